@@ -0,0 +1,74 @@
+'''Micro-benchmark of script_utils.find_uuids against the previous str(val).split("'")
+    implementation using the raw frames in data_files/raw_frames.json
+
+    python -m benchmarks.bench_find_uuids [--number N]
+'''
+import argparse
+import json
+import os
+import timeit
+from functions.script_utils import find_uuids, is_uuid
+
+RAW_FRAMES = os.path.join(os.path.dirname(__file__), 'data_files', 'raw_frames.json')
+
+
+def legacy_find_uuids(val):
+    """find_uuids as it was before the structural extractor"""
+    vals = []
+    if not val:
+        return []
+    elif isinstance(val, str):
+        if is_uuid(val):
+            vals = [val]
+        else:
+            return []
+    else:
+        text = str(val)
+        text_list = [i for i in text. split("'") if len(i) == 36]
+        vals = [i for i in text_list if is_uuid(i)]
+    return vals
+
+
+def legacy_linked_uuids(raw_item):
+    """the way get_linked_items scans a raw frame"""
+    id_list = []
+    for key, val in raw_item.items():
+        if key == 'attachment':
+            continue
+        id_list.extend(legacy_find_uuids(val) or [])
+    return id_list
+
+
+def linked_uuids(raw_item):
+    return find_uuids(raw_item)
+
+
+def load_frames(path=RAW_FRAMES):
+    with open(path) as rf:
+        return json.load(rf)
+
+
+def run(frames, number):
+    results = {}
+    for name, fxn in [('legacy', legacy_linked_uuids), ('structural', linked_uuids)]:
+        secs = timeit.timeit(lambda: [fxn(f) for f in frames], number=number)
+        results[name] = secs / number
+    return results
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(description='Compare uuid extraction from raw frames')
+    parser.add_argument('--number', type=int, default=200,
+                        help="Number of passes over the raw frames to time")
+    args = parser.parse_args()
+    frames = load_frames()
+    for f in frames:
+        assert set(legacy_linked_uuids(f)) == set(linked_uuids(f))
+    results = run(frames, args.number)
+    for name, secs in results.items():
+        print('%-12s %10.3f ms per pass' % (name, secs * 1000))
+    print('speedup      %10.1fx' % (results['legacy'] / results['structural']))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
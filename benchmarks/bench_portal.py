@@ -0,0 +1,349 @@
+'''End to end benchmarks of the scripts that talk to the portal, run against a local
+    fake portal (see fake_portal.py) so they need no network, keys or AWS.
+
+    For each graph size every benchmark gets a freshly generated graph and records its
+    run time, the items it handled per second and the number of requests of each kind it
+    made.  Results are compared to a stored baseline and the run fails if a benchmark
+    makes more requests than before.
+
+    Throughput depends on the machine, so it is also recorded relative to a calibration
+    run of plain item GETs made in the same process.  With --check-throughput the run
+    also fails if that relative speed drops by more than --tolerance.  The runs are short,
+    so this is noisy and is not checked by default.
+
+    python -m benchmarks.bench_portal [--sizes 1k 10k 100k] [--latency 0.002]
+                                      [--only tag_release_freeze ...] [--update-baseline]
+                                      [--check-throughput]
+'''
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from benchmarks.fake_portal import FakePortal, FakeS3Utils, make_graph, fake_es_client, RELEASE_TAG
+from functions import portal_client as pc
+from functions import script_utils as scu
+from functions.cleanup import delete_wfrs, WorkflowRunStash, fetch_pf_associated
+from functions.provenance import ProvenanceWalker
+from functions.deletion_plan import DeletionPlan, execute_plan
+from functions.wfr import find_pairs
+from functions.item_stream import spool_items_by_type, iter_spooled_chunks
+from functions.data_loader import LoadDataSubmitter
+from scripts.tag_release_freeze import tag_release, tag_release_prefetched
+from scripts.load_items_json import load_chunk
+from scripts import item_fetcher
+from scripts.check_release_wfrs import check_release
+
+SIZES = OrderedDict([('1k', 1000), ('10k', 10000), ('100k', 100000)])
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+BENCH_ENV = 'bench'
+
+
+def _sets(graph, fraction):
+    sets = graph.by_type['ExperimentSetReplicate']
+    return sets[:max(2, len(sets) // fraction)]
+
+
+def bench_get_linked_items(portal, graph):
+    for root in _sets(graph, 40):
+        scu.get_linked_items(portal.auth, root, found_items={}, no_children=['Publication', 'Lab', 'User', 'Award'])
+    return len(_sets(graph, 40))
+
+
+def bench_get_linked_items_parallel(portal, graph):
+    for root in _sets(graph, 40):
+        scu.get_linked_items_parallel(portal.auth, root)
+    return len(_sets(graph, 40))
+
+
+def bench_get_linked_items_es(portal, graph):
+    for root in _sets(graph, 40):
+        scu.get_linked_items_parallel(portal.auth, root, use_es=True)
+    return len(_sets(graph, 40))
+
+
+def bench_tag_release_freeze(portal, graph):
+    cnts = tag_release(portal.auth, RELEASE_TAG, dbupdate=True)
+    assert not cnts['errors']
+    return cnts['patched'] + cnts['skipped']
+
+
+def bench_tag_release_freeze_prefetch(portal, graph):
+    cnts = tag_release_prefetched(portal.auth, RELEASE_TAG, dbupdate=True)
+    assert not cnts['errors']
+    return cnts['patched'] + cnts['skipped']
+
+
+def bench_load_items_json(portal, graph):
+    # half the items are already in the database and get patched, half are new and
+    # go to load_data - the existing ones are matched on uuid and the new ones on alias
+    existing = [dict(graph.items[u], description='updated') for u in graph.by_type['Biosample']]
+    new = [{'aliases': ['bench:biosample-%d' % i], 'biosource': b['biosource'], 'lab': b['lab'], 'award': b['award']}
+           for i, b in enumerate(existing)]
+    with tempfile.TemporaryDirectory() as tmp:
+        infile = os.path.join(tmp, 'biosamples.json')
+        with open(infile, 'w') as bf:
+            json.dump(existing + new, bf)
+        spooled = spool_items_by_type(infile, tmp, 'biosample')
+        submitter = LoadDataSubmitter(portal.auth, 'biosample', workers=4, chunk_size=1000)
+        for chunk in iter_spooled_chunks(spooled['biosample'][0], 1000):
+            load_chunk(portal.auth, 'biosample', chunk, ['uuid', 'aliases'], submitter)
+        assert not submitter.finish()
+    return len(existing) + len(new)
+
+
+def _fetch_ids(graph):
+    # half uuids and half accessions
+    files = graph.by_type['FileFastq'][:max(10, len(graph.by_type['FileFastq']) // 4)]
+    return [f if i % 2 else graph.items[f]['accession'] for i, f in enumerate(files)]
+
+
+def bench_item_fetcher(portal, graph):
+    ids = _fetch_ids(graph)
+    for iid, res in item_fetcher.iter_items(portal.auth, ids, ['file_size', 'status']):
+        print(item_fetcher.format_row(iid, res, ['file_size', 'status']))
+    return len(ids)
+
+
+def bench_item_fetcher_threaded(portal, graph):
+    ids = _fetch_ids(graph)
+    for iid, res in item_fetcher.iter_items(portal.auth, ids, ['file_size', 'status'], workers=8):
+        print(item_fetcher.format_row(iid, res, ['file_size', 'status']))
+    return len(ids)
+
+
+def bench_item_fetcher_bulk(portal, graph):
+    ids = _fetch_ids(graph)
+    for iid, res in item_fetcher.iter_items(portal.auth, ids, ['file_size', 'status'], bulk=True):
+        print(item_fetcher.format_row(iid, res, ['file_size', 'status']))
+    return len(ids)
+
+
+def bench_delete_wfrs(portal, graph):
+    files = []
+    for set_uuid in _sets(graph, 10):
+        for exp in graph.items[set_uuid]['experiments_in_set']:
+            files.extend(graph.items[exp]['files'])
+    for file_uuid in files:
+        delete_wfrs(pc.get_metadata(file_uuid, portal.auth), portal.auth, delete=True)
+    return len(files)
+
+
+def bench_delete_wfrs_stash(portal, graph):
+    # the runs come from an expanded store like the 01_find_and_release notebook
+    stash = WorkflowRunStash(graph.frame(u) for u in graph.by_type['WorkflowRunAwsem'])
+    files = []
+    for set_uuid in _sets(graph, 10):
+        for exp in graph.items[set_uuid]['experiments_in_set']:
+            files.extend(graph.items[exp]['files'])
+    for file_uuid in files:
+        delete_wfrs(pc.get_metadata(file_uuid, portal.auth), portal.auth, delete=True, stash=stash)
+    return len(files)
+
+
+def bench_delete_wfrs_plan(portal, graph):
+    # all the files are planned together and the patches sent level by level
+    stash = WorkflowRunStash(graph.frame(u) for u in graph.by_type['WorkflowRunAwsem'])
+    files = []
+    for set_uuid in _sets(graph, 10):
+        for exp in graph.items[set_uuid]['experiments_in_set']:
+            files.extend(graph.items[exp]['files'])
+    plan = DeletionPlan()
+    for file_uuid in files:
+        delete_wfrs(pc.get_metadata(file_uuid, portal.auth), portal.auth, delete=True, stash=stash, plan=plan)
+    assert not execute_plan(plan, portal.auth, workers=8).failed
+    return len(files)
+
+
+def bench_delete_wfrs_dry_run(portal, graph):
+    # the dry run of the same files as check_release_wfrs
+    files = []
+    for set_uuid in _sets(graph, 10):
+        for exp in graph.items[set_uuid]['experiments_in_set']:
+            files.extend(graph.items[exp]['files'])
+    for file_uuid in files:
+        delete_wfrs(pc.get_metadata(file_uuid, portal.auth), portal.auth)
+    return len(files)
+
+
+def bench_check_release_wfrs(portal, graph):
+    results, plan = check_release(portal.auth, _sets(graph, 10), workers=2, chunk_size=100)
+    assert plan and not any(kind == 'error' for r in results for kind, msg in r['notes'])
+    return len(results)
+
+
+def _set_files(graph, set_uuid):
+    files = list(graph.items[set_uuid].get('processed_files') or [])
+    for exp in graph.items[set_uuid]['experiments_in_set']:
+        files.extend(graph.items[exp]['files'])
+    return files
+
+
+def bench_fetch_pf_associated(portal, graph):
+    # each file on its own like the archiving notebooks did
+    files = [f for set_uuid in _sets(graph, 10) for f in _set_files(graph, set_uuid)]
+    for file_uuid in files:
+        fetch_pf_associated(file_uuid, portal.auth)
+    return len(files)
+
+
+def bench_fetch_pf_associated_walker(portal, graph):
+    # all the files of a set walked together - a bulk request for the files and one for their runs
+    files = 0
+    walker = ProvenanceWalker(portal.auth)
+    for set_uuid in _sets(graph, 10):
+        set_files = _set_files(graph, set_uuid)
+        assert walker.walk(set_files)
+        files += len(set_files)
+    return files
+
+
+def bench_find_pairs(portal, graph):
+    pc._env_auths[BENCH_ENV] = portal.auth
+    pc._s3_utils[BENCH_ENV] = FakeS3Utils(portal)
+    sets = _sets(graph, 10)
+    for set_uuid in sets:
+        report = find_pairs(graph.frame(set_uuid, depth=5), BENCH_ENV)
+        assert report[0] and report[1] == 'human'
+    return len(sets)
+
+
+BENCHMARKS = OrderedDict([
+    ('get_linked_items', bench_get_linked_items),
+    ('get_linked_items_parallel', bench_get_linked_items_parallel),
+    ('get_linked_items_es', bench_get_linked_items_es),
+    ('tag_release_freeze', bench_tag_release_freeze),
+    ('tag_release_freeze_prefetch', bench_tag_release_freeze_prefetch),
+    ('load_items_json', bench_load_items_json),
+    ('item_fetcher', bench_item_fetcher),
+    ('item_fetcher_threaded', bench_item_fetcher_threaded),
+    ('item_fetcher_bulk', bench_item_fetcher_bulk),
+    ('delete_wfrs', bench_delete_wfrs),
+    ('delete_wfrs_stash', bench_delete_wfrs_stash),
+    ('delete_wfrs_plan', bench_delete_wfrs_plan),
+    ('delete_wfrs_dry_run', bench_delete_wfrs_dry_run),
+    ('check_release_wfrs', bench_check_release_wfrs),
+    ('fetch_pf_associated', bench_fetch_pf_associated),
+    ('fetch_pf_associated_walker', bench_fetch_pf_associated_walker),
+    ('find_pairs', bench_find_pairs),
+])
+
+
+def bench_calibrate(portal, graph):
+    # plain serial item GETs - what the other benchmarks' speed is measured against
+    items = list(graph.items)[:200]
+    for uuid in items:
+        pc.get_metadata(uuid, portal.auth)
+    return len(items)
+
+
+def calibrate(latency=0.0, seed=0):
+    """Item GETs per second against the fake portal on this machine"""
+    return run_benchmark(bench_calibrate, 1000, latency, seed)['ops_per_sec']
+
+
+def run_benchmark(fxn, n_items, latency=0.0, seed=0):
+    """Run one benchmark against a new fake portal - returns its results"""
+    graph = make_graph(n_items, seed)
+    pc._sessions.clear()
+    pc._es_connections.clear()
+    with FakePortal(graph, latency=latency) as portal, fake_es_client(portal):
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            ops = fxn(portal, graph)
+        seconds = time.perf_counter() - start
+        requests = OrderedDict(('%s %s' % k, v) for k, v in sorted(portal.requests.items()))
+    return OrderedDict([('items', len(graph.items)), ('ops', ops), ('seconds', round(seconds, 4)),
+                        ('ops_per_sec', round(ops / seconds, 2)), ('requests', requests),
+                        ('total_requests', sum(requests.values()))])
+
+
+def compare(results, baseline, tolerance=0.3, check_throughput=False):
+    """Messages for every benchmark that makes more requests than in the baseline and
+        with check_throughput that got slower than tolerance allows relative to the
+        calibration run"""
+    problems = []
+    for size, benches in results.items():
+        for name, res in benches.items():
+            base = baseline.get(size, {}).get(name)
+            if not base:
+                continue
+            if check_throughput and res.get('relative_speed') and base.get('relative_speed'):
+                if res['relative_speed'] < base['relative_speed'] * (1 - tolerance):
+                    problems.append('%s %s: relative speed %.3f is more than %d%% below the baseline %.3f' % (
+                        size, name, res['relative_speed'], tolerance * 100, base['relative_speed']))
+            for kind, count in res['requests'].items():
+                if count > base['requests'].get(kind, 0):
+                    problems.append('%s %s: %d %s requests against %d in the baseline' % (
+                        size, name, count, kind, base['requests'].get(kind, 0)))
+    return problems
+
+
+def print_results(results):
+    print('%-6s %-30s %8s %10s %10s %10s' % ('size', 'benchmark', 'ops', 'seconds', 'ops/s', 'requests'))
+    for size, benches in results.items():
+        for name, res in benches.items():
+            print('%-6s %-30s %8d %10.3f %10.1f %10d' % (
+                size, name, res['ops'], res['seconds'], res['ops_per_sec'], res['total_requests']))
+            print('       ' + ', '.join('%s=%d' % kv for kv in res['requests'].items()))
+
+
+def get_args(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the portal scripts against a local fake portal')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['1k', '10k'],
+                        help="Number of items in the generated graph")
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS),
+                        help="Only run these benchmarks")
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help="Seconds the fake portal waits before answering each request")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=BASELINE,
+                        help="Json file of results to compare to")
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help="Fraction relative speed can drop below the baseline before the run fails")
+    parser.add_argument('--check-throughput', action='store_true',
+                        help="Also fail if a benchmark got slower relative to the calibration run")
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="Write the results of this run to the baseline file")
+    return parser.parse_args(args)
+
+
+def main(args=None):  # pragma: no cover
+    args = get_args(args)
+    names = args.only or list(BENCHMARKS)
+    calibration = calibrate(args.latency, args.seed)
+    print('calibration: %.1f item GETs per second' % calibration)
+    results = OrderedDict()
+    for size in args.sizes:
+        results[size] = OrderedDict()
+        for name in names:
+            res = run_benchmark(BENCHMARKS[name], SIZES[size], args.latency, args.seed)
+            res['relative_speed'] = round(res['ops_per_sec'] / calibration, 4)
+            results[size][name] = res
+    print_results(results)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as bf:
+            baseline = json.load(bf)
+    if args.update_baseline:
+        for size, benches in results.items():
+            baseline.setdefault(size, {}).update(benches)
+        with open(args.baseline, 'w') as bf:
+            json.dump(baseline, bf, indent=2)
+        print('baseline written to', args.baseline)
+        return
+    problems = compare(results, baseline, args.tolerance, args.check_throughput)
+    if problems:
+        print('\nREGRESSIONS')
+        for problem in problems:
+            print(problem)
+        sys.exit(1)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,51 @@
+'''Scaling of the seen id bookkeeping in tag_release_freeze, tagger and get_linked_item_ids
+    Feeds n ids, a third of them repeats, through get_tag_patch with a list and with
+    script_utils.OrderedSet as the seen store and prints the time per id - constant for
+    OrderedSet, growing with n for the list.
+
+    python -m benchmarks.bench_seen_set [--sizes 10000 100000 200000] [--list-max 20000]
+'''
+import io
+import time
+import argparse
+from collections import Counter
+from contextlib import redirect_stdout
+from functions.script_utils import OrderedSet
+from scripts.tag_release_freeze import get_tag_patch
+
+
+def make_items(n):
+    """n released items where every third one repeats an earlier uuid"""
+    return [{'uuid': 'uuid-%d' % (i - i // 3 if i % 3 == 2 else i), 'status': 'released', '@type': ['FileFastq']}
+            for i in range(n)]
+
+
+def run(items, seen):
+    cnts = Counter()
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        for item in items:
+            get_tag_patch(item, 'bench_tag', seen, cnts)
+    return time.perf_counter() - start, list(seen)
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(description='Time seen id tracking with a list and an OrderedSet')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 200000],
+                        help="Numbers of ids to run")
+    parser.add_argument('--list-max', type=int, default=20000,
+                        help="Largest size to also time with a list - it is quadratic")
+    args = parser.parse_args()
+    print('%10s %-12s %10s %12s' % ('ids', 'seen', 'seconds', 'us per id'))
+    for n in args.sizes:
+        items = make_items(n)
+        secs, ordered = run(items, OrderedSet())
+        print('%10d %-12s %10.3f %12.2f' % (n, 'OrderedSet', secs, secs / n * 1e6))
+        if n <= args.list_max:
+            secs, listed = run(items, [])
+            assert listed == ordered
+            print('%10d %-12s %10.3f %12.2f' % (n, 'list', secs, secs / n * 1e6))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
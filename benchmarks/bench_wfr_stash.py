@@ -0,0 +1,62 @@
+'''Scaling of finding the workflow runs of a file in a stash of runs
+    Compares the list scan delete_wfrs used to do for every file with the lookups in a
+    cleanup.WorkflowRunStash (including the one pass to build it) for n files with 4 runs
+    each.
+
+    python -m benchmarks.bench_wfr_stash [--sizes 1000 10000 50000] [--list-max 10000]
+'''
+import time
+import argparse
+from functions.cleanup import WorkflowRunStash
+
+
+def make_runs(n_files):
+    """4 embedded runs per file and the workflow_run_inputs of each file"""
+    runs = []
+    file_runs = {}
+    for f in range(n_files):
+        file_uuid = 'file-%d' % f
+        file_runs[file_uuid] = []
+        for r in range(4):
+            uuid = 'wfr-%d-%d' % (f, r)
+            runs.append({'uuid': uuid, 'display_title': 'md5 0.2.6 run 2020-01-01 10:00:00.000000',
+                         'input_files': [{'value': {'uuid': file_uuid, 'accession': '4DNFI%07d' % f}}]})
+            file_runs[file_uuid].append(uuid)
+    return runs, file_runs
+
+
+def time_list(runs, file_runs):
+    start = time.perf_counter()
+    for wfr_uuids in file_runs.values():
+        wfrs = [i for i in runs if i['uuid'] in wfr_uuids]
+        assert len(wfrs) == len(wfr_uuids)
+    return time.perf_counter() - start
+
+
+def time_stash(runs, file_runs):
+    start = time.perf_counter()
+    stash = WorkflowRunStash(runs)
+    for wfr_uuids in file_runs.values():
+        wfrs = stash.for_uuids(wfr_uuids)
+        assert len(wfrs) == len(wfr_uuids)
+    return time.perf_counter() - start
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(
+        description='Time finding the runs of each file with a list and a WorkflowRunStash')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 50000],
+                        help="Numbers of files to run")
+    parser.add_argument('--list-max', type=int, default=10000,
+                        help="Largest number of files to also time with a list - it is quadratic")
+    args = parser.parse_args()
+    print('%10s %10s %-18s %10s' % ('files', 'runs', 'stash', 'seconds'))
+    for n in args.sizes:
+        runs, file_runs = make_runs(n)
+        print('%10d %10d %-18s %10.3f' % (n, len(runs), 'WorkflowRunStash', time_stash(runs, file_runs)))
+        if n <= args.list_max:
+            print('%10d %10d %-18s %10.3f' % (n, len(runs), 'list', time_list(runs, file_runs)))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
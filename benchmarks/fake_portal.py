@@ -0,0 +1,526 @@
+'''Local stand-in for the portal used by the benchmarks
+    make_graph builds a synthetic graph of experiment sets, experiments, fastq and
+    processed files, quality metrics and workflow runs of roughly the requested size
+    and FakePortal serves it over http on localhost with a configurable latency per request.
+
+    Items can be fetched with frame=raw (links are uuids), frame=object (links are @ids)
+    or the default/embedded frame (linked items as small embedded objects, including the
+    workflow_run_inputs/outputs reverse links of files).  Search supports type, field=value
+    filters on the embedded frame, field= and from/limit paging.  PATCH, POST and the
+    load_data endpoint update the graph.  /health points ES at the portal and
+    fake_es_client returns an in process client that answers get_es_metadata queries.
+
+    Every request is counted by method and endpoint in FakePortal.requests.
+'''
+import json
+import time
+import threading
+from uuid import UUID
+from random import Random
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+from functions.load_order import snake_case, type_name
+
+# type name -> (collection, @type list)
+TYPES = {
+    'Lab': ('labs', ['Lab', 'Item']),
+    'Award': ('awards', ['Award', 'Item']),
+    'User': ('users', ['User', 'Item']),
+    'Organism': ('organisms', ['Organism', 'Item']),
+    'Individual': ('individuals-human', ['IndividualHuman', 'Individual', 'Item']),
+    'Biosource': ('biosources', ['Biosource', 'Item']),
+    'Biosample': ('biosamples', ['Biosample', 'Item']),
+    'Enzyme': ('enzymes', ['Enzyme', 'Item']),
+    'FileFormat': ('file-formats', ['FileFormat', 'Item']),
+    'Workflow': ('workflows', ['Workflow', 'Item']),
+    'OntologyTerm': ('ontology-terms', ['OntologyTerm', 'Item']),
+    'ExperimentSetReplicate': ('experiment-set-replicates', ['ExperimentSetReplicate', 'ExperimentSet', 'Item']),
+    'ExperimentHiC': ('experiments-hi-c', ['ExperimentHiC', 'Experiment', 'Item']),
+    'FileFastq': ('files-fastq', ['FileFastq', 'File', 'Item']),
+    'FileProcessed': ('files-processed', ['FileProcessed', 'File', 'Item']),
+    'QualityMetricFastqc': ('quality-metrics-fastqc', ['QualityMetricFastqc', 'QualityMetric', 'Item']),
+    'WorkflowRunAwsem': ('workflow-runs-awsem', ['WorkflowRunAwsem', 'WorkflowRun', 'Item']),
+    'DataReleaseUpdate': ('data-release-updates', ['DataReleaseUpdate', 'Item']),
+}
+ACCESSION_CODES = {
+    'Biosample': 'BS', 'ExperimentSetReplicate': 'ES', 'ExperimentHiC': 'EX',
+    'FileFastq': 'FI', 'FileProcessed': 'FI',
+}
+REV_LINKS = {'input_files': 'workflow_run_inputs', 'output_files': 'workflow_run_outputs'}
+RELEASE_TAG = 'bench_release'
+ITEMS_PER_SET = 24
+
+
+class Graph(object):
+    """The items of the fake portal keyed by uuid with lookups by accession, alias and @id"""
+
+    def __init__(self):
+        self.items = OrderedDict()
+        self.types = {}
+        self.by_id = {}
+        self.rev = {}
+        self.by_type = {}
+        self._counter = 0
+        self._lock = threading.RLock()
+
+    def _new_accession(self, code):
+        self._counter += 1
+        chars = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+        n = self._counter
+        suffix = ''
+        for _ in range(7):
+            n, r = divmod(n, 36)
+            suffix = chars[r] + suffix
+        return '4DN' + code + suffix
+
+    def add(self, itype, uuid, props):
+        with self._lock:
+            props = dict(props, uuid=uuid)
+            props.setdefault('status', 'released')
+            props.setdefault('last_modified', {'date_modified': '2020-01-01T00:00:00.000000+00:00'})
+            if itype in ACCESSION_CODES and 'accession' not in props:
+                props['accession'] = self._new_accession(ACCESSION_CODES[itype])
+            if uuid in self.items:
+                self._unindex(uuid)
+            self.items[uuid] = props
+            self.types[uuid] = itype
+            self.by_type.setdefault(itype, []).append(uuid)
+            self._index(uuid)
+        return props
+
+    def _ids(self, uuid):
+        props = self.items[uuid]
+        ids = [uuid, self.at_id(uuid)]
+        if props.get('accession'):
+            ids.append(props['accession'])
+        ids.extend(props.get('aliases', []))
+        return ids
+
+    def _index(self, uuid):
+        for iid in self._ids(uuid):
+            self.by_id[iid.strip('/')] = uuid
+        for field, rev_name in REV_LINKS.items():
+            for val in self.items[uuid].get(field, []):
+                self.rev.setdefault((val.get('value'), rev_name), []).append(uuid)
+
+    def _unindex(self, uuid):
+        for iid in self._ids(uuid):
+            self.by_id.pop(iid.strip('/'), None)
+        for field, rev_name in REV_LINKS.items():
+            for val in self.items[uuid].get(field, []):
+                linked = self.rev.get((val.get('value'), rev_name), [])
+                if uuid in linked:
+                    linked.remove(uuid)
+        self.by_type[self.types[uuid]].remove(uuid)
+
+    def resolve(self, iid):
+        return self.by_id.get(iid.strip('/').split('/')[-1]) or self.by_id.get(iid.strip('/'))
+
+    def at_id(self, uuid):
+        props = self.items[uuid]
+        return '/%s/%s/' % (TYPES[self.types[uuid]][0], props.get('accession') or uuid)
+
+    def display_title(self, uuid):
+        props = self.items[uuid]
+        return props.get('display_title') or props.get('accession') or props.get('name') or uuid
+
+    def update(self, uuid, patch, delete_fields=()):
+        with self._lock:
+            props = dict(self.items[uuid])
+            props.update(patch)
+            for field in delete_fields:
+                props.pop(field, None)
+            self._counter += 1
+            props['last_modified'] = {'date_modified': '2021-01-01T00:00:00.%06d+00:00' % (self._counter % 1000000)}
+            itype = self.types[uuid]
+            self._unindex(uuid)
+            del self.items[uuid]
+            return self.add(itype, uuid, props)
+
+    def _link_value(self, val, link_fxn):
+        if isinstance(val, str):
+            return link_fxn(val) if val in self.items else val
+        if isinstance(val, list):
+            return [self._link_value(v, link_fxn) for v in val]
+        if isinstance(val, dict):
+            return {k: self._link_value(v, link_fxn) for k, v in val.items()}
+        return val
+
+    def summary(self, uuid):
+        props = self.items[uuid]
+        summary = {'uuid': uuid, '@id': self.at_id(uuid), '@type': TYPES[self.types[uuid]][1],
+                   'display_title': self.display_title(uuid), 'status': props.get('status')}
+        for field in ('accession', 'name', 'title'):
+            if field in props:
+                summary[field] = props[field]
+        return summary
+
+    def frame(self, uuid, frame='embedded', depth=1):
+        """An item in the raw, object or embedded frame - depth is how many levels of
+            linked items are embedded"""
+        props = self.items[uuid]
+        if frame == 'raw':
+            return dict(props)
+        if frame == 'object':
+            res = self._link_value(props, self.at_id)
+        elif depth <= 1:
+            res = self._link_value(props, self.summary)
+        else:
+            res = self._link_value(props, lambda u: self.frame(u, depth=depth - 1))
+        for rev_name in REV_LINKS.values():
+            linked = self.rev.get((uuid, rev_name))
+            if linked is not None or self.types[uuid] in ('FileFastq', 'FileProcessed'):
+                linked = linked or []
+                if frame == 'object':
+                    res[rev_name] = [self.at_id(u) for u in linked]
+                else:
+                    res[rev_name] = [self.summary(u) for u in linked]
+        res.update({'uuid': uuid, '@id': self.at_id(uuid), '@type': TYPES[self.types[uuid]][1],
+                    'display_title': self.display_title(uuid)})
+        return res
+
+    def es_doc(self, uuid):
+        return {'uuid': uuid, 'item_type': snake_case(self.types[uuid]),
+                'properties': {k: v for k, v in self.items[uuid].items() if k != 'uuid'},
+                'object': self.frame(uuid, 'object'), 'embedded': self.frame(uuid)}
+
+
+def _uuid(rand):
+    return str(UUID(int=rand.getrandbits(128), version=4))
+
+
+def make_graph(n_items, seed=0):
+    """A graph of about n_items items - ITEMS_PER_SET per experiment set plus shared items
+        Every fastq has an old md5 run with a revision that is no longer accepted so that
+        delete_wfrs has something to do"""
+    rand = Random(seed)
+    graph = Graph()
+    lab = _uuid(rand)
+    award = _uuid(rand)
+    user = _uuid(rand)
+    graph.add('User', user, {'title': 'Bench User', 'email': 'bench@example.com'})
+    graph.add('Lab', lab, {'name': 'bench-lab', 'title': 'Bench Lab', 'pi': user})
+    graph.add('Award', award, {'name': 'bench-award', 'pi': user})
+    common = {'lab': lab, 'award': award, 'submitted_by': user}
+    organism = graph.add('Organism', _uuid(rand), {'name': 'human', 'display_title': 'human'})['uuid']
+    individual = graph.add('Individual', _uuid(rand), dict(common, organism=organism))['uuid']
+    biosource = graph.add('Biosource', _uuid(rand), dict(common, individual=individual))['uuid']
+    enzyme = graph.add('Enzyme', _uuid(rand), dict(common, name='MboI', display_title='MboI'))['uuid']
+    fastq_format = graph.add('FileFormat', _uuid(rand), {'file_format': 'fastq', 'display_title': 'fastq'})['uuid']
+    pairs_format = graph.add('FileFormat', _uuid(rand), {'file_format': 'pairs', 'display_title': 'pairs'})['uuid']
+    workflows = {}
+    for name, version in [('md5', '0.2.6'), ('md5', '0.0.1'), ('bwa-mem', '0.2.6')]:
+        workflows[(name, version)] = graph.add('Workflow', _uuid(rand), {
+            'name': name, 'app_version': version, 'title': '%s %s' % (name, version)})['uuid']
+
+    def wfr(name, version, inputs, outputs, day):
+        return graph.add('WorkflowRunAwsem', _uuid(rand), dict(
+            common, workflow=workflows[(name, version)], run_status='complete', status='in review by lab',
+            display_title='%s %s run 2020-01-%02d 10:00:00.000000' % (name, version, day),
+            input_files=[{'workflow_argument_name': 'input_file', 'value': i} for i in inputs],
+            output_files=[{'workflow_argument_name': 'out_file', 'value': o} for o in outputs]))['uuid']
+
+    sets = []
+    for _ in range(max(1, n_items // ITEMS_PER_SET)):
+        biosample = graph.add('Biosample', _uuid(rand), dict(common, biosource=[biosource]))['uuid']
+        exps = []
+        for _ in range(2):
+            fastqs = [_uuid(rand), _uuid(rand)]
+            for pair, fq in enumerate(fastqs):
+                qc = graph.add('QualityMetricFastqc', _uuid(rand), dict(common, overall_quality_status='PASS'))['uuid']
+                graph.add('FileFastq', fq, dict(
+                    common, file_format=fastq_format, paired_end=str(pair + 1), file_size=rand.randint(1, 10) * 10 ** 9,
+                    instrument='Illumina HiSeq 2500', quality_metric=qc,
+                    related_files=[{'relationship_type': 'paired with', 'file': fastqs[1 - pair]}]))
+                graph.items[fq]['filename'] = graph.items[fq]['accession'] + '.fastq.gz'
+                graph.items[fq]['upload_key'] = '%s/%s.fastq.gz' % (fq, graph.items[fq]['accession'])
+                wfr('md5', '0.0.1', [fq], [], 1)
+                wfr('md5', '0.2.6', [fq], [], 2)
+            pf = graph.add('FileProcessed', _uuid(rand), dict(common, file_format=pairs_format))['uuid']
+            wfr('bwa-mem', '0.2.6', fastqs, [pf], 3)
+            exps.append(graph.add('ExperimentHiC', _uuid(rand), dict(
+                common, biosample=biosample, files=fastqs, processed_files=[pf], digestion_enzyme=enzyme,
+                experiment_type='in situ Hi-C'))['uuid'])
+        sets.append(graph.add('ExperimentSetReplicate', _uuid(rand), dict(
+            common, experiments_in_set=exps, experimentset_type='replicate',
+            replicate_exps=[{'replicate_exp': e, 'bio_rep_no': 1, 'tec_rep_no': i + 1}
+                            for i, e in enumerate(exps)]))['uuid'])
+    # the release covers a tenth of the sets
+    graph.add('DataReleaseUpdate', _uuid(rand), dict(
+        common, update_tag=RELEASE_TAG, update_items=[{'primary_id': s} for s in sets[:max(1, len(sets) // 10)]]))
+    return graph
+
+
+def _get_path(val, parts):
+    """values at a dotted path through dicts and lists"""
+    if not parts:
+        return val if isinstance(val, list) else [val]
+    if isinstance(val, list):
+        return [v for item in val for v in _get_path(item, parts)]
+    if isinstance(val, dict) and parts[0] in val:
+        return _get_path(val[parts[0]], parts[1:])
+    return []
+
+
+def _select_sources(doc, sources):
+    """The parts of an ES document named by sources eg. properties.* embedded.@type"""
+    if not sources:
+        return doc
+    res = {}
+    for source in sources:
+        _merge_source(doc, source.split('.'), res)
+    return res
+
+
+def _merge_source(val, parts, into):
+    part, rest = parts[0], parts[1:]
+    keys = list(val.keys()) if part == '*' else [part]
+    for key in keys:
+        if key not in val:
+            continue
+        sub = val[key]
+        if not rest or rest == ['*']:
+            into[key] = sub
+        elif isinstance(sub, dict):
+            _merge_source(sub, rest, into.setdefault(key, {}))
+        elif isinstance(sub, list):
+            target = into.setdefault(key, [{} for _ in sub])
+            for item, t in zip(sub, target):
+                if isinstance(item, dict):
+                    _merge_source(item, rest, t)
+
+
+class FakeEsClient(object):
+    """Answers the queries made by ff_utils.get_es_metadata from the graph"""
+
+    def __init__(self, portal):
+        self.portal = portal
+
+    def search(self, index=None, body=None, size=10, from_=0, **kwargs):
+        self.portal.count_request('ES', 'es')
+        must = body['query']['bool']['must']
+        uuids = must[0]['terms']['_id']
+        graph = self.portal.graph
+        hits = []
+        for uuid in sorted(set(uuids), reverse=True):
+            if uuid not in graph.items:
+                continue
+            doc = graph.es_doc(uuid)
+            if all(self._matches(doc, term['terms']) for term in must[1:]):
+                hits.append({'_id': uuid, '_source': _select_sources(doc, body.get('_source'))})
+        return {'hits': {'total': {'value': len(hits)}, 'hits': hits[from_:from_ + size]}}
+
+    @staticmethod
+    def _matches(doc, terms):
+        [(path, values)] = terms.items()
+        parts = path.split('.')
+        if parts[-1] == 'raw':
+            parts = parts[:-1]
+        return bool(set(str(v) for v in _get_path(doc, parts)) & set(values))
+
+
+class FakeS3Utils(object):
+    """Just enough of s3Utils for find_pairs - every upload_key in the graph exists"""
+    raw_file_bucket = 'bench-raw-files'
+    outfile_bucket = 'bench-wfoutput'
+
+    def __init__(self, portal):
+        self.portal = portal
+
+    def does_key_exist(self, key, bucket=None, print_error=True):
+        self.portal.count_request('HEAD', 's3')
+        time.sleep(self.portal.latency)
+        return {'ContentLength': 1} if key.split('/')[0] in self.portal.graph.items else False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes - without this every keep alive response waits on a delayed ack
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+
+    def _handle(self, method):
+        portal = self.server.portal
+        url = urlparse(self.path)
+        path = url.path.strip('/')
+        params = parse_qsl(url.query, keep_blank_values=True)
+        endpoint = path.split('/')[0] if path else ''
+        portal.count_request(method, endpoint if endpoint in portal.endpoints else 'item')
+        if portal.latency:
+            time.sleep(portal.latency)
+        body = self._body() if method in ('POST', 'PATCH') else None
+        try:
+            status, res = portal.handle(method, path, params, body)
+        except Exception as e:  # pragma: no cover
+            status, res = 500, {'status': 'error', 'description': repr(e)}
+        self._send(status, res)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_POST(self):
+        self._handle('POST')
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakePortal(object):
+    """Serves a Graph on http://127.0.0.1:<port> - use as a context manager or start/stop"""
+    endpoints = ('search', 'profiles', 'health', 'load_data')
+
+    def __init__(self, graph, latency=0.0, port=0):
+        self.graph = graph
+        self.latency = latency
+        self.requests = Counter()
+        self._count_lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.portal = self
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    @property
+    def auth(self):
+        return {'key': 'benchkey', 'secret': 'benchsecret', 'server': self.url + '/'}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count_request(self, method, endpoint):
+        with self._count_lock:
+            self.requests[(method, endpoint)] += 1
+
+    def reset_counts(self):
+        with self._count_lock:
+            self.requests.clear()
+
+    def handle(self, method, path, params, body):
+        graph = self.graph
+        if method == 'GET' and path == 'health':
+            return 200, {'namespace': 'bench', 'elasticsearch': self.url + '/es'}
+        if method == 'GET' and path.startswith('profiles'):
+            return 200, self.profiles(path)
+        if method == 'GET' and path.startswith('search'):
+            return self.search(params)
+        if method == 'POST' and path == 'load_data':
+            for itype, items in body['store'].items():
+                for item in items:
+                    graph.add(type_name(itype), item['uuid'], item)
+            return 200, {'status': 'success'}
+        if method == 'POST':
+            itype = [t for t, (coll, _) in TYPES.items() if coll == path]
+            if not itype:
+                return 404, {'status': 'error', 'description': 'no collection %s' % path}
+            uuid = body.get('uuid') or str(UUID(int=len(graph.items) + 1, version=4))
+            graph.add(itype[0], uuid, body)
+            return 201, {'status': 'success', '@graph': [graph.frame(uuid, 'object')]}
+        uuid = graph.resolve(path)
+        if uuid is None:
+            return 404, {'status': 'error', '@type': ['HTTPNotFound'], 'description': 'not found %s' % path}
+        if method == 'PATCH':
+            delete_fields = [f for k, v in params if k == 'delete_fields' for f in v.split(',')]
+            graph.update(uuid, body, delete_fields)
+            return 200, {'status': 'success', '@graph': [graph.frame(uuid, 'object')]}
+        frame = dict(params).get('frame', 'embedded')
+        if frame in ('raw', 'object'):
+            return 200, graph.frame(uuid, frame)
+        # items embed their linked items and the summaries of the items those link to
+        return 200, graph.frame(uuid, depth=2)
+
+    def profiles(self, path):
+        name = path.split('/')[-1].replace('.json', '')
+        schema = {'identifyingProperties': ['uuid', 'aliases'], 'properties': {}}
+        if name:
+            return schema
+        return {t: schema for t in TYPES}
+
+    def search(self, params):
+        graph = self.graph
+        types = [v for k, v in params if k == 'type']
+        fields = [v for k, v in params if k == 'field']
+        start = int(dict(params).get('from', 0))
+        limit = dict(params).get('limit', '25')
+        filters = {}
+        for k, v in params:
+            # a value of * matches any value eg. status=* for deleted items too
+            if k not in ('type', 'field', 'from', 'limit', 'sort', 'frame') and v != '*':
+                filters.setdefault(k, set()).add(v)
+        candidates = []
+        if filters.keys() & {'accession', 'aliases'}:
+            ids = filters.get('accession', set()) | filters.get('aliases', set())
+            candidates = [u for u in (graph.resolve(i) for i in ids) if u]
+        elif types and types != ['Item']:
+            for itype, (coll, at_types) in TYPES.items():
+                if any(t in at_types for t in types):
+                    candidates.extend(graph.by_type.get(itype, []))
+        else:
+            candidates = list(graph.items)
+        hits = []
+        for uuid in candidates:
+            if filters:
+                if 'uuid' in filters and uuid not in filters['uuid']:
+                    continue
+                doc = graph.frame(uuid)
+                if not all(set(str(v) for v in _get_path(doc, k.split('.'))) & vals
+                           for k, vals in filters.items() if k != 'uuid'):
+                    continue
+            hits.append(uuid)
+        end = len(hits) if limit == 'all' else start + int(limit)
+        page = []
+        for uuid in hits[start:end]:
+            doc = graph.frame(uuid)
+            if fields:
+                doc = {k: v for k, v in doc.items() if k in fields or k.split('.')[0] in
+                       [f.split('.')[0] for f in fields] or k in ('@id', '@type', 'uuid')}
+            page.append(doc)
+        if not page:
+            return 404, {'@graph': [], 'total': len(hits), 'notification': 'No results found'}
+        return 200, {'@graph': page, 'total': len(hits)}
+
+
+@contextmanager
+def fake_es_client(portal):
+    """Make get_es_metadata use a FakeEsClient for the portal while in the with block"""
+    from dcicutils import es_utils
+    original = es_utils.create_es_client
+    es_utils.create_es_client = lambda *args, **kwargs: FakeEsClient(portal)
+    try:
+        yield
+    finally:
+        es_utils.create_es_client = original
@@ -1,5 +1,10 @@
-from dcicutils import ff_utils
+import re
+from functions import portal_client as pc
 from datetime import datetime
+from functools import lru_cache
+from collections import OrderedDict, namedtuple
+from functions.deletion_plan import DeletionPlan, DeletionFailed, run_plan  # noqa: F401
+from functions.provenance import ProvenanceWalker
 
 # accepted workflows
 # workflow name, accepted revision numbers (0 if none), accetable run time (hours)
@@ -56,76 +61,126 @@ workflow_details = [
 
 workflow_names = [i[0] for i in workflow_details]
 
+# the table above by workflow name - revisions are a set and order is the place in the table
+# which is the order delete_wfrs checks the workflows of a file in
+WorkflowRule = namedtuple('WorkflowRule', ['order', 'revisions', 'run_time'])
+WORKFLOW_RULES = OrderedDict((name, WorkflowRule(i, frozenset(revs), run_time))
+                             for i, (name, revs, run_time) in enumerate(workflow_details))
 
-def fetch_pf_associated(pf_id_or_dict, my_key):
+# 'md5 0.2.6 run 2020-01-01 10:00:00.123456' - some older titles have 'run on'
+WFR_TITLE_RE = re.compile(r'^\s*(\S+) (\S+)\s* run (?:on )?'
+                          r'(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?\s*$')
+
+
+# md5 runs of files that aren't inputs of any run (file_microscopy ...) are searched for
+MD5_RUNS_SEARCH = '/search/?type=WorkflowRun&workflow.title=md5+0.2.6&workflow.title=md5+0.0.4'
+
+
+def is_md5_search_run(wfr):
+    """True for the runs MD5_RUNS_SEARCH finds - for picking them out of a stash"""
+    return wfr.get('display_title', '').split(' run ')[0].strip() in ('md5 0.2.6', 'md5 0.0.4')
+
+
+def wfr_name(wfr):
+    """The workflow name from the display title of a run eg. md5 for 'md5 0.2.6 run 2020-01-01 ...'"""
+    wfr_type = wfr.get('display_title', '').split(' run ')[0].strip()
+    parts = wfr_type.split(' ')
+    return parts[0] if len(parts) == 2 else wfr_type
+
+
+class WorkflowRunStash(object):
+    """Workflow runs in the embedded frame indexed by uuid, by the uuid and accession of
+        their input files and by workflow name - built in one pass so looking up the runs
+        of a file does not mean scanning all of them"""
+
+    def __init__(self, wfrs=()):
+        self.by_uuid = OrderedDict()
+        self.by_input = {}
+        self.by_workflow = {}
+        for wfr in wfrs:
+            self.add(wfr)
+
+    def add(self, wfr):
+        if wfr['uuid'] in self.by_uuid:
+            return
+        self.by_uuid[wfr['uuid']] = wfr
+        for input_file in wfr.get('input_files') or []:
+            val = input_file.get('value')
+            ids = [val.get('uuid'), val.get('accession')] if isinstance(val, dict) else [val]
+            for file_id in set(i for i in ids if i):
+                self.by_input.setdefault(file_id, []).append(wfr)
+        self.by_workflow.setdefault(wfr_name(wfr), []).append(wfr)
+
+    def __len__(self):
+        return len(self.by_uuid)
+
+    def __iter__(self):
+        return iter(self.by_uuid.values())
+
+    def __contains__(self, uuid):
+        return uuid in self.by_uuid
+
+    def get(self, uuid):
+        return self.by_uuid.get(uuid)
+
+    def for_uuids(self, uuids):
+        """The runs for the uuids that are in the stash"""
+        return [self.by_uuid[u] for u in OrderedDict.fromkeys(uuids) if u in self.by_uuid]
+
+    def for_input(self, file_id):
+        """Runs with the file (uuid or accession) as an input"""
+        return list(self.by_input.get(file_id, []))
+
+    def for_workflow(self, name):
+        return list(self.by_workflow.get(name, []))
+
+
+def fetch_pf_associated(pf_id_or_dict, my_key, walker=None):
     """Given a file accession, find all related items
     1) QCs
     2) wfr producing the file, and other outputs from the same wfr
     3) wfrs this file went as input, and all files/wfrs/qcs around it
-    The returned list might contain duplicates, uuids and display titles for qcs"""
-    file_as_list = []
+    Pass the same ProvenanceWalker for many files so shared runs are only fetched once
+    The returned list has no duplicates"""
+    walker = ProvenanceWalker(my_key) if walker is None else walker
     if isinstance(pf_id_or_dict, dict):
-        pf_info = pf_id_or_dict
-    else:
-        pf_info = ff_utils.get_metadata(pf_id_or_dict, my_key)
-    file_as_list.append(pf_info['uuid'])
-    if pf_info.get('quality_metric'):
-        file_as_list.append(pf_info['quality_metric']['uuid'])
-    inp_wfrs = pf_info.get('workflow_run_inputs', [])
-    for inp_wfr in inp_wfrs:
-        file_as_list.extend(fetch_wfr_associated(inp_wfr['uuid'], my_key))
-    out_wfrs = pf_info.get('workflow_run_outputs', [])
-    for out_wfr in out_wfrs:
-        file_as_list.extend(fetch_wfr_associated(out_wfr['uuid'], my_key))
-    return list(set(file_as_list))
-
-
-def fetch_wfr_associated(wfr_id_or_resp, my_key):
+        pf_id_or_dict = walker.add_file(pf_id_or_dict)
+    return walker.walk([pf_id_or_dict]).uuids()
+
+
+def fetch_wfr_associated(wfr_id_or_resp, my_key, walker=None):
     """Given wfr_uuid, find associated output files and qcs"""
-    wfr_as_list = []
+    walker = ProvenanceWalker(my_key) if walker is None else walker
     if isinstance(wfr_id_or_resp, dict):
-        wfr_info = wfr_id_or_resp
-    else:
-        wfr_info = ff_utils.get_metadata(wfr_id_or_resp, my_key)
-    wfr_as_list.append(wfr_info['uuid'])
-    if wfr_info.get('output_files'):
-        for o in wfr_info['output_files']:
-            if o.get('value'):
-                wfr_as_list.append(o['value']['uuid'])
-            elif o.get('value_qc'):
-                wfr_as_list.append(o['value_qc']['uuid'])
-    if wfr_info.get('output_quality_metrics'):
-        for qc in wfr_info['output_quality_metrics']:
-            if qc.get('value'):
-                wfr_as_list.append(qc['value']['uuid'])
-    if wfr_info.get('quality_metric'):
-        wfr_as_list.append(wfr_info['quality_metric']['uuid'])
-    return wfr_as_list
+        wfr_id_or_resp = walker.add_run(wfr_id_or_resp)
+    return walker.walk_runs([wfr_id_or_resp]).uuids()
+
+
+@lru_cache(maxsize=100000)
+def parse_wfr_title(title):
+    """The workflow name, version and start time from the display title of a run
+        None for titles without a version like the old style awsem runs"""
+    match = WFR_TITLE_RE.match(title)
+    if not match:
+        return None
+    name, version = match.group(1), match.group(2)
+    fraction = match.group(9) or ''
+    wfr_time = datetime(*[int(i) for i in match.group(3, 4, 5, 6, 7, 8)], microsecond=int(fraction.ljust(6, '0')))
+    return name, version, wfr_time
 
 
 def get_wfr_report(wfrs):
     # for a given list of wfrs, produce a simpler report
     wfr_report = []
+    now = datetime.utcnow()
     for wfr_data in wfrs:
-        wfr_rep = {}
         """For a given workflow_run item, grabs details, uuid, run_status, wfr name, date, and run time"""
-        wfr_type, time_info = wfr_data['display_title'].split(' run ')
+        parsed = parse_wfr_title(wfr_data['display_title'])
         # skip all style awsem runs
-        try:
-            wfr_type_base, wfr_version = wfr_type.strip().split(' ')
-        except:
+        if parsed is None:
             continue
-        time_info = time_info.strip('on').strip()
-        try:
-            wfr_time = datetime.strptime(time_info, '%Y-%m-%d %H:%M:%S.%f')
-        except ValueError:
-            wfr_time = datetime.strptime(time_info, '%Y-%m-%d %H:%M:%S')
-        run_hours = (datetime.utcnow() - wfr_time).total_seconds() / 3600
-        # try:
-        #     wfr_time = datetime.strptime(wfr_data['date_created'], '%Y-%m-%dT%H:%M:%S.%f+00:00')
-        # except ValueError:  # if it was exact second, no fraction is in value
-        #     print("wfr time bingo", wfr_uuid)
-        #     wfr_time = datetime.strptime(wfr_data['date_created'], '%Y-%m-%dT%H:%M:%S+00:00')
+        wfr_type_base, wfr_version, wfr_time = parsed
+        run_hours = (now - wfr_time).total_seconds() / 3600
         output_files = wfr_data.get('output_files', None)
         output_uuids = []
         qc_uuids = []
@@ -143,8 +198,8 @@ def get_wfr_report(wfrs):
 
         wfr_rep = {'wfr_uuid': wfr_data['uuid'],
                    'wfr_status': wfr_data['run_status'],
-                   'wfr_name': wfr_type_base.strip(),
-                   'wfr_version': wfr_version.strip(),
+                   'wfr_name': wfr_type_base,
+                   'wfr_version': wfr_version,
                    'wfr_date': wfr_time,
                    'run_time': run_hours,
                    'status': wfr_data['status'],
@@ -155,9 +210,62 @@ def get_wfr_report(wfrs):
     return wfr_report
 
 
-def delete_wfrs(file_resp, my_key, delete=False, stash=None):
+def group_wfr_report(wfr_report):
+    """The runs of a get_wfr_report by workflow name - each list stays in date order"""
+    groups = OrderedDict()
+    for wfr_rep in wfr_report:
+        groups.setdefault(wfr_rep['wfr_name'], []).append(wfr_rep)
+    return groups
+
+
+def plan_run_deletion(plan, wfr_to_del, reason):
+    """Add a run from get_wfr_report, its output files and its qcs to a DeletionPlan"""
+    wfr_uuid = wfr_to_del['wfr_uuid']
+    plan.add(wfr_uuid, {'description': "This workflow run is deleted", 'status': "deleted"}, reason=reason)
+    # delete output files of the deleted workflow run
+    for out_file in wfr_to_del['outputs'] or []:
+        plan.delete(out_file, after=[wfr_uuid], reason='output of deleted run')
+    for out_qc in wfr_to_del.get('qcs') or []:
+        plan.delete(out_qc, after=[wfr_uuid], reason='qc of deleted run')
+
+
+def delete_wfrs(file_resp, my_key, delete=False, stash=None, plan=None, workers=8):
     # file_resp in embedded frame
-    # stash: all related wfrs for file_resp
+    # stash: all related wfrs for file_resp - a WorkflowRunStash or a list of runs
+    # make the stash once for many files as a list is indexed on every call
+    # for files that are not an input of any run it should have the md5 runs that
+    # MD5_RUNS_SEARCH finds for them as they are looked for there instead
+    # plan: a DeletionPlan to add the patches to - they are then sent by the caller with
+    # execute_plan, otherwise with delete=True they are sent here with workers threads and
+    # DeletionFailed is raised if any fail - its summary has what was and wasn't patched
+    run_now = plan is None
+    if run_now or not delete:
+        plan_here = DeletionPlan()
+    else:
+        plan_here = plan
+    planned = plan_wfr_deletions(file_resp, my_key, plan_here, stash)
+    if not delete:
+        return None if planned is None else []
+    if run_now and plan_here:
+        run_plan(plan_here, my_key, workers=workers)
+    return planned
+
+
+def note(notes, kind, *msg):
+    """Print a delete_wfrs message or if notes is a list add (kind, message) to it
+    kind is one of delete, running, skipped or flagged"""
+    if notes is None:
+        print(*msg)
+    else:
+        notes.append((kind, ' '.join(str(m) for m in msg)))
+
+
+def plan_wfr_deletions(file_resp, my_key, plan, stash=None, notes=None):
+    """The delete_wfrs checks - the runs (and their outputs and qcs) that should be deleted are
+    added to plan and the run uuids returned - None if the file was not checked
+    notes: a list to collect the messages in instead of printing them"""
+    if stash is not None and not isinstance(stash, WorkflowRunStash):
+        stash = WorkflowRunStash(stash)
     deleted_wfrs = []
     wfr_report = []
     file_type = file_resp['@id'].split('/')[1]
@@ -175,7 +283,7 @@ def delete_wfrs(file_resp, my_key, delete=False, stash=None):
         output_wfr = output_wfrs[0]
         wfr_type, time_info = output_wfr['display_title'].split(' run ')
         if wfr_type == 'encode-chipseq-aln-ctl 1.1.1':
-            print('skipping control file for wfr check', file_resp['accession'])
+            note(notes, 'skipped', 'skipping control file for wfr check', file_resp['accession'])
             return
 
     wfr_uuids = [i['uuid'] for i in file_resp.get('workflow_run_inputs')]
@@ -183,29 +291,29 @@ def delete_wfrs(file_resp, my_key, delete=False, stash=None):
     if wfr_uuids:
         # fetch them from stash
         if stash:
-            wfrs = [i for i in stash if i['uuid'] in wfr_uuids]
-            assert len(wfrs) == len(wfr_uuids)
+            wfrs = stash.for_uuids(wfr_uuids)
+            assert len(wfrs) == len(set(wfr_uuids))
         # if no stash, get from database
         else:
-            wfrs = [i['embedded'] for i in ff_utils.get_es_metadata(wfr_uuids, sources=['embedded.*'], key=my_key)]
+            wfrs = [i['embedded'] for i in pc.get_es_metadata(wfr_uuids, sources=['embedded.*'], key=my_key)]
     # look for md5s on files without wfr_run_output (file_microscopy ...)
     else:
         if file_type not in ['files-fastq', 'files-processed']:
-            wfrs_url = ('/search/?type=WorkflowRun&type=WorkflowRun&workflow.title=md5+0.2.6&workflow.title=md5+0.0.4'
-                        '&input_files.value.accession=') + file_resp['accession']
-            wfrs = ff_utils.search_metadata(wfrs_url, key=my_key)
+            if stash is not None:
+                wfrs = [w for w in stash.for_input(file_resp['accession']) if is_md5_search_run(w)]
+            else:
+                wfrs = pc.search_metadata(MD5_RUNS_SEARCH + '&input_files.value.accession=' + file_resp['accession'],
+                                          key=my_key)
     # Skip sbg and file provenance
     wfrs = [i for i in wfrs if not i['@id'].startswith('/workflow-runs-sbg/')]
     wfrs = [i for i in wfrs if not i['display_title'].startswith('File Provenance Tracking')]
     # CLEAN UP IF FILE IS DELETED
     if file_resp['status'] == 'deleted':
         if file_resp.get('quality_metric'):
-            if delete:
-                qc_uuid = file_resp['quality_metric']['uuid']
-                ff_utils.delete_field(file_resp, 'quality_metric', key=my_key)
-                # delete quality metrics object
-                patch_data = {'status': "deleted"}
-                ff_utils.patch_metadata(patch_data, obj_id=qc_uuid, key=my_key)
+            qc_uuid = file_resp['quality_metric']['uuid']
+            plan.add(file_resp['uuid'], delete_fields=['quality_metric'], reason='deleted file')
+            # delete quality metrics object
+            plan.delete(qc_uuid, after=[file_resp['uuid']], reason='qc of deleted file')
         # delete all workflows for deleted files
         if not wfrs:
             return
@@ -213,32 +321,24 @@ def delete_wfrs(file_resp, my_key, delete=False, stash=None):
             wfr_report = get_wfr_report(wfrs)
             for wfr_to_del in wfr_report:
                 if wfr_to_del['status'] != 'deleted':
-                    if wfr_to_del['wfr_name'] not in workflow_names:
-                        print('Unlisted Workflow', wfr_to_del['wfr_name'], 'deleted file workflow',
-                              wfr_to_del['wfr_uuid'], file_resp['accession'])
+                    if wfr_to_del['wfr_name'] not in WORKFLOW_RULES:
+                        note(notes, 'flagged', 'Unlisted Workflow', wfr_to_del['wfr_name'], 'deleted file workflow',
+                             wfr_to_del['wfr_uuid'], file_resp['accession'])
                     ####################################################
                     # TEMPORARY PIECE##################################
                     if wfr_to_del['status'] == 'released to project':
-                        print('saved from deletion', wfr_to_del['wfr_name'], 'deleted file workflow',
-                              wfr_to_del['wfr_uuid'], file_resp['accession'])
+                        note(notes, 'skipped', 'saved from deletion', wfr_to_del['wfr_name'], 'deleted file workflow',
+                             wfr_to_del['wfr_uuid'], file_resp['accession'])
                         return
                     if wfr_to_del['status'] == 'released':
-                        print('delete released!!!!!', wfr_to_del['wfr_name'], 'deleted file workflow',
-                              wfr_to_del['wfr_uuid'], file_resp['accession'])
+                        note(notes, 'flagged', 'delete released!!!!!', wfr_to_del['wfr_name'], 'deleted file workflow',
+                             wfr_to_del['wfr_uuid'], file_resp['accession'])
                         return
                     #####################################################
-                    print(wfr_to_del['wfr_name'], 'deleted file workflow', wfr_to_del['wfr_uuid'], file_resp['accession'])
-                    if delete:
-                        patch_data = {'description': "This workflow run is deleted", 'status': "deleted"}
-                        deleted_wfrs.append(wfr_to_del['wfr_uuid'])
-                        ff_utils.patch_metadata(patch_data, obj_id=wfr_to_del['wfr_uuid'], key=my_key)
-                        # delete output files of the deleted workflow run
-                        if wfr_to_del['outputs']:
-                            for out_file in wfr_to_del['outputs']:
-                                ff_utils.patch_metadata({'status': "deleted"}, obj_id=out_file, key=my_key)
-                        if wfr_to_del.get('qcs'):
-                            for out_qc in wfr_to_del['qcs']:
-                                ff_utils.patch_metadata({'status': "deleted"}, obj_id=out_qc, key=my_key)
+                    note(notes, 'delete', wfr_to_del['wfr_name'], 'deleted file workflow',
+                         wfr_to_del['wfr_uuid'], file_resp['accession'])
+                    deleted_wfrs.append(wfr_to_del['wfr_uuid'])
+                    plan_run_deletion(plan, wfr_to_del, 'deleted file workflow')
 
     else:
         # get a report on all workflow_runs
@@ -248,21 +348,24 @@ def delete_wfrs(file_resp, my_key, delete=False, stash=None):
             wfr_report = get_wfr_report(wfrs)
             # printTable(wfr_report, ['wfr_name', 'run_time', 'wfr_version', 'run_time', 'wfr_status'])
             # check if any unlisted wfr in report
-            my_wfr_names = [i['wfr_name'] for i in wfr_report]
-            unlisted = [x for x in my_wfr_names if x not in workflow_names]
+            by_name = group_wfr_report(wfr_report)
+            unlisted = [i['wfr_name'] for i in wfr_report if i['wfr_name'] not in WORKFLOW_RULES]
             # report the unlisted ones
             if unlisted:
-                print('Unlisted Workflow', unlisted, 'skipped in', file_resp['accession'])
-            for wf_name, accepted_rev, accepted_run_time in workflow_details:
+                note(notes, 'flagged', 'Unlisted Workflow', unlisted, 'skipped in', file_resp['accession'])
+            listed = sorted((i for i in by_name if i in WORKFLOW_RULES), key=lambda i: WORKFLOW_RULES[i].order)
+            for wf_name in listed:
                 # for each type of worklow make a list of old ones, and patch status and description
-                sub_wfrs = [i for i in wfr_report if i['wfr_name'] == wf_name]
+                accepted_rev, accepted_run_time = WORKFLOW_RULES[wf_name].revisions, WORKFLOW_RULES[wf_name].run_time
+                sub_wfrs = by_name[wf_name]
                 if sub_wfrs:
                     active_wfr = sub_wfrs[-1]
                     old_wfrs = sub_wfrs[:-1]
                     # check the status of the most recent workflow
                     if active_wfr['wfr_status'] != 'complete':
-                        if (active_wfr['wfr_status'] in ['running', 'started'] and active_wfr['run_time'] < accepted_run_time):
-                            print(wf_name, 'still running for', file_resp['accession'])
+                        if (active_wfr['wfr_status'] in ['running', 'started'] and
+                                active_wfr['run_time'] < accepted_run_time):
+                            note(notes, 'running', wf_name, 'still running for', file_resp['accession'])
                         else:
                             old_wfrs.append(active_wfr)
                     elif active_wfr['wfr_version'] not in accepted_rev:
@@ -271,32 +374,23 @@ def delete_wfrs(file_resp, my_key, delete=False, stash=None):
                         for wfr_to_del in old_wfrs:
                             if wfr_to_del['status'] != 'deleted':
                                 if wfr_to_del['status'] in ['archived', 'replaced']:
-                                    print(wfr_to_del['wfr_name'], wfr_to_del['status'], ' wfr found, skipping ',
-                                          wfr_to_del['wfr_uuid'], file_resp['accession'])
+                                    note(notes, 'skipped', wfr_to_del['wfr_name'], wfr_to_del['status'],
+                                         ' wfr found, skipping ', wfr_to_del['wfr_uuid'], file_resp['accession'])
                                     continue
                                 ####################################################
                                 # TEMPORARY PIECE
                                 if wfr_to_del['status'] == 'released to project':
-                                    print('saved from deletion', wfr_to_del['wfr_name'], 'old style or dub',
-                                          wfr_to_del['wfr_uuid'], file_resp['accession'])
+                                    note(notes, 'skipped', 'saved from deletion', wfr_to_del['wfr_name'],
+                                         'old style or dub', wfr_to_del['wfr_uuid'], file_resp['accession'])
                                     continue
                                 if wfr_to_del['status'] == 'released':
-                                    print('delete released????', wfr_to_del['wfr_name'], 'old style or dub',
-                                          wfr_to_del['wfr_uuid'], file_resp['accession'])
+                                    note(notes, 'flagged', 'delete released????', wfr_to_del['wfr_name'],
+                                         'old style or dub', wfr_to_del['wfr_uuid'], file_resp['accession'])
                                     continue
                                 ####################################################
 
-                                print(wfr_to_del['wfr_name'], 'old style or dub',
-                                      wfr_to_del['wfr_uuid'], file_resp['accession'])
-                                if delete:
-                                    patch_data = {'description': "This workflow run is deleted", 'status': "deleted"}
-                                    deleted_wfrs.append(wfr_to_del['wfr_uuid'])
-                                    ff_utils.patch_metadata(patch_data, obj_id=wfr_to_del['wfr_uuid'], key=my_key)
-                                    # delete output files of the deleted workflow run
-                                    if wfr_to_del['outputs']:
-                                        for out_file in wfr_to_del['outputs']:
-                                            ff_utils.patch_metadata({'status': "deleted"}, obj_id=out_file, key=my_key)
-                                    if wfr_to_del.get('qcs'):
-                                        for out_qc in wfr_to_del['qcs']:
-                                            ff_utils.patch_metadata({'status': "deleted"}, obj_id=out_qc, key=my_key)
+                                note(notes, 'delete', wfr_to_del['wfr_name'], 'old style or dub',
+                                     wfr_to_del['wfr_uuid'], file_resp['accession'])
+                                deleted_wfrs.append(wfr_to_del['wfr_uuid'])
+                                plan_run_deletion(plan, wfr_to_del, 'old style or dub')
     return deleted_wfrs
@@ -0,0 +1,76 @@
+'''Post items to the load_data endpoint
+    Chunks of items of one type do not depend on each other so they can be posted at
+    the same time, but item types still need to be loaded in load order (see load_order) -
+    use one LoadDataSubmitter per type and finish it before starting on the next type.
+    A chunk that fails is split in half and each half posted again until the items that
+    cannot be loaded are found, so one bad item does not lose the rest of its chunk.
+    This relies on load_data being called with overwrite so re-posting is harmless.
+'''
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functions.portal_client import post_metadata
+
+
+def post_load_data(auth, itype, items):
+    payload = {'store': {itype: items}, 'overwrite': True}
+    if 'localhost' in auth.get('server', ''):
+        payload['config_uri'] = 'development.ini'
+    return post_metadata(payload, 'load_data', auth)
+
+
+def load_with_bisect(auth, itype, items):
+    """Post items to load_data splitting them in half on failure.
+        Returns a list of (uuid, error message) for the items that could not be loaded"""
+    try:
+        post_load_data(auth, itype, items)
+        return []
+    except Exception as e:
+        if len(items) == 1:
+            return [(items[0].get('uuid'), str(e))]
+    mid = len(items) // 2
+    return load_with_bisect(auth, itype, items[:mid]) + load_with_bisect(auth, itype, items[mid:])
+
+
+class LoadDataSubmitter(object):
+    """Posts chunks of items of one type to load_data using up to workers threads
+        submit can be called any number of times - only workers * 2 chunks are held
+        waiting at any time - and finish waits for them all"""
+
+    def __init__(self, auth, itype, workers=1, chunk_size=None):
+        self.auth = auth
+        self.itype = itype
+        self.workers = max(workers, 1)
+        self.chunk_size = chunk_size
+        self.failed = []
+        self._pending = set()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def _collect(self, done):
+        for fut in done:
+            self._pending.discard(fut)
+            for uid, error in fut.result():
+                print("PROBLEM WITH POST", self.itype, uid, error)
+                self.failed.append((uid, error))
+
+    def submit(self, items):
+        size = self.chunk_size or len(items)
+        for start in range(0, len(items), size):
+            if len(self._pending) >= self.workers * 2:
+                done, _ = wait(self._pending, return_when=FIRST_COMPLETED)
+                self._collect(done)
+            self._pending.add(self._executor.submit(
+                load_with_bisect, self.auth, self.itype, items[start:start + size]))
+
+    def finish(self):
+        """Wait for every chunk to be loaded - returns a list of (uuid, error) failures"""
+        if self._pending:
+            done, _ = wait(self._pending)
+            self._collect(done)
+        self._executor.shutdown()
+        return self.failed
+
+
+def load_items(auth, itype, items, chunk_size=50, workers=1):
+    """Load a list of items of one type in chunks - returns a list of (uuid, error) failures"""
+    submitter = LoadDataSubmitter(auth, itype, workers=workers, chunk_size=chunk_size)
+    submitter.submit(items)
+    return submitter.finish()
@@ -0,0 +1,119 @@
+'''Plans of the status patches needed to clean up items and a way to run them
+    Cleanup code (delete_wfrs, clean_for_reupload) adds a step per item to a DeletionPlan
+    rather than patching as it goes - a step is the patch and fields to delete for one
+    item and the items that must be patched before it.  Steps for the same item are
+    merged so an output or QC shared by many runs is only patched once however many
+    files are planned together.
+
+    execute_plan then sends the steps in dependency order, each level with a bounded pool
+    of threads (see patch_executor), printing progress as it goes.  Steps that depend on
+    a failed step are not sent.  run_plan is the same for code that used to patch as it
+    went - any failures are printed and raised as DeletionFailed.
+'''
+from collections import OrderedDict
+from functions import portal_client as pc
+from functions.patch_executor import execute_patches, PatchSummary
+
+
+class DeletionPlan(object):
+    def __init__(self):
+        self.steps = OrderedDict()
+
+    def add(self, item_id, patch=None, after=(), delete_fields=(), reason=''):
+        """Plan a patch of item_id to happen after the items in after"""
+        step = self.steps.get(item_id)
+        if step is None:
+            step = self.steps[item_id] = {'patch': {}, 'delete_fields': [], 'after': [], 'reasons': []}
+        step['patch'].update(patch or {})
+        step['delete_fields'].extend(f for f in delete_fields if f not in step['delete_fields'])
+        step['after'].extend(a for a in after if a != item_id and a not in step['after'])
+        if reason and reason not in step['reasons']:
+            step['reasons'].append(reason)
+        return step
+
+    def delete(self, item_id, after=(), reason=''):
+        return self.add(item_id, {'status': 'deleted'}, after=after, reason=reason)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __contains__(self, item_id):
+        return item_id in self.steps
+
+    def levels(self):
+        """Lists of item ids where each item only depends on items in earlier lists
+            - dependencies on items that are not in the plan are ignored"""
+        remaining = OrderedDict((i, [a for a in s['after'] if a in self.steps]) for i, s in self.steps.items())
+        done = set()
+        levels = []
+        while remaining:
+            level = [i for i, after in remaining.items() if all(a in done for a in after)]
+            if not level:
+                # a cycle - send what is left together rather than never
+                level = list(remaining)
+            for i in level:
+                del remaining[i]
+            done.update(level)
+            levels.append(level)
+        return levels
+
+    def report(self):
+        for item_id, step in self.steps.items():
+            print('PLANNED', item_id, step['patch'], 'delete fields %s' % ','.join(step['delete_fields'])
+                  if step['delete_fields'] else '', '; '.join(step['reasons']))
+
+
+def patch_step(item_id, step, key):
+    add_on = 'delete_fields=' + ','.join(step['delete_fields']) if step['delete_fields'] else ''
+    return pc.patch_metadata(step['patch'], item_id, key, add_on=add_on)
+
+
+def execute_plan(plan, key, workers=8, rate=None, progress_every=100):
+    """Send the steps of plan level by level with up to workers patches at a time
+        returns a PatchSummary"""
+    summary = PatchSummary()
+    failed = set()
+    total = len(plan)
+    state = {'done': 0}
+
+    def on_result(item_id, step, res):
+        state['done'] += 1
+        if progress_every and (state['done'] % progress_every == 0 or state['done'] == total):
+            print('%d of %d cleanup patches done' % (state['done'], total))
+
+    for level in plan.levels():
+        jobs = []
+        for item_id in level:
+            step = plan.steps[item_id]
+            blocked = [a for a in step['after'] if a in failed]
+            if blocked:
+                summary.add_failure(item_id, 'NOT PATCHED - %s failed' % ', '.join(blocked))
+                failed.add(item_id)
+                on_result(item_id, step, None)
+                continue
+            jobs.append((item_id, step))
+        level_summary = execute_patches(jobs, lambda item_id, step: patch_step(item_id, step, key),
+                                        workers=workers, rate=rate, server=key.get('server'), on_result=on_result)
+        summary.succeeded.extend(level_summary.succeeded)
+        for item_id, reason in level_summary.failed.items():
+            summary.add_failure(item_id, reason)
+            failed.add(item_id)
+    return summary
+
+
+class DeletionFailed(Exception):
+    """Some patches of a plan failed - the PatchSummary is in summary"""
+
+    def __init__(self, summary):
+        self.summary = summary
+        super(DeletionFailed, self).__init__('%d of %d cleanup patches failed' % (
+            len(summary.failed), len(summary.failed) + len(summary.succeeded)))
+
+
+def run_plan(plan, key, workers=8, rate=None):
+    """execute_plan that prints the failures and raises DeletionFailed if there are any"""
+    summary = execute_plan(plan, key, workers=workers, rate=rate, progress_every=0)
+    if summary.failed:
+        summary.report()
+        raise DeletionFailed(summary)
+    return summary
@@ -0,0 +1,150 @@
+'''Read items from large json files without loading the whole file into memory
+    Three layouts are supported:
+        a dict of item type to a list of items - {"lab": [{...}, ...], "award": [...]}
+        a list of items of a single type - [{...}, {...}]
+        json lines (.jsonl or .ndjson) - one item of a single type per line
+    Items are decoded one at a time so memory use depends on the size of an item
+    rather than the size of the file.
+'''
+import os
+import json
+from collections import Counter
+
+READ_SIZE = 1 << 16
+JSON_LINES_EXTENSIONS = ('.jsonl', '.ndjson')
+
+_decoder = json.JSONDecoder()
+
+
+class JsonStreamReader(object):
+    """Decodes json values one at a time from a file object holding a buffer
+        of only what has been read but not yet decoded"""
+
+    def __init__(self, fileobj, read_size=READ_SIZE):
+        self.fileobj = fileobj
+        self.read_size = read_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=None):
+        """Read more of the file into the buffer - False if at end of file"""
+        if self.eof:
+            return False
+        data = self.fileobj.read(size or self.read_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """The next non whitespace character - '' at end of file"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        """Consume the next character which must be one of chars and return it"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expected one of '%s' but found '%s'" % (chars, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode and return the next complete json value"""
+        self.peek()
+        size = self.read_size
+        while True:
+            try:
+                val, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # most likely the value isn't all in the buffer yet
+                if self._fill(size):
+                    size *= 2
+                    continue
+                raise
+            self.pos = end
+            return val
+
+
+def _iter_array(reader):
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.pos += 1
+        return
+    while True:
+        yield reader.value()
+        if reader.expect(',]') == ']':
+            return
+
+
+def iter_items(fileobj, itype=None, lines=False, read_size=READ_SIZE):
+    """Yield (item type, item) for each item in the file
+        itype is required for a list of items or json lines and ignored for a dict
+        of item types to lists of items"""
+    reader = JsonStreamReader(fileobj, read_size)
+    first = reader.peek()
+    if lines or first == '[':
+        if not itype:
+            raise ValueError("An item type is needed for a file that is a list of items")
+        if lines:
+            while reader.peek():
+                yield itype, reader.value()
+        else:
+            for item in _iter_array(reader):
+                yield itype, item
+    elif first == '{':
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            store_key = reader.value()
+            if not isinstance(store_key, str):
+                raise ValueError("Expected an item type but found %s" % store_key)
+            reader.expect(':')
+            for item in _iter_array(reader):
+                yield store_key, item
+            if reader.expect(',}') == '}':
+                return
+    else:
+        raise ValueError("Expected a json list or dict but found '%s'" % first)
+
+
+def spool_items_by_type(filename, spool_dir, itype=None):
+    """Stream the items in filename into a json lines file per item type in spool_dir
+        so that types can then be loaded in any order one chunk at a time.
+        Returns a dict of item type to (spool file name, number of items)"""
+    lines = filename.endswith(JSON_LINES_EXTENSIONS)
+    spools = {}
+    counts = Counter()
+    try:
+        with open(filename) as infile:
+            for item_type, item in iter_items(infile, itype, lines):
+                if item_type not in spools:
+                    spools[item_type] = open(os.path.join(spool_dir, item_type + '.jsonl'), 'w')
+                spools[item_type].write(json.dumps(item) + '\n')
+                counts[item_type] += 1
+    finally:
+        for spool in spools.values():
+            spool.close()
+    return {t: (spool.name, counts[t]) for t, spool in spools.items()}
+
+
+def iter_spooled_chunks(spool_file, chunk_size=1000):
+    """Yield lists of at most chunk_size items from a json lines spool file"""
+    chunk = []
+    with open(spool_file) as sf:
+        for line in sf:
+            chunk.append(json.loads(line))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,218 @@
+'''Writers that stream rows of item fields to a file in a format that is easy to analyse
+    tsv - the tab separated lines item_fetcher has always printed
+    jsonl - a json object per line with the values as they are in the item
+    csv - linked items as uuids and lists joined with ', ' like tsv
+    parquet - typed columns, needs pyarrow (pip install pyarrow or the parquet extra)
+
+    Each writer is given the column names up front and then write(row) is called with a
+    dict of column to value for each item.  Parquet rows are spooled to a temporary file
+    and the parquet file written a row group at a time on close, as column types are
+    worked out from all the rows - whole numbers, numbers (whole numbers too if a column
+    has both), true/false, lists of strings (embedded objects in a list are json) and
+    anything else, including columns of mixed types, as strings - and
+    string columns are dictionary encoded as ids, statuses and types repeat a lot.
+'''
+import sys
+import csv
+import json
+import tempfile
+
+FORMATS = ('tsv', 'jsonl', 'csv', 'parquet')
+
+
+def format_value(val):
+    """A value as a string for the text formats - linked items as their uuid and
+        lists joined with ', '"""
+    if isinstance(val, dict):
+        val = val.get('uuid')
+    elif isinstance(val, list):
+        val = ', '.join(v.get('uuid') if isinstance(v, dict) else str(v) for v in val)
+    return val
+
+
+class RowWriter(object):
+    """Base class - writes to outfile or stdout if it is None"""
+
+    def __init__(self, columns, outfile=None):
+        self.columns = list(columns)
+        self.rows = 0
+        self._own_file = outfile is not None
+        self._out = open(outfile, 'w', newline='') if outfile is not None else sys.stdout
+
+    def write(self, row):
+        self._write(row)
+        self.rows += 1
+
+    def _write(self, row):  # pragma: no cover
+        raise NotImplementedError
+
+    def close(self):
+        if self._own_file:
+            self._out.close()
+        else:
+            self._out.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TsvWriter(RowWriter):
+    def __init__(self, columns, outfile=None):
+        super(TsvWriter, self).__init__(columns, outfile)
+        self._out.write('#' + '\t'.join(self.columns) + '\n')
+
+    def _write(self, row):
+        self._out.write('\t'.join(str(format_value(row.get(c))) for c in self.columns) + '\t\n')
+
+
+class JsonLinesWriter(RowWriter):
+    def _write(self, row):
+        self._out.write(json.dumps(row) + '\n')
+
+
+class CsvWriter(RowWriter):
+    def __init__(self, columns, outfile=None):
+        super(CsvWriter, self).__init__(columns, outfile)
+        self._csv = csv.writer(self._out)
+        self._csv.writerow(self.columns)
+
+    def _write(self, row):
+        vals = [format_value(row.get(c)) for c in self.columns]
+        self._csv.writerow(['' if v is None else v for v in vals])
+
+
+def _value_kind(val):
+    if val is None:
+        return None
+    if isinstance(val, bool):
+        return 'bool'
+    if isinstance(val, int):
+        return 'int'
+    if isinstance(val, float):
+        return 'float'
+    if isinstance(val, list) and not any(isinstance(i, list) for i in val):
+        return 'list'
+    return 'string'
+
+
+def _merge_kind(kind, other):
+    """The parquet type that can hold values of both kinds"""
+    if kind is None or kind == other:
+        return other
+    if other is None:
+        return kind
+    if {kind, other} == {'int', 'float'}:
+        return 'float'
+    return 'string'
+
+
+def _column_kind(values):
+    """The parquet type for a column from its values"""
+    kind = None
+    for val in values:
+        kind = _merge_kind(kind, _value_kind(val))
+    return kind or 'string'
+
+
+def _to_string(val):
+    if isinstance(val, (dict, list)):
+        return json.dumps(val)
+    return str(val)
+
+
+def _convert(val, kind, column):
+    if val is None:
+        return None
+    if kind == 'string':
+        return _to_string(val)
+    if kind == 'list':
+        return [_to_string(v) for v in (val if isinstance(val, list) else [val])]
+    if kind == 'float' and isinstance(val, (int, float)) and not isinstance(val, bool):
+        return float(val)
+    if kind == 'int' and isinstance(val, int) and not isinstance(val, bool):
+        return val
+    if kind == 'bool' and isinstance(val, bool):
+        return val
+    raise ValueError("column %s was written as %s but %r is not" % (column, kind, val))
+
+
+def _dictionary_columns(pa, schema):
+    """The parquet paths of the string leaf columns in an arrow schema - struct
+        children are under their parent and list values under <name>.list.<value field>"""
+    def leaves(path, typ):
+        if pa.types.is_string(typ):
+            yield path
+        elif pa.types.is_list(typ):
+            for leaf in leaves(path + '.list.' + typ.value_field.name, typ.value_type):
+                yield leaf
+        elif pa.types.is_struct(typ):
+            for i in range(typ.num_fields):
+                for leaf in leaves(path + '.' + typ[i].name, typ[i].type):
+                    yield leaf
+    return [leaf for field in schema for leaf in leaves(field.name, field.type)]
+
+
+class ParquetWriter(RowWriter):
+    def __init__(self, columns, outfile=None, row_group_size=10000):
+        if outfile is None:
+            raise ValueError("parquet output needs a file name")
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("parquet output needs pyarrow - pip install pyarrow")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.columns = list(columns)
+        self.rows = 0
+        self.outfile = outfile
+        self.row_group_size = row_group_size
+        self.kinds = {c: None for c in self.columns}
+        self._spool = tempfile.TemporaryFile('w+')
+
+    def _write(self, row):
+        row = {c: row.get(c) for c in self.columns}
+        self._spool.write(json.dumps(row, default=str) + '\n')
+        for c, val in row.items():
+            self.kinds[c] = _merge_kind(self.kinds[c], _value_kind(val))
+
+    def _schema(self):
+        pa = self.pa
+        # list values are named element, the name parquet gives them, so the arrow and
+        # parquet paths of their leaf column are the same with any pyarrow version
+        types = {'string': pa.string(), 'list': pa.list_(pa.field('element', pa.string())), 'int': pa.int64(),
+                 'float': pa.float64(), 'bool': pa.bool_()}
+        return pa.schema([(c, types[self.kinds[c]]) for c in self.columns])
+
+    def _table(self, rows, schema):
+        data = {c: [_convert(r.get(c), self.kinds[c], c) for r in rows] for c in self.columns}
+        return self.pa.Table.from_pydict(data, schema=schema)
+
+    def close(self):
+        self.kinds = {c: k or 'string' for c, k in self.kinds.items()}
+        schema = self._schema()
+        dict_columns = _dictionary_columns(self.pa, schema)
+        writer = self.pq.ParquetWriter(self.outfile, schema, use_dictionary=dict_columns)
+        with self._spool, writer:
+            self._spool.seek(0)
+            rows = []
+            for line in self._spool:
+                rows.append(json.loads(line))
+                if len(rows) >= self.row_group_size:
+                    writer.write_table(self._table(rows, schema))
+                    rows = []
+            if rows or not self.rows:
+                writer.write_table(self._table(rows, schema))
+
+
+WRITERS = {'tsv': TsvWriter, 'jsonl': JsonLinesWriter, 'csv': CsvWriter, 'parquet': ParquetWriter}
+
+
+def get_writer(fmt, columns, outfile=None):
+    """A writer for fmt - one of FORMATS"""
+    if fmt not in WRITERS:
+        raise ValueError("unknown format %s - use one of %s" % (fmt, ', '.join(FORMATS)))
+    return WRITERS[fmt](columns, outfile)
@@ -0,0 +1,226 @@
+'''Order to load item types in so that linked items exist before the items linking to them
+    The order is worked out from the linkTo properties of the schemas at /profiles/ and
+    grouped into levels - types in the same level do not link to each other so they can be
+    loaded at the same time, but a level must be loaded before the next one.
+    Levels are cached on disk per server as a json file so the schemas are only fetched
+    once a day.  Without a server, or if the schemas can't be fetched, ORDER is used.
+    Links that make a cycle are dropped - load_data can resolve those within a type - and
+    ORDER decides which type in a cycle goes first.
+'''
+import os
+import re
+import json
+import time
+from functions.portal_client import get_metadata
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'load_order')
+CACHE_MAX_AGE = 24 * 60 * 60
+
+# get order from loadxl.py in fourfront
+ORDER = [
+    'user',
+    'award',
+    'lab',
+    'static_section',
+    'higlass_view_config',
+    'page',
+    'ontology',
+    'ontology_term',
+    'file_format',
+    'badge',
+    'organism',
+    'genomic_region',
+    'gene',
+    'bio_feature',
+    'target',
+    'imaging_path',
+    'publication',
+    'publication_tracking',
+    'document',
+    'image',
+    'vendor',
+    'construct',
+    'modification',
+    'protocol',
+    'sop_map',
+    'biosample_cell_culture',
+    'individual_human',
+    'individual_mouse',
+    'individual_fly',
+    'individual_chicken',
+    'biosource',
+    'antibody',
+    'enzyme',
+    'treatment_rnai',
+    'treatment_agent',
+    'biosample',
+    'quality_metric_fastqc',
+    'quality_metric_bamqc',
+    'quality_metric_pairsqc',
+    'quality_metric_dedupqc_repliseq',
+    'quality_metric_chipseq',
+    'quality_metric_atacseq',
+    'microscope_setting_d1',
+    'microscope_setting_d2',
+    'microscope_setting_a1',
+    'microscope_setting_a2',
+    'file_fastq',
+    'file_processed',
+    'file_reference',
+    'file_calibration',
+    'file_microscopy',
+    'file_set',
+    'file_set_calibration',
+    'file_set_microscope_qc',
+    'file_vistrack',
+    'experiment_hi_c',
+    'experiment_capture_c',
+    'experiment_repliseq',
+    'experiment_atacseq',
+    'experiment_chiapet',
+    'experiment_damid',
+    'experiment_seq',
+    'experiment_tsaseq',
+    'experiment_mic',
+    'experiment_set',
+    'experiment_set_replicate',
+    'data_release_update',
+    'software',
+    'analysis_step',
+    'workflow',
+    'workflow_mapping',
+    'workflow_run_sbg',
+    'workflow_run_awsem'
+]
+
+_CAPS_RE = re.compile(r'(?<!^)(?=[A-Z])')
+
+
+def snake_case(type_name):
+    """Schema name to store key eg. ExperimentHiC -> experiment_hi_c"""
+    return _CAPS_RE.sub('_', type_name).lower()
+
+
+def type_name(store_key):
+    """Store key to schema name eg. experiment_hi_c -> ExperimentHiC"""
+    return ''.join(part.capitalize() for part in store_key.split('_'))
+
+
+def _collect_links(schema, links):
+    # linkTo can be on a property, the items of an array or properties of embedded objects
+    if isinstance(schema, dict):
+        link = schema.get('linkTo')
+        if link:
+            links.update([link] if isinstance(link, str) else link)
+        for key in ('items', 'properties'):
+            sub = schema.get(key)
+            if key == 'properties' and isinstance(sub, dict):
+                for prop in sub.values():
+                    _collect_links(prop, links)
+            elif sub:
+                _collect_links(sub, links)
+    return links
+
+
+def _concrete_types(link, types, parents):
+    """The store keys of the concrete types a linkTo type name can refer to"""
+    key = snake_case(link)
+    if key in types:
+        return [key]
+    subtypes = [t for t, p in parents.items() if link in p]
+    if subtypes:
+        return subtypes
+    # an abstract type not in the schemas - eg File covers file_fastq, file_processed...
+    return [t for t in types if t.startswith(key + '_')]
+
+
+def dependencies_from_profiles(profiles):
+    """dict of store key to the set of store keys it links to from the /profiles/ json"""
+    types = {snake_case(name): schema for name, schema in profiles.items()}
+    parents = {}
+    for key, schema in types.items():
+        sub_of = schema.get('rdfs:subClassOf') or []
+        if isinstance(sub_of, str):
+            sub_of = [sub_of]
+        parents[key] = [p.split('/')[-1].replace('.json', '') for p in sub_of]
+    deps = {}
+    for key, schema in types.items():
+        deps[key] = set()
+        for link in _collect_links(schema, set()):
+            deps[key].update(_concrete_types(link, types, parents))
+        deps[key].discard(key)
+    return deps
+
+
+_ORDER_RANK = {t: i for i, t in enumerate(ORDER)}
+
+
+def _rank(itype):
+    return (_ORDER_RANK.get(itype, len(ORDER)), itype)
+
+
+def build_levels(deps):
+    """Group types into levels so every type comes after the types it links to
+        when a cycle stops progress the type first in ORDER is put in the next level"""
+    remaining = {t: set(d) & set(deps) for t, d in deps.items()}
+    levels = []
+    while remaining:
+        level = [t for t, d in remaining.items() if not d]
+        if not level:
+            level = [min(remaining, key=_rank)]
+        level.sort(key=_rank)
+        levels.append(level)
+        for t in level:
+            del remaining[t]
+        for d in remaining.values():
+            d.difference_update(level)
+    return levels
+
+
+def _cache_file(server, cache_dir):
+    name = re.sub(r'[^A-Za-z0-9.-]+', '_', server.split('://')[-1]).strip('_')
+    return os.path.join(cache_dir, name + '.json')
+
+
+def get_load_levels(auth=None, refresh=False, cache_dir=CACHE_DIR, max_age=CACHE_MAX_AGE):
+    """List of levels of store keys from the schemas on the server in auth
+        uses the cached levels if they are less than max_age seconds old"""
+    if not auth:
+        return [[t] for t in ORDER]
+    cache_file = _cache_file(auth['server'], cache_dir)
+    if not refresh and os.path.isfile(cache_file) and time.time() - os.path.getmtime(cache_file) < max_age:
+        with open(cache_file) as cf:
+            return json.load(cf)['levels']
+    try:
+        profiles = get_metadata('/profiles/', auth, add_on='frame=raw')
+    except Exception as e:
+        print("Could not get schemas to work out load order - using default order", e)
+        return [[t] for t in ORDER]
+    levels = build_levels(dependencies_from_profiles(profiles))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_file, 'w') as cf:
+            json.dump({'server': auth['server'], 'levels': levels}, cf)
+    except OSError as e:
+        print("Could not cache load order", e)
+    return levels
+
+
+def get_load_order(auth=None, **kwargs):
+    """Flat list of store keys in the order to load them"""
+    return [t for level in get_load_levels(auth, **kwargs) for t in level]
+
+
+def group_types(itypes, levels):
+    """Split itypes into the levels they belong to, dropping empty levels -
+        types that aren't in any level go in a final level of their own"""
+    position = {t: (i, j) for i, level in enumerate(levels) for j, t in enumerate(level)}
+    grouped = [[] for _ in range(len(levels) + 1)]
+    for itype in sorted(itypes, key=lambda t: position.get(t, (len(levels), t))):
+        grouped[position.get(itype, (len(levels),))[0]].append(itype)
+    return [g for g in grouped if g]
+
+
+def sort_types(itypes, levels):
+    """itypes in load order - unknown types last"""
+    return [t for level in group_types(itypes, levels) for t in level]
@@ -0,0 +1,224 @@
+'''Persistent read-through cache of portal metadata in a SQLite file
+    Responses are keyed by server, item id and add_on (frame) and kept until the file
+    grows past max_bytes, when the least recently used are dropped.
+    A cached response is used as is for the TTL of its item type.  After that it is
+    revalidated by comparing last_modified.date_modified with a search - done in bulk
+    for all stale entries by revalidate() - and only fetched again if it has changed.
+
+    Only frame=object and frame=raw responses are cached by default.  The embedded frame
+    (the default) has the fields of linked items in it and a change to one of those does
+    not change the item's own date_modified, so it can be out of date however it is
+    revalidated.  Use cache_embedded=True to cache it too if that is acceptable.
+
+    enable_cache() routes portal_client.get_metadata (used by script_utils, wfr...)
+    through the cache eg. at the top of a notebook
+
+        cache = enable_cache()
+        cache.revalidate(my_auth)
+
+    Patches, posts and deleted fields sent with portal_client remove the cached responses
+    of the item changed.  Changes made any other way are not seen until an item's TTL runs
+    out so call invalidate with the ids of items you have changed and want to read back.
+'''
+import os
+import json
+import time
+import sqlite3
+import threading
+from functions import portal_client
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'portal_metadata.sqlite')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_TTL = 10 * 60
+DAY = 24 * 60 * 60
+# item types that hardly ever change
+TYPE_TTLS = {
+    'User': DAY,
+    'Lab': DAY,
+    'Award': DAY,
+    'FileFormat': DAY,
+    'Organism': DAY,
+    'Vendor': DAY,
+    'Enzyme': DAY,
+    'Software': DAY,
+    'Workflow': DAY,
+    'Ontology': DAY,
+    'OntologyTerm': DAY,
+}
+REVALIDATE_CHUNK = 100
+
+_SCHEMA = '''CREATE TABLE IF NOT EXISTS metadata (
+    server TEXT, obj_id TEXT, frame TEXT, item_type TEXT, uuid TEXT, date_modified TEXT,
+    fetched_at REAL, last_used REAL, size INTEGER, body TEXT,
+    PRIMARY KEY (server, obj_id, frame))'''
+
+
+def _server(auth):
+    return auth['server'].rstrip('/')
+
+
+def _date_modified(body):
+    last_modified = body.get('last_modified')
+    if isinstance(last_modified, dict):
+        return last_modified.get('date_modified')
+    return None
+
+
+class MetadataCache(object):
+    """SQLite backed cache of get_metadata responses - safe to share between threads"""
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES, ttls=None, default_ttl=DEFAULT_TTL,
+                 cache_embedded=False):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(TYPE_TTLS, **(ttls or {}))
+        self.default_ttl = default_ttl
+        self.cache_embedded = cache_embedded
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(_SCHEMA)
+            self._conn.execute('CREATE INDEX IF NOT EXISTS metadata_uuid ON metadata (server, uuid)')
+            self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM metadata').fetchone()[0]
+
+    def ttl(self, item_type):
+        return self.ttls.get(item_type, self.default_ttl)
+
+    def cacheable(self, add_on):
+        """False for embedded frames unless cache_embedded - see the module docstring"""
+        return self.cache_embedded or any(f in add_on.split('&') for f in ('frame=object', 'frame=raw'))
+
+    def _lookup(self, server, obj_id, frame):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT uuid, date_modified, item_type, fetched_at, body FROM metadata '
+                'WHERE server=? AND obj_id=? AND frame=?', (server, obj_id, frame)).fetchone()
+
+    def _touch(self, server, obj_id, frame):
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE metadata SET last_used=? WHERE server=? AND obj_id=? AND frame=?',
+                               (time.time(), server, obj_id, frame))
+
+    def _store(self, server, obj_id, frame, body):
+        text = json.dumps(body)
+        item_type = (body.get('@type') or [None])[0]
+        now = time.time()
+        with self._lock, self._conn:
+            old = self._conn.execute('SELECT size FROM metadata WHERE server=? AND obj_id=? AND frame=?',
+                                     (server, obj_id, frame)).fetchone()
+            self._conn.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               (server, obj_id, frame, item_type, body.get('uuid'), _date_modified(body),
+                                now, now, len(text), text))
+            self._size += len(text) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # drop least recently used entries until back under 90% of the limit
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute('SELECT rowid, size FROM metadata ORDER BY last_used')
+        to_drop = []
+        for rowid, size in rows:
+            if self._size <= target:
+                break
+            to_drop.append((rowid,))
+            self._size -= size
+        self._conn.executemany('DELETE FROM metadata WHERE rowid=?', to_drop)
+
+    def _current_dates(self, auth, uuids):
+        """dict of uuid to last_modified.date_modified now on the server"""
+        dates = {}
+        for start in range(0, len(uuids), REVALIDATE_CHUNK):
+            query = 'search/?type=Item&{}&field=uuid&field=last_modified.date_modified'.format(
+                '&'.join('uuid=' + u for u in uuids[start:start + REVALIDATE_CHUNK]))
+            for hit in portal_client.search_metadata(query, auth):
+                dates[hit.get('uuid')] = _date_modified(hit)
+        return dates
+
+    def _revalidate_rows(self, auth, rows):
+        """rows are (obj_id, frame, uuid, date_modified) - unchanged ones are marked as fresh
+            and changed ones removed.  Returns the number still valid"""
+        server = _server(auth)
+        dates = self._current_dates(auth, sorted(set(r[2] for r in rows)))
+        valid = []
+        changed = []
+        for row in rows:
+            (valid if row[3] and dates.get(row[2]) == row[3] else changed).append(row)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany('UPDATE metadata SET fetched_at=? WHERE server=? AND obj_id=? AND frame=?',
+                                   [(now, server, r[0], r[1]) for r in valid])
+            self._conn.executemany('DELETE FROM metadata WHERE server=? AND obj_id=? AND frame=?',
+                                   [(server, r[0], r[1]) for r in changed])
+            self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM metadata').fetchone()[0]
+        self.revalidated += len(valid)
+        return len(valid)
+
+    def get(self, auth, obj_id, add_on=''):
+        """get_metadata(obj_id, auth, add_on) served from the cache when possible"""
+        if not self.cacheable(add_on):
+            return portal_client.get_session(auth).get_metadata(obj_id, add_on=add_on)
+        server = _server(auth)
+        obj_id = obj_id.strip('/')
+        row = self._lookup(server, obj_id, add_on)
+        if row:
+            uuid, date_modified, item_type, fetched_at, body = row
+            if time.time() - fetched_at < self.ttl(item_type):
+                self.hits += 1
+                self._touch(server, obj_id, add_on)
+                return json.loads(body)
+            if uuid and date_modified and self._revalidate_rows(auth, [(obj_id, add_on, uuid, date_modified)]):
+                self.hits += 1
+                self._touch(server, obj_id, add_on)
+                return json.loads(body)
+        self.misses += 1
+        body = portal_client.get_session(auth).get_metadata(obj_id, add_on=add_on)
+        self._store(server, obj_id, add_on, body)
+        return body
+
+    def revalidate(self, auth):
+        """Check every stale entry for the server in auth with bulk searches
+            returns the number of entries that were still valid"""
+        server = _server(auth)
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute('SELECT obj_id, frame, uuid, date_modified, item_type, fetched_at FROM metadata '
+                                      'WHERE server=? AND uuid IS NOT NULL', (server,)).fetchall()
+        stale = [r[:4] for r in rows if now - r[5] >= self.ttl(r[4])]
+        if not stale:
+            return 0
+        return self._revalidate_rows(auth, stale)
+
+    def invalidate(self, auth, ids):
+        """Remove all cached responses for the items with these uuids or other ids"""
+        if isinstance(ids, str):
+            ids = [ids]
+        server = _server(auth)
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM metadata WHERE server=? AND (uuid=? OR obj_id=?)',
+                                   [(server, i, i.strip('/')) for i in ids])
+            self._size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM metadata').fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM metadata')
+            self._size = 0
+
+    def close(self):
+        self._conn.close()
+
+
+def enable_cache(path=DEFAULT_PATH, **kwargs):
+    """Serve portal_client.get_metadata from a MetadataCache at path and return it"""
+    cache = MetadataCache(path, **kwargs)
+    portal_client.set_metadata_cache(cache)
+    return cache
+
+
+def disable_cache():
+    portal_client.set_metadata_cache(None)
@@ -1,10 +1,15 @@
-from dcicutils import ff_utils
+from functions import portal_client as pc
 from uuid import UUID
 import os
 import json
 import xlrd
 import xlwt
 import datetime
+from collections import OrderedDict
+from functions.script_utils import find_uuids  # noqa: F401
+from functions.load_order import ORDER  # noqa: F401
+from functions.item_writers import get_writer
+from functions.deletion_plan import DeletionPlan, run_plan
 
 
 def reader(filename, sheetname=None):
@@ -196,25 +201,9 @@ def is_uuid(value):
         return False
 
 
-def find_uuids(val):
-    vals = []
-    if not val:
-        return []
-    elif isinstance(val, str):
-        if is_uuid(val):
-            vals = [val]
-        else:
-            return []
-    else:
-        text = str(val)
-        text_list = [i for i in text. split("'") if len(i) == 36]
-        vals = [i for i in text_list if is_uuid(i)]
-    return vals
-
-
 def get_schema_names(con_key):
     schema_name = {}
-    profiles = ff_utils.get_metadata('/profiles/', key=con_key, add_on='frame=raw')
+    profiles = pc.get_metadata('/profiles/', key=con_key, add_on='frame=raw')
     for key, value in profiles.items():
         try:
             schema_name[key] = value['id'].split('/')[-1][:-5]
@@ -223,13 +212,22 @@ def get_schema_names(con_key):
     return schema_name
 
 
-def dump_results_to_json(store, folder):
+def dump_results_to_json(store, folder, fmt='json'):
+    """Write the items of each type in store to folder/type.json - fmt can also be jsonl
+    (an item per line), csv, tsv or parquet (a column per field, needs pyarrow) for large
+    stores - the columns are all the fields of the items of a type"""
     if not os.path.exists(folder):
         os.makedirs(folder)
     for a_type in store:
-        filename = folder + '/' + a_type + '.json'
-        with open(filename, 'w') as outfile:
-            json.dump(store[a_type], outfile, indent=4)
+        filename = folder + '/' + a_type + '.' + fmt
+        if fmt == 'json':
+            with open(filename, 'w') as outfile:
+                json.dump(store[a_type], outfile, indent=4)
+            continue
+        columns = list(OrderedDict((k, None) for item in store[a_type] for k in item))
+        with get_writer(fmt, columns, filename) as writer:
+            for item in store[a_type]:
+                writer.write(item)
 
 
 def printTable(myDict, colList=None):
@@ -246,26 +244,38 @@ def printTable(myDict, colList=None):
         print(formatStr.format(*item))
 
 
-def clean_for_reupload(file_acc, key, clean_release_dates=False, delete_runs=True):
+def clean_for_reupload(file_acc, key, clean_release_dates=False, delete_runs=True, plan=None, workers=8):
     """Rare cases we want to reupload the file, and this needs some cleanupself.
-    If you want to delete release dates too, set 'clean_release_dates' to True"""
-    resp = ff_utils.get_metadata(file_acc, key=key)
+    If you want to delete release dates too, set 'clean_release_dates' to True
+    The patches are added to plan (a DeletionPlan) if one is given to be run later with
+    execute_plan - eg. to clean many files together - otherwise they are sent here and
+    DeletionFailed is raised if any of them fail"""
+    run_now = plan is None
+    if run_now:
+        plan = DeletionPlan()
+    resp = pc.get_metadata(file_acc, key=key)
     clean_fields = ['extra_files', 'md5sum', 'content_md5sum', 'file_size', 'filename', 'quality_metric']
     if clean_release_dates:
         clean_fields.extend(['public_release', 'project_release'])
+    cleaned_first = []
     if delete_runs:
         runs = resp.get('workflow_run_inputs', [])
         if runs:
             for a_run in runs:
-                ff_utils.patch_metadata({'status': 'deleted'}, obj_id=a_run['uuid'], key=key)
+                plan.delete(a_run['uuid'], reason='run on file to reupload')
+                cleaned_first.append(a_run['uuid'])
     if resp.get('quality_metric'):
-        ff_utils.patch_metadata({'status': 'deleted'}, obj_id=resp['quality_metric']['uuid'], key=key)
+        plan.delete(resp['quality_metric']['uuid'], reason='qc of file to reupload')
+        cleaned_first.append(resp['quality_metric']['uuid'])
     del_f = []
     for field in clean_fields:
         if field in resp:
             del_f.append(field)
-    del_add_on = 'delete_fields=' + ','.join(del_f)
-    ff_utils.patch_metadata({'status': 'uploading'}, obj_id=resp['uuid'], key=key, add_on=del_add_on)
+    plan.add(resp['uuid'], {'status': 'uploading'}, after=cleaned_first, delete_fields=del_f, reason='reupload')
+    if run_now:
+        run_plan(plan, key, workers=workers)
+        return
+    return plan
 
 
 def file_in_exp(a_file, experiments):
@@ -289,79 +299,3 @@ def file_in_exp(a_file, experiments):
     elif times_found > 0:  # some, but not all of the exps of a_file are in the exp list provided
         found = None
     return found
-
-
-# get order from loadxl.py in fourfront
-ORDER = [
-    'user',
-    'award',
-    'lab',
-    'static_section',
-    'higlass_view_config',
-    'page',
-    'ontology',
-    'ontology_term',
-    'file_format',
-    'badge',
-    'organism',
-    'genomic_region',
-    'target',
-    'imaging_path',
-    'publication',
-    'publication_tracking',
-    'document',
-    'image',
-    'vendor',
-    'construct',
-    'modification',
-    'protocol',
-    'sop_map',
-    'biosample_cell_culture',
-    'individual_human',
-    'individual_mouse',
-    'individual_fly',
-    'individual_chicken',
-    'biosource',
-    'antibody',
-    'enzyme',
-    'treatment_rnai',
-    'treatment_agent',
-    'biosample',
-    'quality_metric_fastqc',
-    'quality_metric_bamqc',
-    'quality_metric_pairsqc',
-    'quality_metric_dedupqc_repliseq',
-    'quality_metric_chipseq',
-    'quality_metric_atacseq',
-    'microscope_setting_d1',
-    'microscope_setting_d2',
-    'microscope_setting_a1',
-    'microscope_setting_a2',
-    'file_fastq',
-    'file_processed',
-    'file_reference',
-    'file_calibration',
-    'file_microscopy',
-    'file_set',
-    'file_set_calibration',
-    'file_set_microscope_qc',
-    'file_vistrack',
-    'experiment_hi_c',
-    'experiment_capture_c',
-    'experiment_repliseq',
-    'experiment_atacseq',
-    'experiment_chiapet',
-    'experiment_damid',
-    'experiment_seq',
-    'experiment_tsaseq',
-    'experiment_mic',
-    'experiment_set',
-    'experiment_set_replicate',
-    'data_release_update',
-    'software',
-    'analysis_step',
-    'workflow',
-    'workflow_mapping',
-    'workflow_run_sbg',
-    'workflow_run_awsem'
-]
@@ -0,0 +1,136 @@
+'''Send many independent portal updates through a bounded pool of threads
+    execute_patches takes an iterable of (item_id, payload) jobs and a function that
+    does the update for one job and returns the portal response.  Only a window of jobs
+    is in flight at any time so jobs can be generated lazily, and an optional per-server
+    rate cap limits the number of requests sent per second.
+    If a PatchJournal is given every result is recorded in it and jobs that it records
+    as already done are skipped.
+'''
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+_lock = threading.Lock()
+_limiters = {}
+
+
+class RateLimiter(object):
+    """Spaces out calls to wait so that at most rate calls per second get through
+        across all threads - a rate of None or 0 means no limit"""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def get_rate_limiter(server, rate=None):
+    """The RateLimiter shared by everything sending to server with its rate set to rate
+        - None or 0 for no limit"""
+    if not server:
+        raise ValueError("A server is needed to share a rate limit")
+    server = server.rstrip('/')
+    with _lock:
+        limiter = _limiters.get(server)
+        if limiter is None:
+            limiter = _limiters[server] = RateLimiter()
+        limiter.interval = 1.0 / rate if rate else 0
+    return limiter
+
+
+class PatchSummary(object):
+    """Collects the outcome of every job run by execute_patches"""
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = OrderedDict()
+        self.skipped = []
+
+    def add_success(self, iid):
+        self.succeeded.append(iid)
+
+    def add_failure(self, iid, reason):
+        self.failed[iid] = reason
+
+    def add_skipped(self, iid):
+        self.skipped.append(iid)
+
+    def report(self):
+        print("%d SUCCEEDED\t%d FAILED" % (len(self.succeeded), len(self.failed)))
+        if self.skipped:
+            print("%d SKIPPED - already done according to the journal" % len(self.skipped))
+        for iid, reason in self.failed.items():
+            print("FAILED", iid, reason)
+
+    def write_failed(self, filename):
+        """Write the failed ids one per line - can be used as input for a re-run"""
+        with open(filename, 'w') as outf:
+            for iid in self.failed:
+                outf.write(iid + '\n')
+
+
+def is_success(res):
+    return isinstance(res, dict) and res.get('status') == 'success'
+
+
+def failure_reason(res):
+    if isinstance(res, dict):
+        return 'RESPONSE STATUS %s %s' % (res.get('status'), res.get('description', ''))
+    return str(res)
+
+
+def execute_patches(jobs, do_patch, workers=1, rate=None, server=None, on_result=None, journal=None):
+    """Run do_patch(item_id, payload) for every (item_id, payload) in jobs using up to
+        workers threads, sending at most rate requests a second to server - server is
+        needed if rate is given.  on_result(item_id, payload, response_or_exception) is called in the calling
+        thread as each job finishes.  Returns a PatchSummary"""
+    summary = PatchSummary()
+    limiter = get_rate_limiter(server, rate) if rate else RateLimiter()
+    max_pending = max(workers, 1) * 2
+
+    def run(iid, payload):
+        limiter.wait()
+        return do_patch(iid, payload)
+
+    def collect(done, pending):
+        # report in the order the jobs were submitted
+        for fut in [f for f in pending if f in done]:
+            iid, payload = pending.pop(fut)
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = e
+            if is_success(res):
+                summary.add_success(iid)
+            else:
+                summary.add_failure(iid, failure_reason(res))
+            if journal is not None:
+                journal.record(iid, payload, res)
+            if on_result is not None:
+                on_result(iid, payload, res)
+
+    pending = OrderedDict()
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for iid, payload in jobs:
+            if journal is not None and journal.is_done(iid, payload):
+                summary.add_skipped(iid)
+                continue
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done, pending)
+            pending[executor.submit(run, iid, payload)] = (iid, payload)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done, pending)
+    return summary
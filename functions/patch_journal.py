@@ -0,0 +1,70 @@
+'''Append only record of the patches made by bulk update scripts
+    Each line of the journal file is a json object with the item id, a hash of the
+    payload, the outcome and when it happened.  Re-running a script with the same
+    journal and resume=True skips the (item id, payload) pairs that succeeded in the
+    earlier run - patches made in this run are only recorded, never skipped.
+'''
+import os
+import sys
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+
+def payload_hash(payload):
+    """Stable hash of a json serializable payload"""
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class PatchJournal(object):
+    """JSONL journal of patch results - safe to share between threads"""
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.resume = resume
+        self._lock = threading.Lock()
+        self._done = set()
+        if os.path.isfile(filename) and os.path.getsize(filename):
+            with open(filename, 'rb+') as jf:
+                jf.seek(-1, os.SEEK_END)
+                if jf.read(1) != b'\n':
+                    # a previous run died mid write - end its partial line so the next
+                    # entry does not get appended to it and lost
+                    jf.write(b'\n')
+        if resume and os.path.isfile(filename):
+            with open(filename) as jf:
+                for line in jf:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a partial last line if the previous run died mid write
+                        continue
+                    if entry.get('status') == 'success':
+                        self._done.add((entry.get('id'), entry.get('hash')))
+
+    def is_done(self, iid, payload):
+        """True if resuming and this patch succeeded in the run being resumed"""
+        return (iid, payload_hash(payload)) in self._done
+
+    def record(self, iid, payload, res):
+        """Append the outcome of a patch - res is the portal response or an exception"""
+        status = res.get('status') if isinstance(res, dict) else 'error'
+        entry = {'id': iid, 'hash': payload_hash(payload), 'status': status,
+                 'time': datetime.utcnow().isoformat()}
+        if status != 'success':
+            entry['message'] = res.get('description') if isinstance(res, dict) else str(res)
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            with open(self.filename, 'a') as jf:
+                jf.write(line)
+
+
+def get_journal(args):
+    """Create the PatchJournal for scripts using create_journal_arg_parser - None if no --journal"""
+    if not getattr(args, 'journal', None):
+        if getattr(args, 'resume', False):
+            print("--resume needs the --journal file of the run to resume")
+            sys.exit(1)
+        return None
+    return PatchJournal(args.journal, resume=args.resume)
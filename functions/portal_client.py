@@ -0,0 +1,267 @@
+'''Shared portal connections for scripts and notebooks
+    A keep-alive connection pool is kept for each server (and key) so that repeated
+    requests re-use connections rather than doing a new TLS handshake each time, and
+    the auth and s3Utils for an environment are only looked up once.
+    get_metadata, search_metadata, patch_metadata, post_metadata, delete_field and
+    get_es_metadata can be used in place of the ff_utils functions of the same name and
+    get_metadata can be served from a persistent cache - see metadata_cache.enable_cache -
+    and patches, posts and deleted fields remove the changed item from it.
+    get_es_metadata keeps an ES client for each server so the health page is only got and
+    the client only made once rather than for every call.
+    All of them record their timing in portal_stats when that is enabled.
+'''
+import os
+import json
+import time
+import threading
+from functools import partial
+import requests
+from requests.adapters import HTTPAdapter
+from dcicutils import ff_utils, es_utils
+from dcicutils.s3_utils import s3Utils
+from functions import portal_stats
+
+POOL_SIZE = 32
+
+_lock = threading.Lock()
+_sessions = {}
+_es_connections = {}
+_env_auths = {}
+_s3_utils = {}
+_metadata_cache = None
+
+
+class PortalSession(object):
+    """Makes authorized requests to a single server using a pooled requests.Session
+        with the same headers, timeout and retries as ff_utils.authorized_request"""
+
+    def __init__(self, auth, pool_size=POOL_SIZE):
+        self.auth = auth
+        self.server = auth['server'].rstrip('/')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _request_with_retries(self, request_fxn, url, auth, verb, **kwargs):
+        # authorized_request passes in requests.get etc. - use the pooled session instead
+        send = partial(self.session.request, verb.upper())
+
+        def send_and_count(*args, **kw):
+            res = send(*args, **kw)
+            if portal_stats.get_recorder() is not None:
+                portal_stats.note_attempt(len(res.content or b''))
+            return res
+
+        return ff_utils.standard_request_with_retries(send_and_count, url, auth, verb, **kwargs)
+
+    def url(self, obj_id, add_on=''):
+        return '/'.join([self.server, obj_id.lstrip('/')]) + ff_utils.process_add_on(add_on)
+
+    def request(self, obj_id, verb='GET', add_on='', **kwargs):
+        return ff_utils.authorized_request(self.url(obj_id, add_on), auth=self.auth, verb=verb,
+                                           retry_fxn=self._request_with_retries, **kwargs)
+
+    def get_metadata(self, obj_id, add_on=''):
+        return ff_utils.get_response_json(self.request(obj_id, add_on=add_on))
+
+    def patch_metadata(self, patch_item, obj_id='', add_on=''):
+        obj_id = obj_id or patch_item['uuid']
+        return ff_utils.get_response_json(self.request(obj_id, 'PATCH', add_on, data=json.dumps(patch_item)))
+
+    def post_metadata(self, post_item, schema_name, add_on=''):
+        return ff_utils.get_response_json(self.request(schema_name, 'POST', add_on, data=json.dumps(post_item)))
+
+    def delete_field(self, obj_id, del_field):
+        return ff_utils.get_response_json(self.request(obj_id, 'PATCH', 'delete_fields=' + del_field,
+                                                       data=json.dumps({})))
+
+
+def get_session(auth):
+    """Return the shared PortalSession for the server and key in auth"""
+    skey = (auth['server'].rstrip('/'), auth.get('key'))
+    with _lock:
+        session = _sessions.get(skey)
+        if session is None:
+            session = _sessions[skey] = PortalSession(auth)
+    return session
+
+
+def get_es_connection(auth):
+    """The shared ES client for the server in auth and the index pattern of its namespace
+        - the health page is only got once per server"""
+    server = auth['server'].rstrip('/')
+    with _lock:
+        conn = _es_connections.get(server)
+    if conn is None:
+        health = ff_utils.get_health_page(key=auth)
+        es_url = os.environ.get('ES_HOST_LOCAL') or health['elasticsearch']
+        conn = (es_utils.create_es_client(es_url, use_aws_auth=True), health.get('namespace', '') + '*')
+        with _lock:
+            conn = _es_connections.setdefault(server, conn)
+    return conn
+
+
+def get_env_auth(env):
+    """get_authentication_with_server for an environment - only looked up once per env"""
+    with _lock:
+        if env not in _env_auths:
+            _env_auths[env] = ff_utils.get_authentication_with_server({}, ff_env=env)
+        return _env_auths[env]
+
+
+def get_s3_utils(env):
+    """s3Utils for an environment - the bucket names are only looked up once per env"""
+    with _lock:
+        if env not in _s3_utils:
+            _s3_utils[env] = s3Utils(env=env)
+        return _s3_utils[env]
+
+
+def set_metadata_cache(cache):
+    """Serve get_metadata through cache eg. a metadata_cache.MetadataCache - None turns it off"""
+    global _metadata_cache
+    _metadata_cache = cache
+
+
+def get_metadata(obj_id, key, add_on=''):
+    """Drop in for ff_utils.get_metadata with an auth dict that uses the shared session"""
+    with portal_stats.track('get', portal_stats.endpoint_class(obj_id)):
+        if _metadata_cache is not None:
+            return _metadata_cache.get(key, obj_id, add_on=add_on)
+        return get_session(key).get_metadata(obj_id, add_on=add_on)
+
+
+def _invalidate_cached(key, obj_id, res=None):
+    """Drop the cached responses of an item that has been changed - also by the uuids in
+        the response as obj_id may be an accession or alias"""
+    if _metadata_cache is None:
+        return
+    ids = [obj_id] if obj_id else []
+    if isinstance(res, dict):
+        ids.extend(i['uuid'] for i in res.get('@graph') or [] if isinstance(i, dict) and i.get('uuid'))
+    if ids:
+        _metadata_cache.invalidate(key, ids)
+
+
+def patch_metadata(patch_item, obj_id='', key=None, add_on=''):
+    """Drop in for ff_utils.patch_metadata with an auth dict"""
+    item_id = obj_id or patch_item['uuid']
+    res = None
+    with portal_stats.track('patch', portal_stats.endpoint_class(item_id)):
+        try:
+            res = get_session(key).patch_metadata(patch_item, obj_id, add_on=add_on)
+            return res
+        finally:
+            # even a failed patch may have been applied
+            _invalidate_cached(key, item_id, res)
+
+
+def post_metadata(post_item, schema_name, key=None, add_on=''):
+    """Drop in for ff_utils.post_metadata with an auth dict"""
+    res = None
+    with portal_stats.track('post', schema_name):
+        try:
+            res = get_session(key).post_metadata(post_item, schema_name, add_on=add_on)
+            return res
+        finally:
+            _invalidate_cached(key, post_item.get('uuid') if isinstance(post_item, dict) else None, res)
+
+
+def delete_field(obj_id, del_field, key=None):
+    """Drop in for ff_utils.delete_field with an auth dict"""
+    if isinstance(obj_id, dict):
+        obj_id = obj_id['uuid']
+    res = None
+    with portal_stats.track('delete', portal_stats.endpoint_class(obj_id)):
+        try:
+            res = get_session(key).delete_field(obj_id, del_field)
+            return res
+        finally:
+            _invalidate_cached(key, obj_id, res)
+
+
+def _tracked_iter(call_type, endpoint, results):
+    """Yield from results recording the time spent fetching them as one call"""
+    recorder = portal_stats.get_recorder()
+    seconds = 0.0
+    nbytes = 0
+    error = None
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                res = next(results)
+            except StopIteration:
+                return
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                seconds += time.perf_counter() - start
+            nbytes += len(json.dumps(res))
+            yield res
+    finally:
+        recorder.record(call_type, endpoint, seconds, nbytes, error=error)
+
+
+def search_metadata(search, key, page_limit=50, is_generator=False):
+    """ff_utils.search_metadata recorded in portal_stats as one call"""
+    if portal_stats.get_recorder() is None:
+        return ff_utils.search_metadata(search, key, page_limit=page_limit, is_generator=is_generator)
+    endpoint = search.split('?')[0].strip('/')
+    if is_generator:
+        return _tracked_iter('search', endpoint, ff_utils.search_metadata(
+            search, key, page_limit=page_limit, is_generator=True))
+    with portal_stats.track('search', endpoint) as call:
+        res = ff_utils.search_metadata(search, key, page_limit=page_limit)
+        call['bytes'] += len(json.dumps(res))
+    return res
+
+
+def _es_hits(uuids, filters, sources, chunk_size, key):
+    """The query of ff_utils.get_es_metadata sent with the shared ES client of the server"""
+    es_client, index = get_es_connection(key)
+    uuids = list(uuids)
+    for i in range(0, len(uuids), chunk_size):
+        must = [{'terms': {'_id': uuids[i:i + chunk_size]}}]
+        must_not = []
+        for field, vals in (filters or {}).items():
+            vals = vals if isinstance(vals, list) else [vals]
+            terms = [v for v in vals if not v.startswith('!')]
+            not_terms = [v[1:] for v in vals if v.startswith('!')]
+            if terms:
+                must.append({'terms': {'embedded.' + field + '.raw': terms}})
+            if not_terms:
+                must_not.append({'terms': {'embedded.' + field + '.raw': not_terms}})
+        query = {'query': {'bool': {'must': must, 'must_not': must_not}}, 'sort': [{'_id': {'order': 'desc'}}]}
+        if sources:
+            query['_source'] = sources
+        for page in ff_utils.get_es_search_generator(es_client, index, query, page_size=chunk_size):
+            for hit in page:
+                yield hit['_source']
+
+
+def get_es_metadata(uuids, es_client=None, filters=None, sources=None, chunk_size=200, key=None,
+                    is_generator=False):
+    """ff_utils.get_es_metadata using the shared ES client of the server unless es_client
+        is given - recorded in portal_stats as one call"""
+    if es_client is not None:
+        results = ff_utils.get_es_metadata(uuids, es_client=es_client, filters=filters, sources=sources,
+                                           chunk_size=chunk_size, key=key, is_generator=True)
+    else:
+        results = _es_hits(uuids, filters, sources, chunk_size, key)
+    if portal_stats.get_recorder() is None:
+        return results if is_generator else list(results)
+    if is_generator:
+        return _tracked_iter('es', 'es', results)
+    with portal_stats.track('es', 'es') as call:
+        res = list(results)
+        call['bytes'] += len(json.dumps(res))
+    return res
+
+
+def does_key_exist(s3_utils, key, bucket=None):
+    """s3Utils.does_key_exist (an S3 head request) recorded in portal_stats"""
+    with portal_stats.track('s3_head', bucket or s3_utils.outfile_bucket):
+        return s3_utils.does_key_exist(key, bucket)
@@ -0,0 +1,203 @@
+'''Request level timing of portal, ES and S3 calls
+    The wrappers in portal_client record every call they make here - its latency, the
+    bytes received, what kind of endpoint it was and how many times it had to be retried.
+    Latencies go in a log scale histogram per call type so memory use stays flat however
+    many calls a run makes.  When the process exits a table of p50/p95/p99 per call type
+    is printed, which together with the total wall time shows if a script is bound by
+    round trips or by its own work.
+
+    Turn it on with enable() or by setting the environment variable PORTAL_STATS=1.
+    enable(trace_file=...) or PORTAL_STATS_TRACE=file.jsonl also writes a line per call.
+'''
+import os
+import re
+import sys
+import json
+import math
+import time
+import atexit
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+ENV_VAR = 'PORTAL_STATS'
+TRACE_ENV_VAR = 'PORTAL_STATS_TRACE'
+# histogram buckets are 5% wide
+BUCKET_BASE = 1.05
+
+_UUID_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+_ACCESSION_RE = re.compile(r'^4DN[A-Z]{2}[0-9A-Z]{7}$')
+
+_local = threading.local()
+_recorder = None
+
+
+def endpoint_class(obj_id):
+    """Rough grouping of a request path eg. item, search, profiles, files-fastq"""
+    path = obj_id.split('?')[0].strip('/')
+    first = path.split('/')[0] if path else ''
+    if not first or _UUID_RE.match(first) or _ACCESSION_RE.match(first) or ':' in first:
+        return 'item'
+    return first
+
+
+class LatencyHistogram(object):
+    """Counts of latencies in log scale buckets - percentiles are accurate to a bucket"""
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        ms = max(seconds * 1000, 0.001)
+        self.buckets[int(math.floor(math.log(ms, BUCKET_BASE)))] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, pct):
+        """Latency in ms at pct - the upper edge of the bucket it falls in"""
+        if not self.count:
+            return 0.0
+        rank = max(int(math.ceil(pct / 100.0 * self.count)), 1)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return BUCKET_BASE ** (bucket + 1)
+        return 0.0  # pragma: no cover
+
+
+class CallStats(object):
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.bytes = 0
+        self.retries = 0
+        self.errors = 0
+        self.endpoints = Counter()
+
+
+class StatsRecorder(object):
+    """Thread safe store of the stats for each call type"""
+
+    def __init__(self, trace_file=None):
+        self.started = time.time()
+        self.calls = OrderedDict()
+        self.trace_file = trace_file
+        self._trace = open(trace_file, 'a', buffering=1) if trace_file else None
+        self._lock = threading.Lock()
+
+    def record(self, call_type, endpoint, seconds, nbytes=0, retries=0, error=None):
+        with self._lock:
+            stats = self.calls.get(call_type)
+            if stats is None:
+                stats = self.calls[call_type] = CallStats()
+            stats.latency.add(seconds)
+            stats.bytes += nbytes
+            stats.retries += retries
+            stats.endpoints[endpoint] += 1
+            if error:
+                stats.errors += 1
+            if self._trace is not None:
+                self._trace.write(json.dumps({
+                    'time': time.time(), 'call': call_type, 'endpoint': endpoint, 'seconds': round(seconds, 6),
+                    'bytes': nbytes, 'retries': retries, 'error': error,
+                    'thread': threading.current_thread().name}) + '\n')
+
+    def summary_rows(self):
+        rows = []
+        with self._lock:
+            for call_type, stats in self.calls.items():
+                lat = stats.latency
+                rows.append(OrderedDict([
+                    ('call', call_type), ('count', lat.count), ('total_s', lat.total),
+                    ('p50_ms', lat.percentile(50)), ('p95_ms', lat.percentile(95)), ('p99_ms', lat.percentile(99)),
+                    ('kb', stats.bytes / 1024.0), ('retries', stats.retries), ('errors', stats.errors),
+                    ('top_endpoint', stats.endpoints.most_common(1)[0][0] if stats.endpoints else '')]))
+        return rows
+
+    def report(self, out=None):
+        out = out or sys.stderr
+        rows = self.summary_rows()
+        if not rows:
+            return
+        wall = time.time() - self.started
+        in_calls = sum(r['total_s'] for r in rows)
+        out.write('\nPORTAL CALLS - %.1fs wall time, %.1fs in calls (can overlap when threaded)\n' % (wall, in_calls))
+        out.write('%-10s %8s %9s %9s %9s %9s %11s %7s %6s  %s\n' % (
+            'call', 'count', 'total_s', 'p50_ms', 'p95_ms', 'p99_ms', 'kb', 'retries', 'errors', 'top_endpoint'))
+        for r in rows:
+            out.write('%-10s %8d %9.2f %9.1f %9.1f %9.1f %11.1f %7d %6d  %s\n' % tuple(r.values()))
+        if self.trace_file:
+            out.write('trace written to %s\n' % self.trace_file)
+
+    def close(self):
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+
+def enable(trace_file=None, report_at_exit=True):
+    """Start recording calls - returns the StatsRecorder"""
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+    _recorder = StatsRecorder(trace_file)
+    if report_at_exit:
+        atexit.register(_report_at_exit, _recorder)
+    return _recorder
+
+
+def disable():
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+    _recorder = None
+
+
+def get_recorder():
+    return _recorder
+
+
+def _report_at_exit(recorder):
+    if recorder is _recorder:
+        recorder.report()
+        recorder.close()
+
+
+@contextmanager
+def track(call_type, endpoint=''):
+    """Time the calls made in the with block as one call of call_type
+        yields a dict that the request layer adds bytes and attempts to
+        - see note_attempt - or None when stats are off"""
+    recorder = _recorder
+    if recorder is None:
+        yield None
+        return
+    call = {'bytes': 0, 'attempts': 0}
+    outer = getattr(_local, 'call', None)
+    _local.call = call
+    error = None
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _local.call = outer
+        recorder.record(call_type, endpoint, time.perf_counter() - start,
+                        call['bytes'], max(call['attempts'] - 1, 0), error)
+
+
+def note_attempt(nbytes=0):
+    """Called for each http request sent on behalf of the call being tracked"""
+    call = getattr(_local, 'call', None)
+    if call is not None:
+        call['attempts'] += 1
+        call['bytes'] += nbytes
+
+
+if os.environ.get(ENV_VAR) or os.environ.get(TRACE_ENV_VAR):
+    enable(trace_file=os.environ.get(TRACE_ENV_VAR))
@@ -0,0 +1,188 @@
+'''Walks the provenance of files - their qcs, the workflow runs they went into or came out
+    of and the outputs and qcs of those runs.
+
+    A ProvenanceWalker gets the items a level at a time with bulk ES requests (the files,
+    then all their runs, then with depth > 1 the output files of those runs ...) and keeps
+    what it has got so each file and run is only fetched once however many walks it is
+    used for - use one walker for all the files of a set.  Items not in ES yet are got from
+    the portal one at a time.
+
+    A walk returns a ProvenanceGraph - the items found with their type and the links between
+    them as (from, relation, to) - file quality_metric qc, run input file, run output file
+    and run qc qc.
+'''
+from collections import OrderedDict
+from functions import portal_client as pc
+from functions.script_utils import is_uuid
+
+FILE_SOURCES = ['uuid', 'embedded.@type', 'embedded.quality_metric.uuid', 'embedded.quality_metric.@type',
+                'embedded.workflow_run_inputs.uuid', 'embedded.workflow_run_inputs.@type',
+                'embedded.workflow_run_outputs.uuid', 'embedded.workflow_run_outputs.@type']
+RUN_SOURCES = ['uuid', 'embedded.@type', 'embedded.input_files.value.uuid', 'embedded.input_files.value.@type',
+               'embedded.output_files.value.uuid', 'embedded.output_files.value.@type',
+               'embedded.output_files.value_qc.uuid', 'embedded.output_files.value_qc.@type',
+               'embedded.output_quality_metrics.value.uuid', 'embedded.output_quality_metrics.value.@type',
+               'embedded.quality_metric.uuid', 'embedded.quality_metric.@type']
+
+
+def _linked(val):
+    """(uuid, type) of an embedded linked item - type is None if it wasn't embedded"""
+    if isinstance(val, dict):
+        return val.get('uuid'), (val.get('@type') or [None])[0]
+    return val, None
+
+
+def file_info(resp):
+    """What the walk needs from the embedded frame of a file"""
+    qc = _linked(resp.get('quality_metric')) if resp.get('quality_metric') else None
+    return {'uuid': resp['uuid'], 'type': (resp.get('@type') or ['File'])[0], 'qc': qc,
+            'input_of': [_linked(w) for w in resp.get('workflow_run_inputs') or []],
+            'output_of': [_linked(w) for w in resp.get('workflow_run_outputs') or []]}
+
+
+def run_info(resp):
+    """What the walk needs from the embedded frame of a workflow run"""
+    outputs = []
+    qcs = []
+    for o in resp.get('output_files') or []:
+        if o.get('value'):
+            outputs.append(_linked(o['value']))
+        elif o.get('value_qc'):
+            qcs.append(_linked(o['value_qc']))
+    for qc in resp.get('output_quality_metrics') or []:
+        if qc.get('value'):
+            qcs.append(_linked(qc['value']))
+    if resp.get('quality_metric'):
+        qcs.append(_linked(resp['quality_metric']))
+    inputs = [_linked(i['value']) for i in resp.get('input_files') or [] if i.get('value')]
+    return {'uuid': resp['uuid'], 'type': (resp.get('@type') or ['WorkflowRun'])[0],
+            'inputs': inputs, 'outputs': outputs, 'qcs': qcs}
+
+
+class ProvenanceGraph(object):
+    """Items by uuid with their type in the order found and the links between them"""
+
+    def __init__(self):
+        self.nodes = OrderedDict()
+        self.edges = []
+        self._edge_set = set()
+
+    def add_node(self, uuid, item_type=None):
+        if uuid not in self.nodes or (item_type and not self.nodes[uuid]):
+            self.nodes[uuid] = item_type
+        return uuid
+
+    def add_edge(self, src, relation, dst):
+        edge = (src, relation, dst)
+        if edge not in self._edge_set:
+            self._edge_set.add(edge)
+            self.edges.append(edge)
+
+    def uuids(self):
+        return list(self.nodes)
+
+    def of_type(self, prefix):
+        """uuids of the items whose type starts with prefix eg. File, WorkflowRun or QualityMetric"""
+        return [u for u, t in self.nodes.items() if t and t.startswith(prefix)]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, uuid):
+        return uuid in self.nodes
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+
+class ProvenanceWalker(object):
+    def __init__(self, auth, chunk_size=200):
+        self.auth = auth
+        self.chunk_size = chunk_size
+        self.files = {}
+        self.runs = {}
+        self._ids = {}
+
+    def _fetch(self, ids, memo, sources, make_info):
+        """Get the items not in memo yet - returns the infos of ids in order"""
+        todo = [i for i in OrderedDict.fromkeys(ids) if self._ids.get(i, i) not in memo]
+        uuids = [i for i in todo if is_uuid(i)]
+        if uuids:
+            for hit in pc.get_es_metadata(uuids, sources=sources, chunk_size=self.chunk_size,
+                                          key=self.auth, is_generator=True):
+                memo[hit['uuid']] = make_info(dict(hit.get('embedded') or {}, uuid=hit['uuid']))
+        for iid in todo:
+            if iid not in memo:
+                # not a uuid or not in ES yet
+                resp = pc.get_metadata(iid, self.auth)
+                memo[resp['uuid']] = make_info(resp)
+                self._ids[iid] = resp['uuid']
+        return [memo[self._ids.get(i, i)] for i in ids]
+
+    def fetch_files(self, ids):
+        return self._fetch(ids, self.files, FILE_SOURCES, file_info)
+
+    def fetch_runs(self, ids):
+        return self._fetch(ids, self.runs, RUN_SOURCES, run_info)
+
+    def add_file(self, resp):
+        """Use a file already got (embedded frame) rather than fetching it"""
+        if resp['uuid'] not in self.files:
+            self.files[resp['uuid']] = file_info(resp)
+        return resp['uuid']
+
+    def add_run(self, resp):
+        """Use a workflow run already got (embedded frame) rather than fetching it"""
+        if resp['uuid'] not in self.runs:
+            self.runs[resp['uuid']] = run_info(resp)
+        return resp['uuid']
+
+    @staticmethod
+    def _add_run(graph, run):
+        graph.add_node(run['uuid'], run['type'])
+        for input_uuid, _ in run['inputs']:
+            if input_uuid in graph:
+                graph.add_edge(run['uuid'], 'input', input_uuid)
+        for out_uuid, out_type in run['outputs']:
+            graph.add_node(out_uuid, out_type)
+            graph.add_edge(run['uuid'], 'output', out_uuid)
+        for qc_uuid, qc_type in run['qcs']:
+            graph.add_node(qc_uuid, qc_type)
+            graph.add_edge(run['uuid'], 'qc', qc_uuid)
+
+    def walk(self, file_ids, depth=1, graph=None):
+        """The provenance graph of the files - their qcs, the runs they are an input or
+            output of and the outputs and qcs of those runs.  With depth > 1 the output
+            files of the runs are walked in the same way, depth times in all"""
+        graph = ProvenanceGraph() if graph is None else graph
+        files = self.fetch_files(file_ids)
+        walked = set()
+        walked_runs = set()
+        for level in range(depth):
+            run_ids = OrderedDict()
+            for info in files:
+                walked.add(info['uuid'])
+                graph.add_node(info['uuid'], info['type'])
+                if info['qc']:
+                    graph.add_node(*info['qc'])
+                    graph.add_edge(info['uuid'], 'quality_metric', info['qc'][0])
+                for run_uuid, run_type in info['input_of'] + info['output_of']:
+                    graph.add_node(run_uuid, run_type)
+                    if run_uuid not in walked_runs:
+                        run_ids[run_uuid] = None
+            next_files = OrderedDict()
+            for run in self.fetch_runs(list(run_ids)):
+                walked_runs.add(run['uuid'])
+                self._add_run(graph, run)
+                next_files.update((o, None) for o, _ in run['outputs'] if o not in walked)
+            if not next_files or level == depth - 1:
+                break
+            files = self.fetch_files(list(next_files))
+        return graph
+
+    def walk_runs(self, run_ids, graph=None):
+        """The runs with their output files and qcs"""
+        graph = ProvenanceGraph() if graph is None else graph
+        for run in self.fetch_runs(run_ids):
+            self._add_run(graph, run)
+        return graph
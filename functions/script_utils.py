@@ -3,9 +3,13 @@ import copy
 import argparse
 import sys
 import ast
+import re
 import json
 from pathlib import Path
-from dcicutils.ff_utils import search_metadata, get_metadata
+from collections import OrderedDict, deque
+from collections.abc import MutableSet
+from concurrent.futures import ThreadPoolExecutor
+from functions.portal_client import get_metadata, search_metadata, get_es_metadata
 
 
 def create_ff_arg_parser():
@@ -39,6 +43,30 @@ def create_input_arg_parser():
     return input_arg_parser
 
 
+def create_stream_arg_parser():
+    stream_arg_parser = argparse.ArgumentParser(add_help=False)
+    stream_arg_parser.add_argument('--stream',
+                                   default=False,
+                                   action='store_true',
+                                   help="With --search start on the items as each page of results arrives \
+                                   rather than after getting them all - only safe if the update does not \
+                                   change which items the search finds")
+    return stream_arg_parser
+
+
+def create_journal_arg_parser():
+    journal_arg_parser = argparse.ArgumentParser(add_help=False)
+    journal_arg_parser.add_argument('--journal',
+                                    default=None,
+                                    help="A file to record the result of each patch in - it is appended to \
+                                    so the same file can be used for re-runs")
+    journal_arg_parser.add_argument('--resume',
+                                    default=False,
+                                    action='store_true',
+                                    help="Skip the patches that the --journal file records as successful")
+    return journal_arg_parser
+
+
 def find_keyname_in_keyfile(keyname, keyfile):
     if isinstance(keyfile, dict):
         keys = keyfile
@@ -80,6 +108,38 @@ def get_item_ids_from_args(id_input, auth, is_search=False):
         return id_input
 
 
+def iter_item_ids_from_args(id_input, auth, is_search=False, stream_search=False):
+    """Lazy version of get_item_ids_from_args - ids are yielded as the file is read so
+        work can start straight away.  Repeated ids and blank lines are skipped.
+        All the search results are got before the first id is yielded as the pages are
+        got by offset - patching items out of the search while it is read would shift later
+        pages and skip items.  stream_search yields them as each page arrives - only use it
+        when the updates do not change which items the search finds (scripts' --stream)"""
+    seen = set()
+    if is_search:
+        query = 'search/?' + id_input[0]
+        ids = (r.get('uuid') for r in search_metadata(query, auth, is_generator=True))
+        if not stream_search:
+            ids = list(ids)
+    else:
+        ids = _iter_ids_from_file_or_list(id_input)
+    for iid in ids:
+        if iid and iid not in seen:
+            seen.add(iid)
+            yield iid
+
+
+def _iter_ids_from_file_or_list(id_input):
+    try:
+        inf = open(id_input[0])
+    except FileNotFoundError:
+        yield from id_input
+        return
+    with inf:
+        for line in inf:
+            yield line.strip()
+
+
 def get_item_if_you_can(auth, value, itype=None):
     try:
         value.get('uuid')
@@ -116,20 +176,33 @@ def is_uuid(value):
         return False
 
 
+# values of a field per search so the url stays well under server limits
+SEARCH_CHUNK_SIZE = 40
+UUID_RE = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+
+def _collect_uuids(val, vals):
+    if isinstance(val, str):
+        if len(val) == 36 and UUID_RE.fullmatch(val):
+            vals.append(val)
+    elif isinstance(val, dict):
+        for key, v in val.items():
+            # attachments can be big blobs that won't have linked uuids
+            if key == 'attachment':
+                continue
+            _collect_uuids(v, vals)
+    elif isinstance(val, (list, tuple)):
+        for v in val:
+            _collect_uuids(v, vals)
+
+
 def find_uuids(val):
-    """Find any uuids in the value"""
+    """Find any uuids in the value - nested dicts and lists are walked and any
+        string that is a uuid is returned in the order found
+        values of 'attachment' fields are skipped"""
     vals = []
-    if not val:
-        return []
-    elif isinstance(val, str):
-        if is_uuid(val):
-            vals = [val]
-        else:
-            return []
-    else:
-        text = str(val)
-        text_list = [i for i in text. split("'") if len(i) == 36]
-        vals = [i for i in text_list if is_uuid(i)]
+    if val:
+        _collect_uuids(val, vals)
     return vals
 
 
@@ -145,6 +218,115 @@ def get_item_type(auth, item):
     return None
 
 
+def bulk_fetch(auth, ids, sources, make_item, resolved=None, add_on='', chunk_size=200):
+    """Get many items with bulk ES requests - make_item turns an ES hit with the sources
+        into the item.  resolved maps ids to uuids (by default uuid ids are used as is) and
+        ids that are not in it, not in ES yet or in an ES request that fails are got one at
+        a time with add_on.  Returns an OrderedDict of id to item - None if it can't be got"""
+    if resolved is None:
+        resolved = {i: i for i in ids if is_uuid(i)}
+    found = {}
+    uuids = list(OrderedSet(resolved.values()))
+    if uuids:
+        try:
+            for hit in get_es_metadata(uuids, sources=sources, chunk_size=chunk_size, key=auth, is_generator=True):
+                found[hit.get('uuid')] = make_item(hit)
+        except Exception as e:
+            print("ES request for %d items failed - getting them one at a time: %s" % (len(uuids), e),
+                  file=sys.stderr)
+    results = OrderedDict()
+    for iid in OrderedSet(ids):
+        item = found.get(resolved.get(iid))
+        if item is None:
+            try:
+                item = get_metadata(iid, auth, add_on=add_on)
+            except Exception:
+                item = None
+        results[iid] = item
+    return results
+
+
+class ItemInfoResolver(object):
+    """Gets the @type and the given raw fields of many items with bulk ES requests and
+        keeps them so each item is only looked up once.  Ids that are not uuids, or items
+        not yet in ES, are got from the portal one at a time"""
+
+    def __init__(self, auth, fields=('tags',), chunk_size=200):
+        self.auth = auth
+        self.fields = list(fields)
+        self.chunk_size = chunk_size
+        self.cache = {}
+
+    def _info(self, item):
+        info = {'uuid': item.get('uuid'), '@type': item.get('@type')}
+        for f in self.fields:
+            if f in item:
+                info[f] = item[f]
+        return info
+
+    @staticmethod
+    def _hit_item(hit):
+        item = dict(hit.get('properties') or {}, uuid=hit.get('uuid'))
+        item['@type'] = (hit.get('embedded') or {}).get('@type')
+        return item
+
+    def resolve(self, ids):
+        """Returns a dict of id to {'uuid', '@type', fields...} - None for ids that can't be got"""
+        todo = [i for i in OrderedSet(ids) if i not in self.cache]
+        if todo:
+            sources = ['uuid', 'embedded.@type'] + ['properties.' + f for f in self.fields]
+            items = bulk_fetch(self.auth, todo, sources, self._hit_item, chunk_size=self.chunk_size)
+            for iid, item in items.items():
+                if item is None:
+                    print("Can't get item %s" % iid)
+                self.cache[iid] = None if item is None else self._info(item)
+        return {i: self.cache[i] for i in ids}
+
+    def get_types(self, ids):
+        """Returns a dict of id to its most specific @type or None"""
+        types = {}
+        for iid, info in self.resolve(ids).items():
+            try:
+                types[iid] = info['@type'][0]
+            except (KeyError, IndexError, TypeError):
+                print("Can't find a type for item %s" % iid)
+                types[iid] = None
+        return types
+
+
+class OrderedSet(MutableSet):
+    """A set that iterates in the order items were first added - for keeping track of
+        ids already seen without the cost of searching a list every time.
+        append is the same as add so it can be used where a list was before"""
+
+    def __init__(self, iterable=()):
+        self._items = OrderedDict.fromkeys(iterable)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item):
+        self._items[item] = None
+
+    append = add
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def discard(self, item):
+        self._items.pop(item, None)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, list(self._items))
+
+
 def filter_dict_by_value(dictionary, values, include=True):
     """Will filter items from a dictionary based on values
         can be either an inclusive or exclusive filter
@@ -245,12 +427,137 @@ def get_linked_items(auth, itemid, found_items={},
     return found_items
 
 
-def chunk_list(item_list, chunk_size=None):
-    list_length = len(item_list)
-    curr_pos = 0
-    while curr_pos < list_length:
-        slice_for = chunk_size if (chunk_size and chunk_size <= (list_length - curr_pos)) else list_length - curr_pos
-        new_end = curr_pos + slice_for
-        # chunk = item_list[curr_pos: new_end]
-        # do something with the chunk
-        curr_pos = new_end
+def _find_linked_uuids(raw_item):
+    """Find the uuids of linked items in a raw frame item - attachments are skipped"""
+    id_list = []
+    for key, val in raw_item.items():
+        if key == 'attachment':
+            continue
+        # could be more than one item in a value
+        foundids = find_uuids(val)
+        if foundids:
+            id_list.extend(foundids)
+    return list(set(id_list))
+
+
+def _fetch_linked_item_info(auth, itemid):
+    """Get what is needed to expand a single node when looking for linked items
+        returns a dict with the item type, the raw frame of the item and the uuids of
+        any workflow_run_inputs or None if the item can't be retrieved or typed"""
+    res = get_metadata(itemid, auth, add_on='frame=raw')
+    if 'error' in res['status']:
+        return None
+    try:
+        obj = get_metadata(itemid, auth)
+        obj_type = obj.get('@type')[0]
+    except (AttributeError, KeyError, TypeError):  # noqa: E722
+        print("Can't find a type for item %s" % itemid)
+        return None
+    wfrs = []
+    if obj_type in ['FileFastq', 'FileProcessed']:
+        wfrs = [wfr.get('uuid') for wfr in obj.get('workflow_run_inputs') or []]
+    return {'type': obj_type, 'raw': res, 'wfrs': wfrs}
+
+
+# the parts of the ES document needed to expand a node - properties is the raw frame
+LINKED_ITEM_ES_SOURCES = ['uuid', 'properties.*', 'embedded.@type', 'embedded.workflow_run_inputs.uuid']
+
+
+def _fetch_linked_item_infos_es(auth, itemids):
+    """Bulk version of _fetch_linked_item_info that gets the raw frame and the type of
+        all the uuids in itemids from ES with one request per chunk of 200.
+        Returns a dict keyed by uuid - items that are not found in ES (eg. not yet indexed)
+        are not included in the result"""
+    infos = {}
+    uuids = [i for i in itemids if is_uuid(i)]
+    if not uuids:
+        return infos
+    for hit in get_es_metadata(uuids, sources=LINKED_ITEM_ES_SOURCES, key=auth, is_generator=True):
+        uid = hit.get('uuid')
+        embedded = hit.get('embedded') or {}
+        try:
+            obj_type = embedded['@type'][0]
+        except (KeyError, IndexError, TypeError):
+            print("Can't find a type for item %s" % uid)
+            infos[uid] = None
+            continue
+        wfrs = []
+        if obj_type in ['FileFastq', 'FileProcessed']:
+            wfrs = [wfr.get('uuid') for wfr in embedded.get('workflow_run_inputs') or []]
+        infos[uid] = {'type': obj_type, 'raw': hit.get('properties') or {}, 'wfrs': wfrs}
+    return infos
+
+
+def _fetch_frontier(executor, auth, frontier, use_es=False):
+    """Get the info needed to expand every item in the frontier - from ES in bulk if use_es
+        and otherwise (or for any items not found in ES) from the portal using the executor"""
+    infos = {}
+    if use_es:
+        infos.update(_fetch_linked_item_infos_es(auth, frontier))
+    to_fetch = [i for i in frontier if i not in infos]
+    infos.update(zip(to_fetch, executor.map(lambda i: _fetch_linked_item_info(auth, i), to_fetch)))
+    return infos
+
+
+def get_linked_items_parallel(auth, itemid, found_items=None, no_children=None, max_workers=8, use_es=False):
+    """Breadth first version of get_linked_items that fetches all the items at the same
+        depth using a pool of max_workers threads so run time scales with the depth of
+        the graph rather than the number of linked items.
+        Returns the same {uuid: type} dict and honors no_children in the same way.
+        If use_es is True each level is fetched with bulk ES requests that return both the
+        type and the raw frame of an item rather than 2 portal requests per item."""
+    if found_items is None:
+        found_items = {}
+    if no_children is None:
+        no_children = ['Publication', 'Lab', 'User', 'Award']
+    frontier = [itemid]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while frontier:
+            # items may have been found since being queued eg. as workflow_run_inputs
+            frontier = [i for i in frontier if not found_items.get(i)]
+            infos = _fetch_frontier(executor, auth, frontier, use_es)
+            next_frontier = []
+            queued = set()
+            for iid in frontier:
+                info = infos.get(iid)
+                if info is None:
+                    continue
+                found_items[iid] = info['type']
+                if info['type'] in no_children:
+                    continue
+                for wfr in info['wfrs']:
+                    found_items[wfr] = 'WorkflowRun'
+                for uid in _find_linked_uuids(info['raw']):
+                    if uid not in found_items and uid not in queued:
+                        queued.add(uid)
+                        next_frontier.append(uid)
+            frontier = next_frontier
+    return found_items
+
+
+def imap_ordered(fxn, items, workers=4, window=None):
+    """Yield fxn(item) for each item in order while up to workers calls run at once.
+        Only window (default workers * 2) results are held at a time so items can be a
+        long generator.  An exception from fxn is raised when its result is reached"""
+    window = window or max(workers, 1) * 2
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for item in items:
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            pending.append(executor.submit(fxn, item))
+        while pending:
+            yield pending.popleft().result()
+
+
+def chunk_list(items, chunk_size=None):
+    """Yield successive lists of chunk_size items from any iterable - the last can be
+        shorter - a single chunk with everything if no chunk_size"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if chunk_size and len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -1,5 +1,4 @@
-from dcicutils import ff_utils
-from dcicutils import s3Utils
+from functions import portal_client as pc
 from datetime import datetime
 import json
 from IPython.core.display import display, HTML
@@ -64,8 +63,8 @@ def get_attribution(file_json):
 
 
 def extract_file_info(obj_id, arg_name, env, rename=[]):
-    auth = ff_utils.get_authentication_with_server({}, ff_env=env)
-    my_s3_util = s3Utils(env=env)
+    auth = pc.get_env_auth(env)
+    my_s3_util = pc.get_s3_utils(env)
 
     raw_bucket = my_s3_util.raw_file_bucket
     out_bucket = my_s3_util.outfile_bucket
@@ -82,7 +81,7 @@ def extract_file_info(obj_id, arg_name, env, rename=[]):
         uuid = []
         buckets = []
         for obj in obj_id:
-            metadata = ff_utils.get_metadata(obj, key=auth)
+            metadata = pc.get_metadata(obj, auth)
             object_key.append(metadata['display_title'])
             uuid.append(metadata['uuid'])
             # get the bucket
@@ -105,7 +104,7 @@ def extract_file_info(obj_id, arg_name, env, rename=[]):
 
     # if obj_id is a string
     else:
-        metadata = ff_utils.get_metadata(obj_id, key=auth)
+        metadata = pc.get_metadata(obj_id, auth)
         template['object_key'] = metadata['display_title']
         template['uuid'] = metadata['uuid']
         # get the bucket
@@ -120,7 +119,7 @@ def extract_file_info(obj_id, arg_name, env, rename=[]):
 
 
 def run_json(input_files, env, wf_info, run_name):
-    my_s3_util = s3Utils(env=env)
+    my_s3_util = pc.get_s3_utils(env)
     out_bucket = my_s3_util.outfile_bucket
     """Creates the trigger json that is used by foufront endpoint.
     """
@@ -153,8 +152,8 @@ def run_json(input_files, env, wf_info, run_name):
 
 
 def find_pairs(my_rep_set, my_env, lookfor='pairs', exclude_miseq=True):
-    auth = ff_utils.get_authentication_with_server({}, ff_env=my_env)
-    my_s3_util = s3Utils(env=my_env)
+    auth = pc.get_env_auth(my_env)
+    my_s3_util = pc.get_s3_utils(my_env)
     """Find fastq files from experiment set, exclude miseq.
     """
     report = {}
@@ -180,7 +179,7 @@ def find_pairs(my_rep_set, my_env, lookfor='pairs', exclude_miseq=True):
             enzymes.append(enzyme['display_title'])
 
         for fastq_file in exp_files:
-            file_resp = ff_utils.get_metadata(fastq_file['uuid'], key=auth)
+            file_resp = pc.get_metadata(fastq_file['uuid'], auth)
             if not file_resp.get('file_size'):
                 print("WARNING!", file_resp['accession'], 'does not have filesize')
             else:
@@ -204,7 +203,7 @@ def find_pairs(my_rep_set, my_env, lookfor='pairs', exclude_miseq=True):
                 continue
             # check if file is in s3
 
-            head_info = my_s3_util.does_key_exist(file_resp['upload_key'], my_s3_util.raw_file_bucket)
+            head_info = pc.does_key_exist(my_s3_util, file_resp['upload_key'], my_s3_util.raw_file_bucket)
 
             if not head_info:
                 print(file_resp['accession'], "does not have a file in S3")
@@ -278,7 +277,7 @@ def get_wfr_out(file_id, wfr_name, auth, versions, md_qc=False, run=100):
     file_format:file_id, else, will return the status. Some runs, like qc and md5,
     does not have any file_format output, so they will simply return 'complete'
     """
-    emb_file = ff_utils.get_metadata(file_id, key=auth)
+    emb_file = pc.get_metadata(file_id, key=auth)
     workflows = emb_file.get('workflow_run_inputs')
     wfr = {}
     run_status = 'did not run'
@@ -304,7 +303,7 @@ def get_wfr_out(file_id, wfr_name, auth, versions, md_qc=False, run=100):
     my_workflows = sorted(my_workflows, key=lambda k: k['run_hours'])
     last_wfr = [i for i in my_workflows if i['run_type'] == wfr_name][0]
 
-    wfr = ff_utils.get_metadata(last_wfr['uuid'], key=auth)
+    wfr = pc.get_metadata(last_wfr['uuid'], key=auth)
     run_duration = last_wfr['run_hours']
     run_status = wfr['run_status']
 
@@ -343,7 +342,7 @@ def get_wfr_out_file(file_id, wfr_name, auth, versions, md_qc=False, run=100):
     argument_name:file_id, else, will return the status. Some runs, like qc and md5,
     does not have any file_format output, so they will simply return 'complete'
     """
-    emb_file = ff_utils.get_metadata(file_id, key=auth)
+    emb_file = pc.get_metadata(file_id, key=auth)
     workflows = emb_file.get('workflow_run_inputs')
     wfr = {}
     run_status = 'did not run'
@@ -369,7 +368,7 @@ def get_wfr_out_file(file_id, wfr_name, auth, versions, md_qc=False, run=100):
     my_workflows = sorted(my_workflows, key=lambda k: k['run_hours'])
     last_wfr = [i for i in my_workflows if i['run_type'] == wfr_name][0]
 
-    wfr = ff_utils.get_metadata(last_wfr['uuid'], key=auth)
+    wfr = pc.get_metadata(last_wfr['uuid'], key=auth)
     run_duration = last_wfr['run_hours']
     run_status = wfr['run_status']
 
@@ -402,7 +401,7 @@ def get_wfr_out_file(file_id, wfr_name, auth, versions, md_qc=False, run=100):
 def add_processed_files(item_id, list_pc, auth):
     # patch the exp or set
     patch_data = {'processed_files': list_pc}
-    ff_utils.patch_metadata(patch_data, obj_id=item_id, key=auth)
+    pc.patch_metadata(patch_data, obj_id=item_id, key=auth)
     return
 
 
@@ -415,7 +414,7 @@ def add_preliminary_processed_files(item_id, list_pc, auth, run_type="hic"):
         pc_set_title = titles[run_type]
     else:
         pc_set_title = run_type
-    resp = ff_utils.get_metadata(item_id, key=auth)
+    resp = pc.get_metadata(item_id, key=auth)
 
     # check if this items are in processed files field
     # extract essential for comparison, unfold all possible ids into a list, and compare list_pc to that one
@@ -448,7 +447,7 @@ def add_preliminary_processed_files(item_id, list_pc, auth, run_type="hic"):
                 return
 
     # we need raw to get the existing piece, to patch back with the new ones
-    patch_data = ff_utils.get_metadata(item_id, key=auth, add_on='frame=raw').get('other_processed_files')
+    patch_data = pc.get_metadata(item_id, key=auth, add_on='frame=raw').get('other_processed_files')
     if not patch_data:
         patch_data = []
 
@@ -457,23 +456,23 @@ def add_preliminary_processed_files(item_id, list_pc, auth, run_type="hic"):
                 'files': list_pc}
     patch_data.append(new_data)
     patch = {'other_processed_files': patch_data}
-    ff_utils.patch_metadata(patch, obj_id=item_id, key=auth)
+    pc.patch_metadata(patch, obj_id=item_id, key=auth)
 
 
 def release_files(set_id, list_items, auth, status=None):
     if status:
         item_status = status
     else:
-        item_status = ff_utils.get_metadata(set_id, key=auth)['status']
+        item_status = pc.get_metadata(set_id, key=auth)['status']
     # bring files to same status as experiments and sets
     if item_status in ['released', 'released to project', 'pre-release']:
         for a_file in list_items:
-            it_resp = ff_utils.get_metadata(a_file, key=auth)
+            it_resp = pc.get_metadata(a_file, key=auth)
             workflow = it_resp.get('workflow_run_outputs')
             # release the wfr that produced the file
             if workflow:
-                ff_utils.patch_metadata({"status": item_status}, obj_id=workflow[0]['uuid'], key=auth)
-            ff_utils.patch_metadata({"status": item_status}, obj_id=a_file, key=auth)
+                pc.patch_metadata({"status": item_status}, obj_id=workflow[0]['uuid'], key=auth)
+            pc.patch_metadata({"status": item_status}, obj_id=a_file, key=auth)
 
 
 def run_missing_wfr(wf_info, input_files, run_name, auth, env):
@@ -485,7 +484,7 @@ def run_missing_wfr(wf_info, input_files, run_name, auth, env):
     all_inputs = sorted(all_inputs, key=itemgetter('workflow_argument_name'))
 
     input_json = run_json(all_inputs, env, wf_info, run_name)
-    e = ff_utils.post_metadata(input_json, 'WorkflowRun/run', key=auth)
+    e = pc.post_metadata(input_json, 'WorkflowRun/run', key=auth)
 
     url = json.loads(e['input'])['_tibanna']['url']
     display(HTML("<a href='{}' target='_blank'>{}</a>".format(url, e['status'])))
@@ -494,7 +493,7 @@ def run_missing_wfr(wf_info, input_files, run_name, auth, env):
 
 def extract_nz_file(acc, auth):
     mapping = {"HindIII": "6", "DpnII": "4", "MboI": "4", "NcoI": "6"}
-    exp_resp = ff_utils.get_metadata(acc, key=auth)
+    exp_resp = pc.get_metadata(acc, key=auth)
     exp_type = exp_resp.get('experiment_type')
     # get enzyme
     nz_num = ""
@@ -554,7 +553,7 @@ def get_chip_info(f_exp_resp, my_key):
             if len(controls) != 1:
                 print('multiple control experiments')
             else:
-                cont_exp_info = ff_utils.get_metadata(controls[0]['uuid'], my_key)['experiment_sets']
+                cont_exp_info = pc.get_metadata(controls[0]['uuid'], my_key)['experiment_sets']
                 control_set = [i['accession'] for i in cont_exp_info if i['@id'].startswith('/experiment-set-replicates/')][0]
     else:
         # if no relation is present
@@ -576,7 +575,7 @@ def get_chip_files(exp_resp, my_auth):
     for a_file in exp_files:
         f_t = []
         o_t = []
-        file_resp = ff_utils.get_metadata(a_file['uuid'], my_auth)
+        file_resp = pc.get_metadata(a_file['uuid'], my_auth)
         # get pair end no
         pair_end = file_resp.get('paired_end')
         if pair_end == '2':
@@ -603,7 +602,7 @@ def get_chip_files(exp_resp, my_auth):
             f_t.append(file_resp['uuid'])
             o_t.append(file_resp['display_title'])
         else:
-            f2 = ff_utils.get_metadata(paired_with, my_auth)
+            f2 = pc.get_metadata(paired_with, my_auth)
             f_t.append(file_resp['uuid'])
             o_t.append(file_resp['display_title'])
             f_t.append(f2['uuid'])
@@ -614,7 +613,7 @@ def get_chip_files(exp_resp, my_auth):
 
 
 def run_missing_chip1(control, wf_info, organism, target_type, paired, files, obj_keys, my_env, my_key, run_name):
-    my_s3_util = s3Utils(env=my_env)
+    my_s3_util = pc.get_s3_utils(my_env)
     raw_bucket = my_s3_util.raw_file_bucket
     out_bucket = my_s3_util.outfile_bucket
 
@@ -726,14 +725,14 @@ def run_missing_chip1(control, wf_info, organism, target_type, paired, files, ob
                   }
     # r = json.dumps(input_json)
     # print(r)
-    e = ff_utils.post_metadata(input_json, 'WorkflowRun/run', key=my_key)
+    e = pc.post_metadata(input_json, 'WorkflowRun/run', key=my_key)
     url = json.loads(e['input'])['_tibanna']['url']
     display(HTML("<a href='{}' target='_blank'>{}</a>".format(url, e['status'])))
 
 
 def run_missing_chip2(control_set, wf_info, organism, target_type, paired,
                       ta, ta_xcor, ta_cnt, my_env, my_key, run_ids):
-    my_s3_util = s3Utils(env=my_env)
+    my_s3_util = pc.get_s3_utils(my_env)
     raw_bucket = my_s3_util.raw_file_bucket
     out_bucket = my_s3_util.outfile_bucket
 
@@ -818,13 +817,13 @@ def run_missing_chip2(control_set, wf_info, organism, target_type, paired,
                   }
     # r = json.dumps(input_json)
     # print(r)
-    e = ff_utils.post_metadata(input_json, 'WorkflowRun/run', key=my_key)
+    e = pc.post_metadata(input_json, 'WorkflowRun/run', key=my_key)
     url = json.loads(e['input'])['_tibanna']['url']
     display(HTML("<a href='{}' target='_blank'>{}</a>".format(url, e['status'])))
 
 
 def run_missing_atac1(wf_info, organism, paired, files, obj_keys, my_env, my_key, run_name):
-    my_s3_util = s3Utils(env=my_env)
+    my_s3_util = pc.get_s3_utils(my_env)
     raw_bucket = my_s3_util.raw_file_bucket
     out_bucket = my_s3_util.outfile_bucket
 
@@ -919,14 +918,14 @@ def run_missing_atac1(wf_info, organism, paired, files, obj_keys, my_env, my_key
                   }
     # r = json.dumps(input_json)
     # print(r)
-    e = ff_utils.post_metadata(input_json, 'WorkflowRun/run', key=my_key)
+    e = pc.post_metadata(input_json, 'WorkflowRun/run', key=my_key)
     url = json.loads(e['input'])['_tibanna']['url']
     display(HTML("<a href='{}' target='_blank'>{}</a>".format(url, e['status'])))
 
 
 def run_missing_atac2(wf_info, organism, paired, ta,
                       my_env, my_key, run_name):
-    my_s3_util = s3Utils(env=my_env)
+    my_s3_util = pc.get_s3_utils(my_env)
     raw_bucket = my_s3_util.raw_file_bucket
     out_bucket = my_s3_util.outfile_bucket
 
@@ -999,7 +998,7 @@ def run_missing_atac2(wf_info, organism, paired, ta,
                   }
     # r = json.dumps(input_json)
     # print(r)
-    e = ff_utils.post_metadata(input_json, 'WorkflowRun/run', key=my_key)
+    e = pc.post_metadata(input_json, 'WorkflowRun/run', key=my_key)
     url = json.loads(e['input'])['_tibanna']['url']
     display(HTML("<a href='{}' target='_blank'>{}</a>".format(url, e['status'])))
 
@@ -1011,12 +1010,12 @@ def select_best_2(file_list, my_key):
         return(file_list)
 
     for f in file_list:
-        f_resp = ff_utils.get_metadata(f, my_key)
+        f_resp = pc.get_metadata(f, my_key)
         qc = f_resp.get('quality_metric')
         if not qc:
             print('No qc found on file', f)
             return
-        qc_resp = ff_utils.get_metadata(qc['uuid'], my_key)
+        qc_resp = pc.get_metadata(qc['uuid'], my_key)
         try:
             score = qc_resp['nodup_flagstat_qc'][0]['mapped']
         except Exception:
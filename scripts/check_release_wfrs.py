@@ -0,0 +1,228 @@
+'''Checks the workflow runs of many files at once with the delete_wfrs rules and writes
+    a report of what would be deleted, skipped, flagged or is still running.
+
+    Input is a list of experiment sets, experiments or files (ids, a file of ids or a
+    search with --search).  All the files of the sets and experiments and all their
+    workflow runs are got with bulk ES requests up front, then the files are checked in
+    chunks by a pool of processes - nothing is deleted unless --dbupdate is used, when the
+    deletions of all the files are sent together with cleanup's DeletionPlan.
+
+    The report is tab separated - file accession, action, item and detail - with a line per
+    item to delete and per message from the checks followed by a summary.
+'''
+import sys
+import argparse
+from collections import OrderedDict, Counter
+from concurrent.futures import ProcessPoolExecutor
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import get_es_metadata, search_metadata
+from functions.cleanup import WorkflowRunStash, plan_wfr_deletions, MD5_RUNS_SEARCH
+from functions.deletion_plan import DeletionPlan, execute_plan
+from functions import script_utils as scu
+
+# what is needed from the embedded frame of the files and runs for the delete_wfrs checks
+FILE_SOURCES = ['uuid', 'embedded.@type', 'embedded.@id', 'embedded.uuid', 'embedded.accession',
+                'embedded.status', 'embedded.quality_metric.uuid', 'embedded.workflow_run_inputs.uuid',
+                'embedded.workflow_run_outputs.display_title']
+WFR_SOURCES = ['embedded.uuid', 'embedded.@id', 'embedded.display_title', 'embedded.status',
+               'embedded.run_status', 'embedded.input_files.value.uuid', 'embedded.input_files.value.accession',
+               'embedded.output_files.value.uuid', 'embedded.output_files.value_qc.uuid',
+               'embedded.quality_metric.uuid']
+# where the files and experiments of sets and experiments are
+FILE_FIELDS = ['files', 'processed_files', 'other_processed_files.files']
+EXPERIMENT_FIELDS = ['experiments_in_set']
+ACTIONS = ('delete', 'running', 'skipped', 'flagged', 'error')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        parents=[scu.create_input_arg_parser(), scu.create_ff_arg_parser()],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--workers',
+                        type=int,
+                        default=4,
+                        help="Number of processes checking files - 1 to check them in this process. Default 4")
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=500,
+                        help="Number of files given to a process at a time - default 500")
+    parser.add_argument('--outfile',
+                        help="File to write the report to - default is the screen")
+    args = parser.parse_args()
+    if args.key:
+        args.key = scu.convert_key_arg_to_dict(args.key)
+    return args
+
+
+def _field_uuids(doc, path):
+    """The uuids at the dotted path of an embedded doc - lists are followed"""
+    vals = [doc]
+    for part in path.split('.'):
+        found = []
+        for val in vals:
+            sub = val.get(part) if isinstance(val, dict) else None
+            if isinstance(sub, list):
+                found.extend(sub)
+            elif sub is not None:
+                found.append(sub)
+        vals = found
+    return [v.get('uuid') for v in vals if isinstance(v, dict) and v.get('uuid')]
+
+
+def get_file_uuids(auth, uuids):
+    """The uuids of the given files and the files of the given sets and experiments
+        - the experiments of the sets are got in a second bulk request"""
+    sources = ['uuid', 'embedded.@type'] + ['embedded.%s.uuid' % f for f in FILE_FIELDS + EXPERIMENT_FIELDS]
+    file_uuids = scu.OrderedSet()
+    seen = set()
+    todo = list(uuids)
+    while todo:
+        seen.update(todo)
+        linked = scu.OrderedSet()
+        for hit in get_es_metadata(todo, sources=sources, key=auth, is_generator=True):
+            embedded = hit.get('embedded') or {}
+            if 'File' in (embedded.get('@type') or []):
+                file_uuids.add(hit['uuid'])
+                continue
+            for field in FILE_FIELDS:
+                file_uuids.update(_field_uuids(embedded, field))
+            for field in EXPERIMENT_FIELDS:
+                linked.update(_field_uuids(embedded, field))
+        todo = [u for u in linked if u not in seen]
+    return list(file_uuids)
+
+
+def load_files(auth, file_uuids):
+    """The embedded frame of the files (only what the checks need) by uuid in the given order"""
+    found = {}
+    for hit in get_es_metadata(list(file_uuids), sources=FILE_SOURCES, key=auth, is_generator=True):
+        found[hit['uuid']] = hit.get('embedded') or {}
+    files = OrderedDict((u, found[u]) for u in file_uuids if u in found)
+    for missing in [u for u in file_uuids if u not in found]:
+        print("Can't get file %s" % missing, file=sys.stderr)
+    return files
+
+
+def _without_runs(files):
+    """Accessions of the files that delete_wfrs looks for md5 runs of with a search"""
+    return [f['accession'] for f in files if not f.get('workflow_run_inputs')
+            and f.get('@id', '').split('/')[1] not in ('files-fastq', 'files-processed')]
+
+
+def load_runs(auth, files):
+    """A WorkflowRunStash of the runs with any of the files as input and the md5 runs of
+        files that are not an input of any run - searched for a chunk of files at a time"""
+    wfr_uuids = scu.OrderedSet()
+    for file_resp in files.values():
+        wfr_uuids.update(w['uuid'] for w in file_resp.get('workflow_run_inputs') or [])
+    stash = WorkflowRunStash()
+    if wfr_uuids:
+        for hit in get_es_metadata(list(wfr_uuids), sources=WFR_SOURCES, key=auth, is_generator=True):
+            stash.add(hit['embedded'])
+    for chunk in scu.chunk_list(_without_runs(files.values()), scu.SEARCH_CHUNK_SIZE):
+        query = MD5_RUNS_SEARCH + ''.join('&input_files.value.accession=' + acc for acc in chunk)
+        for wfr in search_metadata(query, auth):
+            stash.add(wfr)
+    return stash
+
+
+def check_file(file_resp, auth, stash):
+    """Run the delete_wfrs checks on one file - returns its result and the planned steps.
+        A file is checked if it has runs or steps planned - if the checks fail part way it
+        is not and what they planned before failing is dropped"""
+    plan = DeletionPlan()
+    notes = []
+    try:
+        runs = plan_wfr_deletions(file_resp, auth, plan, stash, notes=notes)
+    except Exception as e:
+        notes = [(kind, msg) for kind, msg in notes if kind != 'delete']
+        notes.append(('error', '%s: %s' % (type(e).__name__, e)))
+        runs = None
+        plan = DeletionPlan()
+    return {'uuid': file_resp.get('uuid'), 'accession': file_resp.get('accession'),
+            'checked': runs is not None or bool(plan), 'runs': runs or [], 'notes': notes,
+            'steps': list(plan.steps.items())}
+
+
+def check_files(file_resps, runs, auth):
+    """Check a chunk of files with the runs they have as inputs - run in the process pool"""
+    stash = WorkflowRunStash(runs)
+    return [check_file(file_resp, auth, stash) for file_resp in file_resps]
+
+
+def iter_chunk_args(files, stash, auth, chunk_size):
+    for chunk in scu.chunk_list(files.values(), chunk_size):
+        wfr_uuids = [w['uuid'] for f in chunk for w in f.get('workflow_run_inputs') or []]
+        runs = stash.for_uuids(wfr_uuids) + [w for acc in _without_runs(chunk) for w in stash.for_input(acc)]
+        yield chunk, runs, auth
+
+
+def check_release(auth, item_uuids, workers=4, chunk_size=500):
+    """Check the files of the items - returns the result for every file in order and a
+        DeletionPlan of all the deletions with the ones shared between files merged"""
+    files = load_files(auth, get_file_uuids(auth, item_uuids))
+    stash = load_runs(auth, files)
+    print('checking %d files with %d workflow runs' % (len(files), len(stash)), file=sys.stderr)
+    chunks = iter_chunk_args(files, stash, auth, chunk_size)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(check_files, *args) for args in chunks]
+            chunk_results = [fut.result() for fut in futures]
+    else:
+        chunk_results = [check_files(*args) for args in chunks]
+    results = [res for chunk in chunk_results for res in chunk]
+    plan = DeletionPlan()
+    for res in results:
+        for item_id, step in res['steps']:
+            for reason in step['reasons'] or ['']:
+                plan.add(item_id, step['patch'], after=step['after'], delete_fields=step['delete_fields'],
+                         reason=reason)
+    return results, plan
+
+
+def write_report(results, plan, out):
+    """Write a line per planned deletion and check message of each file and a summary"""
+    cnts = Counter()
+    out.write('#file\taction\titem\tdetail\n')
+    for res in results:
+        for kind, msg in res['notes']:
+            cnts[kind] += 1
+            if kind != 'delete':
+                out.write('%s\t%s\t\t%s\n' % (res['accession'], kind, msg))
+        for item_id, step in res['steps']:
+            detail = ' '.join('%s=%s' % kv for kv in step['patch'].items())
+            if step['delete_fields']:
+                detail += ' delete_fields=' + ','.join(step['delete_fields'])
+            reasons = '; '.join(step['reasons'])
+            out.write('%s\tdelete\t%s\t%s; %s\n' % (res['accession'], item_id, detail.strip(), reasons))
+    runs = set(r for res in results for r in res['runs'])
+    out.write('# %d files checked, %d not checked\n' % (
+        sum(1 for r in results if r['checked']), sum(1 for r in results if not r['checked'])))
+    out.write('# %d workflow runs and %d items in all to patch\n' % (len(runs), len(plan)))
+    out.write('# %s\n' % ', '.join('%d %s' % (cnts[k], k) for k in ACTIONS[1:]))
+    return cnts
+
+
+def main():  # pragma: no cover
+    args = get_args()
+    try:
+        auth = get_authentication_with_server(args.key, args.env)
+    except Exception:
+        print("Authentication failed")
+        sys.exit(1)
+
+    item_uuids = [scu.get_item_uuid(i, auth) for i in scu.iter_item_ids_from_args(args.input, auth, args.search)]
+    results, plan = check_release(auth, [u for u in item_uuids if u], args.workers, args.chunk_size)
+    if args.outfile:
+        with open(args.outfile, 'w') as outf:
+            write_report(results, plan, outf)
+    else:
+        write_report(results, plan, sys.stdout)
+    if args.dbupdate and plan:
+        summary = execute_plan(plan, auth)
+        summary.report()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -5,7 +5,8 @@ copy files from raw file bucket to processed file bucket
 import sys
 import argparse
 import boto3
-from dcicutils.ff_utils import get_authentication_with_server, get_metadata
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import get_metadata
 from functions import script_utils as scu
 
 
@@ -2,12 +2,16 @@ import sys
 import argparse
 from dcicutils import ff_utils as ff
 from functions import script_utils as scu
+from functions import portal_client as pc
+from functions.patch_executor import execute_patches
+from functions.patch_journal import get_journal
 
 
 def get_args():  # pragma: no cover
     parser = argparse.ArgumentParser(
         description='Provide a search query suffix and get a list of item uuids',
-        parents=[scu.create_ff_arg_parser(), scu.create_input_arg_parser()],
+        parents=[scu.create_ff_arg_parser(), scu.create_input_arg_parser(), scu.create_journal_arg_parser(),
+                 scu.create_stream_arg_parser()],
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
     args = parser.parse_args()
@@ -24,22 +28,33 @@ def main():
         print("Authentication failed")
         sys.exit(1)
     print("Working on {}".format(auth.get('server')))
-    itemids = scu.get_item_ids_from_args(args.input, auth, args.search)
+    itemids = scu.iter_item_ids_from_args(args.input, auth, args.search, args.stream)
     seen = []
     failed = []
-    for itemid in itemids:
-        print("Touching ", itemid)
-        if args.dbupdate:
-            try:
-                res = ff.patch_metadata({}, itemid, auth)
-                print(res.get('status'))
-                if res.get('status') == 'success':
-                    seen.append(itemid)
-            except Exception:
-                print(itemid, ' failed to patch')
-                failed.append(itemid)
-                continue
+
+    journal = get_journal(args) if args.dbupdate else None
+
+    def jobs():
+        for itemid in itemids:
+            if journal is not None and journal.is_done(itemid, {}):
+                print("Skipping ", itemid, "- already touched according to the journal")
+            else:
+                print("Touching ", itemid)
+            yield itemid, {}
+
+    def report_result(itemid, payload, res):
+        if isinstance(res, dict):
+            print(res.get('status'))
         else:
+            print(itemid, ' failed to patch')
+
+    if args.dbupdate:
+        summary = execute_patches(jobs(), lambda iid, payload: pc.patch_metadata(payload, iid, auth),
+                                  on_result=report_result, journal=journal)
+        seen = summary.succeeded
+        failed = list(summary.failed)
+    else:
+        for _ in jobs():
             print('dry run!')
     for i in seen:
         print(i)
@@ -1,7 +1,8 @@
 import sys
 import argparse
 from datetime import datetime
-from dcicutils.ff_utils import get_authentication_with_server, get_metadata, post_metadata
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import get_metadata, post_metadata
 from functions import script_utils as scu
 '''Generate provenance workflow_runs for processed files using the
     information in the 'produced_from' field.
@@ -1,6 +1,7 @@
 import sys
 import argparse
-from dcicutils.ff_utils import get_authentication_with_server, get_metadata
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import get_metadata
 from functions import script_utils as scu
 
 
@@ -45,6 +46,16 @@ def get_args(args):
                         action='store_true',
                         help='Normally released items are skipped \
                         - this flag includes them in the final list')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=8,
+                        help='Number of items to fetch at the same time when getting linked items. \
+                        Default is 8')
+    parser.add_argument('--use_es',
+                        default=False,
+                        action='store_true',
+                        help='Get the type and links of linked items with bulk ES requests \
+                        - items not yet indexed are fetched from the portal')
     args = parser.parse_args(args)
     if args.key:
         args.key = scu.convert_key_arg_to_dict(args.key)
@@ -65,10 +76,10 @@ def main():
         no_child.extend(args.no_children)
         no_child = list(set(no_child))
 
-    all_linked_ids = []
+    all_linked_ids = scu.OrderedSet()
     # main loop through the top level item ids
     for itemid in itemids:
-        linked = scu.get_linked_items(auth, itemid, {})
+        linked = scu.get_linked_items_parallel(auth, itemid, {}, no_child, args.workers, args.use_es)
         if excluded_types is not None:
             linked = scu.filter_dict_by_value(linked, excluded_types, include=False)
         ll = [(k, linked[k]) for k in sorted(linked, key=linked.get)]
@@ -82,7 +93,7 @@ def main():
                     print(i, '\t', t, '\tSKIPPING', suff)
                     continue
             if i not in all_linked_ids:
-                all_linked_ids.append(i)
+                all_linked_ids.add(i)
             else:
                 suff = suff + '\tSEEN'
             print(i, '\t', t, suff)
@@ -4,6 +4,7 @@ import sys
 import argparse
 import json
 from dcicutils import ff_utils
+from functions import portal_client as pc
 from pathlib import Path
 from functions import script_utils as scu
 
@@ -291,8 +292,8 @@ def main():
     for type in hic_types:
         query_pub += '&exp_sets_prod_in_pub.experiments_in_set.experiment_type.display_title=' + type
         query_exp += '&experiments_in_set.experiment_type.display_title=' + type
-    pubs_search = ff_utils.search_metadata(query_pub, key=auth)
-    expsets_search = ff_utils.search_metadata(query_exp, key=auth)
+    pubs_search = pc.search_metadata(query_pub, key=auth)
+    expsets_search = pc.search_metadata(query_exp, key=auth)
 
     # building publications dictionary
     pubs_dict = convert_pubs_list_to_lookup(pubs_search)
@@ -409,7 +410,7 @@ def main():
         # check if static section exists
         post = False
         try:
-            ff_utils.get_metadata(alias, auth)
+            pc.get_metadata(alias, auth)
         except Exception:
             print("'{}' static section cannot be patched because it does not exist".format(studygroup))
             print("Do you want to (p)ost or (s)kip this static section? [p/s]")
@@ -437,12 +438,12 @@ def main():
                 }
             }
             if not dryrun:
-                res = ff_utils.post_metadata(post_body, "StaticSection", key=auth)
+                res = pc.post_metadata(post_body, "StaticSection", key=auth)
             posted.append(alias)
         else:
             patch_body = {"body": output}
             if not dryrun:
-                res = ff_utils.patch_metadata(patch_body, alias, key=auth)
+                res = pc.patch_metadata(patch_body, alias, key=auth)
             patched.append(alias)
         if not dryrun:
             print("{}: {}".format(alias, res['status']))
@@ -2,11 +2,31 @@
 '''
 Given a list of item IDs will fetch the items or the fields of those items
 specified in the --fields parameter)
+
+With --bulk the ids are fetched --batch-size at a time - accessions and aliases are
+turned into uuids with searches and the items are then got from ES with only the
+--fields asked for, so far fewer requests and bytes are needed for long id lists.
+Rows are still printed in the order of the ids, a batch at a time.  If a search or ES
+request fails its ids are got one at a time instead.
+
+--format jsonl, csv or parquet writes the rows in that format to --outfile or stdout
+(parquet needs a file and pyarrow) - jsonl of full items if no --fields are given.
+Messages and problem ids then go to stderr so they do not end up in the data.
+
+--workers fetches that many items (or batches with --bulk) at the same time - rows are
+held until the ones before them are printed so the output order does not change.
 '''
+import re
 import sys
 import argparse
-from dcicutils.ff_utils import get_authentication_with_server, get_metadata
+from collections import OrderedDict
+from urllib.parse import quote
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import get_metadata, search_metadata
 from functions import script_utils as scu
+from functions.item_writers import FORMATS, format_value, get_writer
+
+ACCESSION_RE = re.compile(r'^4DN[A-Z]{2}[0-9A-Z]{7}$')
 
 
 def get_args():
@@ -21,6 +41,25 @@ def get_args():
                         action='store_true',
                         default='False',
                         help="By default the id provided is the first column of output - this flag removes that column")
+    parser.add_argument('--bulk',
+                        action='store_true',
+                        default=False,
+                        help="Get the items in batches from search and ES with only the requested fields \
+                        rather than one full item per request")
+    parser.add_argument('--batch-size',
+                        type=int,
+                        default=200,
+                        help="Number of ids fetched per batch with --bulk - default 200")
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        help="Number of requests to have going at the same time - default 1")
+    parser.add_argument('--format',
+                        choices=FORMATS,
+                        default='tsv',
+                        help="Output format - default tsv as printed before")
+    parser.add_argument('--outfile',
+                        help="File to write the rows to rather than stdout - needed for parquet")
 
     args = parser.parse_args()
     if args.key:
@@ -28,6 +67,101 @@ def get_args():
     return args
 
 
+def format_row(iid, res, fields, noid='False'):
+    """The output line for an item - the field values tab separated and prefixed by
+        the id unless noid is set"""
+    line = ''.join(str(format_value(res.get(f))) + '\t' for f in fields)
+    if noid == 'False':
+        line = iid + '\t' + line
+    return line
+
+
+def item_row(iid, res, fields, noid='False'):
+    """The row of column values given to an item writer"""
+    row = OrderedDict() if noid is True else OrderedDict([('id', iid)])
+    for f in fields:
+        row[f] = res.get(f)
+    return row
+
+
+def _search_field(iid):
+    """The field to look up a non uuid id with in a search or None"""
+    key = iid.strip('/').split('/')[-1]
+    if ACCESSION_RE.match(key):
+        return 'accession', key
+    if ':' in key and '/' not in iid:
+        return 'aliases', key
+    return None, key
+
+
+def resolve_uuids(auth, ids, chunk_size=scu.SEARCH_CHUNK_SIZE):
+    """Map the ids to uuids - uuids as is and accessions and aliases with a search per
+        field and chunk_size values.  Ids that can't be resolved this way, including
+        those in a search that fails, are left out"""
+    resolved = {}
+    to_search = {}
+    for iid in ids:
+        field, key = _search_field(iid)
+        if scu.is_uuid(key):
+            resolved[iid] = key
+        elif field:
+            to_search.setdefault(field, {})[key] = iid
+    for field, keys in to_search.items():
+        for chunk in scu.chunk_list(keys, chunk_size):
+            query = 'search/?type=Item&{}&field=uuid&field={}'.format(
+                '&'.join('{}={}'.format(field, quote(k)) for k in chunk), field)
+            try:
+                for res in search_metadata(query, auth):
+                    vals = res.get(field)
+                    for val in vals if isinstance(vals, list) else [vals]:
+                        if val in keys:
+                            resolved[keys[val]] = res.get('uuid')
+            except Exception as e:
+                print("Search for %d %s values failed - getting them one at a time: %s" % (len(chunk), field, e),
+                      file=sys.stderr)
+    return resolved
+
+
+def fetch_batch(auth, ids, fields=None):
+    """Get the object frame of the ids - only the fields if given - using searches to
+        resolve ids and one ES request.  Ids not found that way are got one at a time.
+        Returns an OrderedDict in the order of ids with None for items that can't be got"""
+    resolved = resolve_uuids(auth, ids)
+    sources = ['uuid'] + (['object.' + f for f in fields] if fields else ['object.*'])
+    return scu.bulk_fetch(auth, ids, sources, lambda hit: hit.get('object') or {},
+                          resolved=resolved, add_on='frame=object')
+
+
+def _get_object(auth, iid):
+    try:
+        return get_metadata(iid, auth, add_on='frame=object')
+    except Exception:
+        return None
+
+
+def iter_items(auth, id_list, fields=None, bulk=False, batch_size=200, workers=1):
+    """Yields (id, item) in the order of id_list - item is None if it could not be got
+        with workers > 1 requests overlap but only a window of results is held"""
+    if not bulk:
+        if workers <= 1:
+            for iid in id_list:
+                yield iid, _get_object(auth, iid)
+            return
+        for iid, res in scu.imap_ordered(lambda iid: (iid, _get_object(auth, iid)), id_list, workers):
+            yield iid, res
+        return
+    batches = scu.chunk_list(id_list, batch_size)
+
+    def fetch(batch):
+        return batch, fetch_batch(auth, batch, fields)
+
+    results = (fetch(batch) for batch in batches) if workers <= 1 else scu.imap_ordered(fetch, batches, workers)
+    for batch, batch_result in results:
+        # a row for every id given even if it is repeated as without --bulk
+        for iid in batch:
+            yield iid, batch_result.get(iid)
+
+
 def main():  # pragma: no cover
     args = get_args()
     try:
@@ -36,62 +170,40 @@ def main():  # pragma: no cover
         print("Authentication failed")
         sys.exit(1)
 
-    print('#', auth.get('server'))
+    # with the other formats the data is all that goes to stdout
+    info = sys.stdout if args.format == 'tsv' else sys.stderr
+    print('#', auth.get('server'), file=info)
+    if args.format in ('csv', 'parquet') and not args.fields:
+        print("--fields are needed for %s output" % args.format, file=sys.stderr)
+        sys.exit(1)
     id_list = scu.get_item_ids_from_args(args.input, auth, args.search)
+    writer = None
     if args.fields:
         fields = args.fields
-
-        header = '#id\t' + '\t'.join(fields)
-        if args.noid is True:
-            header = header.replace('#id\t', '#')
-        print(header)
+        writer = get_writer(args.format, item_row('', {}, fields, args.noid).keys(), args.outfile)
+    elif args.format == 'jsonl':
+        writer = get_writer('jsonl', [], args.outfile)
     problems = []
-    for iid in id_list:
-        try:
-            res = get_metadata(iid, auth, add_on='frame=object')
-        except Exception:
+    for iid, res in iter_items(auth, id_list, args.fields, args.bulk, args.batch_size, args.workers):
+        if res is None:
             problems.append(iid)
             continue
 
         if args.fields:
-            line = ''
-            # counts = {}
-            for f in fields:
-                val = res.get(f)
-                # if val is not None:  # added in for specific use case
-                if isinstance(val, dict):
-                    val = val.get('uuid')
-                elif isinstance(val, list):
-                    # counts[f] = len(val)  # added in for specific use case
-                    # if len(counts) > 1:
-                    #     print(iid, '\t', counts)
-                    # else:
-                    #     cnt = list(counts.values())[0]
-                    #     if cnt > 1:
-                    #         print(iid, '\t', cnt)
-                    vs = ''
-                    for v in val:
-                        if isinstance(v, dict):
-                            v = v.get('uuid')
-                        else:
-                            v = str(v)
-                        vs = vs + v + ', '
-                    val = vs
-                    if val.endswith(', '):
-                        val = val[:-2]
-                line = line + str(val) + '\t'
-            if args.noid == 'False':
-                line = iid + '\t' + line
-            print(line)
+            writer.write(item_row(iid, res, fields, args.noid))
+        elif writer is not None:
+            writer.write(res)
         else:
             if args.noid is True:
                 print(res)
             else:
                 print(iid, '\t', res)
+    if writer is not None:
+        writer.close()
     if problems:
-        print('THERE WAS A PROBLEM GETTING METADATA FOR THE FOLLOWING:')
+        print('THERE WAS A PROBLEM GETTING METADATA FOR THE FOLLOWING:', file=info)
         for p in problems:
-            print(p)
+            print(p, file=info)
 
 
 if __name__ == '__main__':
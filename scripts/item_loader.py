@@ -2,21 +2,24 @@
 
 import sys
 import argparse
-import json
+import tempfile
 from datetime import datetime
 from uuid import uuid4
-from dcicutils.ff_utils import (
-    get_authentication_with_server,
-    post_metadata,
-    get_metadata,
-    patch_metadata,
-)
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import post_metadata, get_metadata, patch_metadata
 from functions.script_utils import create_ff_arg_parser, convert_key_arg_to_dict
+from functions.item_stream import spool_items_by_type, iter_spooled_chunks
+from functions.data_loader import LoadDataSubmitter, load_items
+from functions.load_order import get_load_levels, sort_types
 ''' Will attempt to load data from a file into the database using the load_data endpoint if it can
     or post/patch_metadata if not
     The file can be a simple list of json items in which case you need to specify an item type
     with the --itype option (file created by generate_ontology is like this) or the file can
-    specify a dictionary with item types as keys and list of jsons as values.
+    specify a dictionary with item types as keys and list of jsons as values.  A .jsonl file
+    with one item per line is also accepted and needs --itype like a list.
+
+    The file is read item by item and loaded in chunks of --chunk-size items so large files
+    do not need to fit in memory.
 
     If the --as_file option is used the json items must contain a uuid and the endpoint will
     attempt to read the file from the request - no ordering and if there are dependencies to
@@ -24,82 +27,6 @@ from functions.script_utils import create_ff_arg_parser, convert_key_arg_to_dict
     WARNING: currently only works locally or if file is uploaded as part of the app file system
 '''
 
-ORDER = [
-    'user',
-    'award',
-    'lab',
-    'static_section',
-    'higlass_view_config',
-    'page',
-    'ontology',
-    'ontology_term',
-    'file_format',
-    'badge',
-    'organism',
-    'genomic_region',
-    'gene',
-    'bio_feature',
-    'target',
-    'imaging_path',
-    'publication',
-    'publication_tracking',
-    'document',
-    'image',
-    'vendor',
-    'construct',
-    'modification',
-    'protocol',
-    'sop_map',
-    'biosample_cell_culture',
-    'individual_human',
-    'individual_mouse',
-    'individual_fly',
-    'individual_chicken',
-    'biosource',
-    'antibody',
-    'enzyme',
-    'treatment_rnai',
-    'treatment_agent',
-    'biosample',
-    'quality_metric_fastqc',
-    'quality_metric_bamqc',
-    'quality_metric_pairsqc',
-    'quality_metric_dedupqc_repliseq',
-    'quality_metric_chipseq',
-    'quality_metric_atacseq',
-    'microscope_setting_d1',
-    'microscope_setting_d2',
-    'microscope_setting_a1',
-    'microscope_setting_a2',
-    'file_fastq',
-    'file_processed',
-    'file_reference',
-    'file_calibration',
-    'file_microscopy',
-    'file_set',
-    'file_set_calibration',
-    'file_set_microscope_qc',
-    'file_vistrack',
-    'experiment_hi_c',
-    'experiment_capture_c',
-    'experiment_repliseq',
-    'experiment_atacseq',
-    'experiment_chiapet',
-    'experiment_damid',
-    'experiment_seq',
-    'experiment_tsaseq',
-    'experiment_mic',
-    'experiment_set',
-    'experiment_set_replicate',
-    'data_release_update',
-    'software',
-    'analysis_step',
-    'workflow',
-    'workflow_mapping',
-    'workflow_run_sbg',
-    'workflow_run_awsem'
-]
-
 
 def get_args():  # pragma: no cover
     parser = argparse.ArgumentParser(
@@ -120,6 +47,15 @@ def get_args():  # pragma: no cover
                         help="Will attempt to load and process the file directly in the request. "
                              "This currently only works locally or if the file has been uploaded to "
                              "the apps file system")
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=1000,
+                        help="Number of items of a type to check and load at a time. Default is 1000")
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        help="Number of --chunk-size chunks of the same item type to send to load_data at the same "
+                             "time - types are still loaded one after another. Default is 1")
     args = parser.parse_args()
     if args.key:
         args.key = convert_key_arg_to_dict(args.key)
@@ -135,23 +71,8 @@ def patch_jsons(auth, to_patch):
             print(e)
 
 
-def load_json(auth, itype, item_list, chunk_size=50):
-    list_length = len(item_list)
-    curr_pos = 0
-    while curr_pos < list_length:
-        slice_for = chunk_size if (chunk_size and chunk_size <= (list_length - curr_pos)) else list_length - curr_pos
-        new_end = curr_pos + slice_for
-        chunk = item_list[curr_pos: new_end]
-        store = {itype: chunk}
-        payload = {'store': store, 'overwrite': True}
-        if 'localhost' in auth.get('server', ''):
-            payload['config_uri'] = 'development.ini'
-        try:
-            post_metadata(payload, 'load_data', auth)
-        except Exception as e:
-            print("PROBLEM WITH POST")
-            print(e)
-        curr_pos = new_end
+def load_json(auth, itype, item_list, chunk_size=50, workers=1):
+    return load_items(auth, itype, item_list, chunk_size=chunk_size, workers=workers)
 
 
 def load_file(auth, itype, filename):
@@ -189,6 +110,35 @@ def check_for_existing(item, itype, idfields, auth):
     return uid
 
 
+def load_chunk(auth, itype, items, identifiers, submitter):
+    # checking to see if an item exists
+    # if no can use load_data endpoint
+    # if yes do it the old fashioned way
+    to_patch = []
+    to_post = []
+    for item in items:
+        uid = item.get('uuid')
+        if uid:
+            exists = get_item(uid, auth)
+            if exists:  # try a patch
+                to_patch.append(item)
+            else:
+                to_post.append(item)
+        else:
+            uid = check_for_existing(item, itype, identifiers, auth)
+            if uid:  # try a patch
+                item['uuid'] = uid
+                to_patch.append(item)
+            else:
+                uid = str(uuid4())
+                item['uuid'] = uid
+                to_post.append(item)
+    if to_post:
+        submitter.submit(to_post)
+    if to_patch:
+        patch_jsons(auth, to_patch)
+
+
 def main():  # pragma: no cover
     start = datetime.now()
     print(str(start))
@@ -208,53 +158,31 @@ def main():  # pragma: no cover
             except Exception as e:
                 print(e)
     else:
-        with open(args.infile) as ifile:
-            item_store = json.loads(ifile.read())
-            if not args.itype:
-                if not isinstance(item_store, dict):
-                    print("File is not in correct format")
-                    sys.exit(1)
-            else:
-                if not isinstance(item_store, list):
-                    print("File is not in correct format")
-                    sys.exit(1)
-                item_store = {args.itype: item_store}
-            for itype, items in sorted(item_store.items(), key=lambda x: ORDER.index(x[0])):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            try:
+                spooled = spool_items_by_type(args.infile, spool_dir, args.itype)
+            except ValueError as e:
+                print("File is not in correct format", e)
+                sys.exit(1)
+            # item types are loaded in an order worked out from the schemas
+            levels = get_load_levels(auth)
+            for itype in sort_types(spooled, levels):
+                spool_file, count = spooled[itype]
                 if not args.dbupdate:
-                    print('DRY RUN - would try to load {} {} items'.format(len(items), itype))
+                    print('DRY RUN - would try to load {} {} items'.format(count, itype))
                     continue
                 if args.id_field:
                     identifiers = [args.id_field]
                 else:
                     schema_path = 'profiles/' + itype + '.json'
                     schema_info = get_metadata(schema_path, auth)
-                    identifiers = schema_info.get('identifyingProperties')
-                # checking to see if an item exists
-                # if no can use load_data endpoint
-                # if yes do it the old fashioned way
-                to_patch = []
-                to_post = []
-                for item in items:
-                    uid = item.get('uuid')
-                    if uid:
-                        exists = get_item(uid, auth)
-                        if exists:  # try a patch
-                            to_patch.append(item)
-                        else:
-                            to_post.append(item)
-                    else:
-                        uid = check_for_existing(item, itype, identifiers, auth)
-                        if uid:  # try a patch
-                            item['uuid'] = uid
-                            to_patch.append(item)
-                        else:
-                            uid = str(uuid4())
-                            item['uuid'] = uid
-                            to_post.append(item)
-                if to_post:
-                    load_json(auth, itype, to_post, chunk_size=1000)
-                if to_patch:
-                    patch_jsons(auth, to_patch)
+                    identifiers = schema_info.get('identifyingProperties') or []
+                submitter = LoadDataSubmitter(auth, itype, workers=args.workers, chunk_size=1000)
+                for items in iter_spooled_chunks(spool_file, args.chunk_size):
+                    load_chunk(auth, itype, items, identifiers, submitter)
+                failed = submitter.finish()
+                if failed:
+                    print('{} {} items could not be loaded'.format(len(failed), itype))
     stop = datetime.now()
     print(str(stop))
 
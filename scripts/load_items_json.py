@@ -2,21 +2,37 @@
 
 import sys
 import argparse
-import json
+import tempfile
 from datetime import datetime
 from uuid import uuid4
-from dcicutils.ff_utils import (
-    get_authentication_with_server,
+from urllib.parse import quote
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import (
     post_metadata,
     get_metadata,
     patch_metadata,
+    search_metadata,
 )
-from functions.script_utils import create_ff_arg_parser, convert_key_arg_to_dict
+from functions.script_utils import (
+    create_ff_arg_parser,
+    convert_key_arg_to_dict,
+    chunk_list,
+    bulk_fetch,
+    SEARCH_CHUNK_SIZE,
+)
+from functions.item_stream import spool_items_by_type, iter_spooled_chunks
+from functions.data_loader import LoadDataSubmitter
+from functions.load_order import get_load_levels, sort_types, type_name
 ''' Will attempt to load data from a file into the database using the load_data endpoint if it can
     or post/patch_metadata if not
     The file can be a simple list of json items in which case you need to specify an item type
-    with the --itype option (file created by generate_ontology is like this) or the file can
-    specify a dictionary with item types as keys and list of jsons as values.
+    with the --itypes option (file created by generate_ontology is like this) or the file can
+    specify a dictionary with item types as keys and list of jsons as values - in which case
+    --itypes can be used to only load some of the types.  A .jsonl file with one item per line
+    is also accepted and needs an item type like a list.
+
+    The file is read item by item and loaded in chunks of --chunk-size items so large files
+    do not need to fit in memory.
 
     If the --as_file option is used the json items must contain a uuid and the endpoint will
     attempt to read the file from the request - no ordering and if there are dependencies to
@@ -24,82 +40,6 @@ from functions.script_utils import create_ff_arg_parser, convert_key_arg_to_dict
     WARNING: currently only works locally or if file is uploaded as part of the app file system
 '''
 
-ORDER = [
-    'user',
-    'award',
-    'lab',
-    'static_section',
-    'higlass_view_config',
-    'page',
-    'ontology',
-    'ontology_term',
-    'file_format',
-    'badge',
-    'organism',
-    'genomic_region',
-    'gene',
-    'bio_feature',
-    'target',
-    'imaging_path',
-    'publication',
-    'publication_tracking',
-    'document',
-    'image',
-    'vendor',
-    'construct',
-    'modification',
-    'protocol',
-    'sop_map',
-    'biosample_cell_culture',
-    'individual_human',
-    'individual_mouse',
-    'individual_fly',
-    'individual_chicken',
-    'biosource',
-    'antibody',
-    'enzyme',
-    'treatment_rnai',
-    'treatment_agent',
-    'biosample',
-    'quality_metric_fastqc',
-    'quality_metric_bamqc',
-    'quality_metric_pairsqc',
-    'quality_metric_dedupqc_repliseq',
-    'quality_metric_chipseq',
-    'quality_metric_atacseq',
-    'microscope_setting_d1',
-    'microscope_setting_d2',
-    'microscope_setting_a1',
-    'microscope_setting_a2',
-    'file_fastq',
-    'file_processed',
-    'file_reference',
-    'file_calibration',
-    'file_microscopy',
-    'file_set',
-    'file_set_calibration',
-    'file_set_microscope_qc',
-    'file_vistrack',
-    'experiment_hi_c',
-    'experiment_capture_c',
-    'experiment_repliseq',
-    'experiment_atacseq',
-    'experiment_chiapet',
-    'experiment_damid',
-    'experiment_seq',
-    'experiment_tsaseq',
-    'experiment_mic',
-    'experiment_set',
-    'experiment_set_replicate',
-    'data_release_update',
-    'software',
-    'analysis_step',
-    'workflow',
-    'workflow_mapping',
-    'workflow_run_sbg',
-    'workflow_run_awsem'
-]
-
 
 def get_args():  # pragma: no cover
     parser = argparse.ArgumentParser(
@@ -112,7 +52,8 @@ def get_args():  # pragma: no cover
                         help="the datafile containing json formatted items")
     parser.add_argument('--itypes',
                         nargs='*',
-                        help="The item type(s) to load if not specified in the file by store key(s)")
+                        help="The item type to load if not specified in the file by store key(s) "
+                             "or the store keys to load from the file")
     parser.add_argument('--id-field',
                         help="Field name to used as identifier for items (all item types in file)")
     parser.add_argument('--as-file',
@@ -121,6 +62,15 @@ def get_args():  # pragma: no cover
                         help="Will attempt to load and process the file directly in the request. "
                              "This currently only works locally or if the file has been uploaded to "
                              "the apps file system")
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=1000,
+                        help="Number of items of a type to check and load at a time. Default is 1000")
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        help="Number of --chunk-size chunks of the same item type to send to load_data at the same "
+                             "time - types are still loaded one after another. Default is 1")
     args = parser.parse_args()
     if args.key:
         args.key = convert_key_arg_to_dict(args.key)
@@ -136,25 +86,6 @@ def patch_jsons(auth, to_patch):
             print(e)
 
 
-def load_json(auth, itype, item_list, chunk_size=50):
-    list_length = len(item_list)
-    curr_pos = 0
-    while curr_pos < list_length:
-        slice_for = chunk_size if (chunk_size and chunk_size <= (list_length - curr_pos)) else list_length - curr_pos
-        new_end = curr_pos + slice_for
-        chunk = item_list[curr_pos: new_end]
-        store = {itype: chunk}
-        payload = {'store': store, 'overwrite': True}
-        if 'localhost' in auth.get('server', ''):
-            payload['config_uri'] = 'development.ini'
-        try:
-            post_metadata(payload, 'load_data', auth)
-        except Exception as e:
-            print("PROBLEM WITH POST")
-            print(e)
-        curr_pos = new_end
-
-
 def load_file(auth, itype, filename):
     payload = {'in_file': filename, 'overwrite': True, 'itype': itype}
     if 'localhost' in auth.get('server', ''):
@@ -165,29 +96,81 @@ def load_file(auth, itype, filename):
         raise
 
 
-def get_item(val, auth):
-    try:
-        return get_metadata(val, auth).get('uuid')
-    except:
-        return None
-
+def _id_values(item, ifield):
+    val = item.get(ifield)
+    if not val:
+        return []
+    if isinstance(val, list):
+        return [str(v) for v in val]
+    return [str(val)]
+
+
+def build_existing_index(auth, itype, items, idfields, chunk_size=SEARCH_CHUNK_SIZE):
+    """Find which items already exist in the database with bulk requests rather than
+        a get per uuid, alias or identifying property.
+        uuids are checked with ES and the ones it doesn't have (eg. not indexed yet) with a
+        get from the database.  The other identifiers are checked with one search per
+        chunk_size values per field - with status=* as searches leave out deleted and
+        replaced items by default and those still exist.  Aliases are looked for in all
+        types as they have to be unique across them.
+        Returns a dict mapping (field, value) of existing items to their uuid"""
+    index = {}
+    uuids = [item['uuid'] for item in items if item.get('uuid')]
+    found = bulk_fetch(auth, uuids, ['uuid'], lambda hit: hit, resolved={u: u for u in uuids},
+                       add_on='frame=object&datastore=database')
+    for uid, item in found.items():
+        if item is not None:
+            index[('uuid', uid)] = uid
 
-def check_for_existing(item, itype, idfields, auth):
-    uid = None
     for ifield in idfields:
-        id2chk = item.get(ifield)
-        if id2chk:
-            if ifield == 'aliases':
-                for a in id2chk:
-                    uid = get_item(a, auth)
-                    if uid:
-                        return uid
-            else:
-                chkid = itype + '/' + id2chk
-                uid = get_item(chkid, auth)
-                if uid:
-                    return uid
-    return uid
+        if ifield == 'uuid':
+            continue
+        search_type = 'Item' if ifield == 'aliases' else type_name(itype)
+        # only items without a uuid are checked using other identifiers
+        values = sorted(set(v for item in items if not item.get('uuid') for v in _id_values(item, ifield)))
+        for chunk in chunk_list(values, chunk_size):
+            query = 'search/?type={}&status=*&{}&field=uuid&field={}'.format(
+                search_type, '&'.join('{}={}'.format(ifield, quote(v)) for v in chunk), ifield)
+            for res in search_metadata(query, auth):
+                for val in _id_values(res, ifield):
+                    index[(ifield, val)] = res.get('uuid')
+    return index
+
+
+def find_existing(item, idfields, index):
+    """Return the uuid of the existing item in the index matching the item or None
+        an item with a uuid is only matched on that uuid"""
+    uid = item.get('uuid')
+    if uid:
+        return index.get(('uuid', uid))
+    for ifield in idfields:
+        for val in _id_values(item, ifield):
+            uid = index.get((ifield, val))
+            if uid:
+                return uid
+    return None
+
+
+def load_chunk(auth, itype, items, identifiers, submitter):
+    # checking to see if an item exists
+    # if no can use load_data endpoint
+    # if yes do it the old fashioned way
+    existing = build_existing_index(auth, itype, items, identifiers)
+    to_patch = []
+    to_post = []
+    for item in items:
+        uid = find_existing(item, identifiers, existing)
+        if uid:  # try a patch
+            item['uuid'] = uid
+            to_patch.append(item)
+        else:
+            if not item.get('uuid'):
+                item['uuid'] = str(uuid4())
+            to_post.append(item)
+    if to_post:
+        submitter.submit(to_post)
+    if to_patch:
+        patch_jsons(auth, to_patch)
 
 
 def main():  # pragma: no cover
@@ -200,62 +183,44 @@ def main():  # pragma: no cover
         print("Authentication failed")
         sys.exit(1)
     print('working on ', auth.get('server'))
+    # a single type is needed for a list of items - with a store it selects the types to load
+    itype = args.itypes[0] if args.itypes and len(args.itypes) == 1 else None
     if args.as_file:
         if not args.dbupdate:
             print("DRY RUN - use --dbupdate to update the database")
         else:
             try:
-                load_file(auth, args.itype, args.infile)
+                load_file(auth, itype, args.infile)
             except Exception as e:
                 print(e)
     else:
-        with open(args.infile) as ifile:
-            item_store = json.loads(ifile.read())
-            if not args.itype:
-                if not isinstance(item_store, dict):
-                    print("File is not in correct format")
-                    sys.exit(1)
-            else:
-                if not isinstance(item_store, list):
-                    print("File is not in correct format")
-                    sys.exit(1)
-                item_store = {args.itype: item_store}
-            for itype, items in sorted(item_store.items(), key=lambda x: ORDER.index(x[0])):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            try:
+                spooled = spool_items_by_type(args.infile, spool_dir, itype)
+            except ValueError as e:
+                print("File is not in correct format", e)
+                sys.exit(1)
+            if args.itypes:
+                spooled = {t: s for t, s in spooled.items() if t in args.itypes}
+            # item types are loaded in an order worked out from the schemas
+            levels = get_load_levels(auth)
+            for itype in sort_types(spooled, levels):
+                spool_file, count = spooled[itype]
                 if not args.dbupdate:
-                    print('DRY RUN - would try to load {} {} items'.format(len(items), itype))
+                    print('DRY RUN - would try to load {} {} items'.format(count, itype))
                     continue
                 if args.id_field:
                     identifiers = [args.id_field]
                 else:
                     schema_path = 'profiles/' + itype + '.json'
                     schema_info = get_metadata(schema_path, auth)
-                    identifiers = schema_info.get('identifyingProperties')
-                # checking to see if an item exists
-                # if no can use load_data endpoint
-                # if yes do it the old fashioned way
-                to_patch = []
-                to_post = []
-                for item in items:
-                    uid = item.get('uuid')
-                    if uid:
-                        exists = get_item(uid, auth)
-                        if exists:  # try a patch
-                            to_patch.append(item)
-                        else:
-                            to_post.append(item)
-                    else:
-                        uid = check_for_existing(item, itype, identifiers, auth)
-                        if uid:  # try a patch
-                            item['uuid'] = uid
-                            to_patch.append(item)
-                        else:
-                            uid = str(uuid4())
-                            item['uuid'] = uid
-                            to_post.append(item)
-                if to_post:
-                    load_json(auth, itype, to_post, chunk_size=1000)
-                if to_patch:
-                    patch_jsons(auth, to_patch)
+                    identifiers = schema_info.get('identifyingProperties') or []
+                submitter = LoadDataSubmitter(auth, itype, workers=args.workers, chunk_size=1000)
+                for items in iter_spooled_chunks(spool_file, args.chunk_size):
+                    load_chunk(auth, itype, items, identifiers, submitter)
+                failed = submitter.finish()
+                if failed:
+                    print('{} {} items could not be loaded'.format(len(failed), itype))
     stop = datetime.now()
     print(str(stop))
 
@@ -4,12 +4,8 @@ import sys
 import argparse
 import json
 from datetime import datetime
-from dcicutils.ff_utils import (
-    get_authentication_with_server,
-    get_metadata,
-    patch_metadata,
-    post_metadata,
-)
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import get_metadata, patch_metadata, post_metadata
 from functions.script_utils import create_ff_arg_parser, convert_key_arg_to_dict
 
 
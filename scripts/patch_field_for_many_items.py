@@ -1,12 +1,17 @@
 import sys
 import argparse
-from dcicutils.ff_utils import get_authentication_with_server, patch_metadata, delete_field
+from datetime import datetime
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import patch_metadata, delete_field
 from functions import script_utils as scu
+from functions.patch_executor import execute_patches, is_success
+from functions.patch_journal import get_journal
 
 
 def get_args(args):
     parser = argparse.ArgumentParser(
-        parents=[scu.create_input_arg_parser(), scu.create_ff_arg_parser()],
+        parents=[scu.create_input_arg_parser(), scu.create_ff_arg_parser(), scu.create_journal_arg_parser(),
+                 scu.create_stream_arg_parser()],
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
     parser.add_argument('field',
@@ -21,12 +26,37 @@ def get_args(args):
                         use this so value is correctly formatted even if only a single value")
     parser.add_argument('--numtype',
                         help="options: 'i' or 'f' If the field value is integer or number deal accordingly")
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        help="Number of patches to send at the same time. Default is 1")
+    parser.add_argument('--rate',
+                        type=float,
+                        help="Maximum number of patch requests per second to send to the server")
+    parser.add_argument('--failed_ids',
+                        help="File to write the ids of items that failed to patch to - one per line. \
+                        Default is patch_failures_<datetime>.txt if there are any failures")
     args = parser.parse_args(args)
     if args.key:
         args.key = scu.convert_key_arg_to_dict(args.key)
     return args
 
 
+def patch_item(iid, field, val, auth):
+    if val == '*delete*':
+        return delete_field(iid, field, auth)
+    return patch_metadata({field: val}, iid, auth)
+
+
+def report_result(iid, payload, res):
+    if is_success(res):
+        print("SUCCESS!")
+    elif isinstance(res, dict):
+        print("FAILED TO PATCH", iid, "RESPONSE STATUS", res.get('status'), res.get('description'))
+    else:
+        print("FAILED TO PATCH", iid, res)
+
+
 def main():
     args = get_args(sys.argv[1:])
     try:
@@ -35,7 +65,7 @@ def main():
         print("Authentication failed")
         sys.exit(1)
     print("Working on {}".format(auth.get('server')))
-    itemids = scu.get_item_ids_from_args(args.input, auth, args.search)
+    itemids = scu.iter_item_ids_from_args(args.input, auth, args.search, args.stream)
     field = args.field
     val = args.value
     if val == 'True':
@@ -50,19 +80,29 @@ def main():
             val = int(val)
         elif ntype == 'f':
             val = float(val)
-    for iid in itemids:
-        print("PATCHING", iid, "to", field, "=", val)
-        if (args.dbupdate):
-            # do the patch
-            if val == '*delete*':
-                res = delete_field(iid, field, auth)
-            else:
-                res = patch_metadata({args.field: val}, iid, auth)
-            if res['status'] == 'success':
-                print("SUCCESS!")
+
+    journal = get_journal(args) if args.dbupdate else None
+
+    def jobs():
+        for iid in itemids:
+            if journal is not None and journal.is_done(iid, {field: val}):
+                print("SKIPPING", iid, "- already patched according to the journal")
             else:
-                print("FAILED TO PATCH", iid, "RESPONSE STATUS", res['status'], res['description'])
-                # print(res)
+                print("PATCHING", iid, "to", field, "=", val)
+            yield iid, {field: val}
+
+    if not args.dbupdate:
+        for _ in jobs():
+            pass
+        return
+    summary = execute_patches(jobs(), lambda iid, payload: patch_item(iid, field, val, auth),
+                              workers=args.workers, rate=args.rate, server=auth.get('server'),
+                              on_result=report_result, journal=journal)
+    summary.report()
+    if summary.failed:
+        failed_file = args.failed_ids or 'patch_failures_{}.txt'.format(datetime.now().strftime('%Y%m%d_%H%M%S'))
+        summary.write_failed(failed_file)
+        print("Failed ids written to", failed_file)
 
 
 if __name__ == '__main__':  # pragma:nocover
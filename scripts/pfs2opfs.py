@@ -5,7 +5,8 @@ will transfer processed_files to other_processed_files
 '''
 import sys
 import argparse
-from dcicutils.ff_utils import get_authentication_with_server, get_metadata, patch_metadata
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import get_metadata, patch_metadata
 from functions import script_utils as scu
 
 
@@ -8,14 +8,17 @@ import sys
 import argparse
 import json
 from datetime import datetime
-from dcicutils.ff_utils import get_authentication_with_server, patch_metadata
-from functions.script_utils import create_ff_arg_parser, convert_key_arg_to_dict
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import patch_metadata
+from functions.script_utils import create_ff_arg_parser, convert_key_arg_to_dict, create_journal_arg_parser
+from functions.patch_executor import execute_patches
+from functions.patch_journal import get_journal
 
 
 def get_args():  # pragma: no cover
     parser = argparse.ArgumentParser(
         description='Given a file of ontology term jsons (one per line) load into db',
-        parents=[create_ff_arg_parser()],
+        parents=[create_ff_arg_parser(), create_journal_arg_parser()],
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
 
@@ -27,6 +30,21 @@ def get_args():  # pragma: no cover
     return args
 
 
+def read_patches(infile):
+    with open(infile) as items:
+        for i in items:
+            [iid, payload] = [t.strip() for t in i.split('\t')]
+            yield iid, json.loads(payload)
+
+
+def report_result(iid, payload, res):
+    status = res.get('status') if isinstance(res, dict) else None
+    if status and status == 'success':
+        print(status)
+    else:
+        print('FAILED', res)
+
+
 def main():  # pragma: no cover
     start = datetime.now()
     print(str(start))
@@ -40,21 +58,13 @@ def main():  # pragma: no cover
     # assumes a single line corresponds to json for single term
     if not args.dbupdate:
         print("DRY RUN - use --dbupdate to update the database")
-    with open(args.infile) as items:
-        for i in items:
-            [iid, payload] = [t.strip() for t in i.split('\t')]
-            payload = json.loads(payload)
-            if args.dbupdate:
-                e = patch_metadata(payload, iid, auth)
-            else:
-                print("DRY RUN\n\tPATCH: ", iid, " TO\n", payload)
-                e = {'status': 'success'}
-
-            status = e.get('status')
-            if status and status == 'success':
-                print(status)
-            else:
-                print('FAILED', e)
+        for iid, payload in read_patches(args.infile):
+            print("DRY RUN\n\tPATCH: ", iid, " TO\n", payload)
+            print('success')
+    else:
+        summary = execute_patches(read_patches(args.infile), lambda iid, payload: patch_metadata(payload, iid, auth),
+                                  on_result=report_result, journal=get_journal(args))
+        summary.report()
 
     end = datetime.now()
     print("FINISHED - START: ", str(start), "\tEND: ", str(end))
@@ -1,9 +1,14 @@
 import sys
 import argparse
 from collections import Counter
-from dcicutils.ff_utils import get_authentication_with_server, get_metadata, patch_metadata
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import get_metadata, patch_metadata, get_es_metadata
+from functions.patch_executor import execute_patches
 from functions import script_utils as scu
 
+# what is needed from ES to tag an item and find its experiments and files - properties is the raw frame
+PREFETCH_ES_SOURCES = ['uuid', 'properties.*', 'embedded.@type']
+
 
 def get_args():
     parser = argparse.ArgumentParser(
@@ -12,6 +17,15 @@ def get_args():
     )
     parser.add_argument('reltag',
                         help="The release tag to query DataReleaseUpdates and add to items.")
+    parser.add_argument('--prefetch',
+                        default=False,
+                        action='store_true',
+                        help="Get all the items to tag with bulk ES requests up front and send the \
+                        patches concurrently rather than getting and patching one item at a time")
+    parser.add_argument('--workers',
+                        type=int,
+                        default=8,
+                        help="Number of patches sent at the same time with --prefetch - default 8")
     args = parser.parse_args()
     if args.key:
         args.key = scu.convert_key_arg_to_dict(args.key)
@@ -51,26 +65,29 @@ def do_patch(uid, type, patch, auth, dbupdate, cnts):
     # import pdb; pdb.set_trace()
     res = patch_metadata(patch, uid, auth)
     # res = {'status': 'testing'}
+    count_patch_result(uid, type, patch, res, cnts)
+    return
+
+
+def count_patch_result(uid, type, patch, res, cnts):
     print('UPDATING - %s of type %s with %s' % (uid, type, patch))
-    rs = res['status']
+    rs = res['status'] if isinstance(res, dict) else res
     print(rs)
     if rs == 'success':
         cnts['patched'] += 1
     else:
         cnts['errors'] += 1
         print(res)
-    return
 
 
-def add_tag2item(auth, iid, tag, seen, cnts, itype=None, dbupdate=False):
-    # turns out that we do need to do a get as tags aren't embedded
-    item = get_metadata(iid, auth)
+def get_tag_patch(item, tag, seen, cnts, itype=None):
+    """Returns (uuid, type, patch) if item needs tagging else None - the uuid is added to seen"""
     status = item.get('status')
     uid = item.get('uuid')
     if (not uid) or (uid in seen):
         print("SEEN OR IDLESS ITEM - SKIPPING")
         cnts['skipped'] += 1
-        return
+        return None
     seen.append(uid)
     if has_released(status):
         attype = get_attype(item)
@@ -78,27 +95,35 @@ def add_tag2item(auth, iid, tag, seen, cnts, itype=None, dbupdate=False):
             attype = itype
         patch = make_tag_patch(item, tag)
         if patch:
-            do_patch(uid, attype, patch, auth, dbupdate, cnts)
-        else:
-            print('NOTHING TO PATCH - skipping %s' % uid)
-            cnts['skipped'] += 1
+            return uid, attype, patch
+        print('NOTHING TO PATCH - skipping %s' % uid)
+        cnts['skipped'] += 1
     else:
         print("STATUS %s doesn't get tagged - skipping %s" % (status, uid))
         cnts['skipped'] += 1
+    return None
+
+
+def add_tag2item(auth, iid, tag, seen, cnts, itype=None, dbupdate=False):
+    # turns out that we do need to do a get as tags aren't embedded
+    item = get_metadata(iid, auth)
+    to_patch = get_tag_patch(item, tag, seen, cnts, itype)
+    if to_patch:
+        do_patch(*to_patch, auth, dbupdate, cnts)
     return
 
 
-def main():  # pragma: no cover
-    args = get_args()
-    dbupdate = args.dbupdate
-    try:
-        auth = get_authentication_with_server(args.key, args.env)
-    except Exception:
-        print("Authentication failed")
-        sys.exit(1)
+def item_id(val):
+    """linked items come as embedded dicts in the default frame - get an id to fetch them with"""
+    if isinstance(val, dict):
+        return val.get('uuid') or val.get('@id')
+    return val
+
 
+def tag_release(auth, reltag, dbupdate=False):
+    """Tag the released experiment sets in the DataReleaseUpdates for reltag and their
+        experiments and files - returns the counts of what was done"""
     cnts = Counter()
-    reltag = args.reltag
     # build the search query string
     query = 'type=DataReleaseUpdate&update_tag=' + reltag
     relupdates = scu.get_item_ids_from_args([query], auth, True)
@@ -107,8 +132,8 @@ def main():  # pragma: no cover
         res = get_metadata(u, auth)
         for ui in res.get('update_items'):
             if ui.get('primary_id'):
-                update_items.append(ui['primary_id'])
-    seen = []
+                update_items.append(item_id(ui['primary_id']))
+    seen = scu.OrderedSet()
     # update_items = ['experiment-set-replicates/4DNESOI2ALTL']
     for item in update_items:
         res = get_metadata(item, auth)
@@ -128,19 +153,18 @@ def main():  # pragma: no cover
             if exps is not None:
                 cnts['Experiment'] += len(exps)
                 for exp in exps:
-                    # import pdb; pdb.set_trace()
-                    add_tag2item(auth, exp, reltag, seen, cnts, 'Experiment', dbupdate)
+                    add_tag2item(auth, item_id(exp), reltag, seen, cnts, 'Experiment', dbupdate)
                     files = exp.get('files')
                     if files is not None:
                         cnts['FileFastq'] += len(files)
                         for file in files:
-                            file = add_tag2item(auth, file, reltag, seen, cnts, 'FileFastq', dbupdate)
+                            add_tag2item(auth, item_id(file), reltag, seen, cnts, 'FileFastq', dbupdate)
                     epfiles = exp.get('processed_files')
                     # epfiles = None  # case for first freeze (no processed files included)
                     if epfiles is not None:
                         cnts['FileProcessed'] += len(epfiles)
                         for epf in epfiles:
-                            add_tag2item(auth, epf, reltag, seen, cnts, 'FileProcessed', dbupdate)
+                            add_tag2item(auth, item_id(epf), reltag, seen, cnts, 'FileProcessed', dbupdate)
 
             # check the processed files directly associated to the eset
             # pfiles = res.get('procesed_files')
@@ -148,7 +172,111 @@ def main():  # pragma: no cover
             if pfiles is not None:
                 cnts['FileProcessed'] += len(pfiles)
                 for pf in pfiles:
-                    add_tag2item(auth, pf, reltag, seen, cnts, 'FileProcessed', dbupdate)
+                    add_tag2item(auth, item_id(pf), reltag, seen, cnts, 'FileProcessed', dbupdate)
+    return cnts
+
+
+def prefetch_items(auth, ids):
+    """Get the items for ids with bulk ES requests - returns a dict of uuid to the raw frame
+        of the item with its @type added.  Ids that are not uuids or are not in ES yet are
+        got from the portal one at a time"""
+    items = {}
+    ids = list(dict.fromkeys(i for i in ids if i))
+    uuids = [i for i in ids if scu.is_uuid(i)]
+    if uuids:
+        for hit in get_es_metadata(uuids, sources=PREFETCH_ES_SOURCES, key=auth, is_generator=True):
+            item = dict(hit.get('properties') or {}, uuid=hit.get('uuid'))
+            item['@type'] = (hit.get('embedded') or {}).get('@type')
+            items[item['uuid']] = item
+    for iid in ids:
+        if iid not in items:
+            item = get_metadata(iid, auth, add_on='frame=object')
+            items[iid] = item
+            if item.get('uuid'):
+                items[item['uuid']] = item
+    return items
+
+
+def plan_release_tags(auth, reltag, cnts):
+    """The same walk through the release as tag_release but with every item got up front in
+        3 rounds of bulk requests - update items, their experiments and then the files.
+        Returns a list of (uuid, type, patch) and counts what was found in cnts"""
+    query = 'type=DataReleaseUpdate&update_tag=' + reltag
+    relupdates = prefetch_items(auth, scu.get_item_ids_from_args([query], auth, True))
+    update_items = []
+    for res in relupdates.values():
+        for ui in res.get('update_items') or []:
+            if ui.get('primary_id'):
+                update_items.append(item_id(ui['primary_id']))
+    items = prefetch_items(auth, update_items)
+    sets = [items[i] for i in update_items if 'ExperimentSet' in (get_attype(items[i]) or '')]
+    exp_ids = [item_id(e) for s in sets for e in s.get('experiments_in_set') or []]
+    items.update(prefetch_items(auth, [i for i in exp_ids if i not in items]))
+    file_ids = [item_id(f) for e in exp_ids for field in ('files', 'processed_files')
+                for f in items[e].get(field) or []]
+    items.update(prefetch_items(auth, [i for i in file_ids if i not in items]))
+
+    seen = scu.OrderedSet()
+    patches = []
+
+    def add_patch(iid, itype):
+        to_patch = get_tag_patch(items[item_id(iid)], reltag, seen, cnts, itype)
+        if to_patch:
+            patches.append(to_patch)
+
+    for item in update_items:
+        res = items[item]
+        uid = res.get('uuid')
+        type = get_attype(res)
+        cnts[type] += 1
+        if (not uid) or (uid in seen) or ('ExperimentSet' not in type):
+            print("SKIPPING ", uid)
+            cnts['skipped'] += 1
+            continue
+        add_patch(uid, type)
+        exps = res.get('experiments_in_set')
+        if exps is not None:
+            cnts['Experiment'] += len(exps)
+            for exp in exps:
+                add_patch(exp, 'Experiment')
+                exp = items[item_id(exp)]
+                for field, ftype in (('files', 'FileFastq'), ('processed_files', 'FileProcessed')):
+                    files = exp.get(field)
+                    if files is not None:
+                        cnts[ftype] += len(files)
+                        for file in files:
+                            add_patch(file, ftype)
+    return patches
+
+
+def tag_release_prefetched(auth, reltag, dbupdate=False, workers=8):
+    """tag_release with the items got in bulk and the patches sent by workers threads"""
+    cnts = Counter()
+    patches = plan_release_tags(auth, reltag, cnts)
+    if not dbupdate:
+        for uid, type, patch in patches:
+            print('DRY RUN - will update %s of type %s with %s' % (uid, type, patch))
+            cnts['not_patched'] += 1
+        return cnts
+    types = {uid: type for uid, type, _ in patches}
+    execute_patches([(uid, patch) for uid, _, patch in patches],
+                    lambda uid, patch: patch_metadata(patch, uid, auth), workers=workers,
+                    on_result=lambda uid, patch, res: count_patch_result(uid, types[uid], patch, res, cnts))
+    return cnts
+
+
+def main():  # pragma: no cover
+    args = get_args()
+    try:
+        auth = get_authentication_with_server(args.key, args.env)
+    except Exception:
+        print("Authentication failed")
+        sys.exit(1)
+
+    if args.prefetch:
+        cnts = tag_release_prefetched(auth, args.reltag, args.dbupdate, args.workers)
+    else:
+        cnts = tag_release(auth, args.reltag, args.dbupdate)
     print(cnts)
 
 
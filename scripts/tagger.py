@@ -1,7 +1,13 @@
 import sys
 import argparse
-from dcicutils.ff_utils import get_authentication_with_server, get_metadata, patch_metadata
+from dcicutils.ff_utils import get_authentication_with_server
+from functions.portal_client import patch_metadata
 from functions import script_utils as scu
+from functions.patch_executor import execute_patches
+from functions.patch_journal import get_journal
+
+# number of input ids whose types and tags are got together
+BATCH_SIZE = 200
 
 
 def make_tag_patch(item, tag):
@@ -16,7 +22,8 @@ def make_tag_patch(item, tag):
 def get_args():  # pragma: no cover
     parser = argparse.ArgumentParser(
         description='Add a tag to provided items (and optionally their children)',
-        parents=[scu.create_input_arg_parser(), scu.create_ff_arg_parser()],
+        parents=[scu.create_input_arg_parser(), scu.create_ff_arg_parser(), scu.create_journal_arg_parser(),
+                 scu.create_stream_arg_parser()],
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
     parser.add_argument('tag',
@@ -30,6 +37,16 @@ def get_args():  # pragma: no cover
                         help="List of Item Types to Explicitly Exclude Tagging - \
                         you may have some linked items that can get tags but may \
                         not want to tag them with this tag")
+    parser.add_argument('--workers',
+                        type=int,
+                        default=8,
+                        help='Number of items to fetch at the same time when getting linked items. \
+                        Default is 8')
+    parser.add_argument('--use_es',
+                        default=False,
+                        action='store_true',
+                        help='Get the type and links of linked items with bulk ES requests \
+                        - items not yet indexed are fetched from the portal')
     args = parser.parse_args()
     if args.key:
         args.key = scu.convert_key_arg_to_dict(args.key)
@@ -43,41 +60,62 @@ def main():  # pragma: no cover
     except Exception:
         print("Authentication failed")
         sys.exit(1)
-    itemids = scu.get_item_ids_from_args(args.input, auth, args.search)
+    itemids = scu.iter_item_ids_from_args(args.input, auth, args.search, args.stream)
     taggable = scu.get_types_that_can_have_field(auth, 'tags')
     if args.types2exclude is not None:
         # remove explicitly provide types not to tag
         taggable = [t for t in taggable if t not in args.types2exclude]
 
-    seen = []   # only need to add tag once so this keeps track of what's been seen
-    to_patch = {}   # keep track of those to patch
-    # main loop through the top level item ids
-    for itemid in itemids:
-        items2tag = {}
+    journal = get_journal(args)
+    # journal entries are for the tag being added rather than the full tags patch
+    # so that items already tagged in a previous run can be skipped without a get
+    tag_op = {'add_tag': args.tag}
+    seen = scu.OrderedSet()   # only need to add tag once so this keeps track of what's been seen
+    # types and tags are got with bulk requests and kept so each item is only read once
+    resolver = scu.ItemInfoResolver(auth, fields=['tags'])
+
+    def items_to_tag():
+        # yields dicts of item id to type for each batch of items to tag
         if args.taglinked:
-            # need to get linked items and tag them
-            linked = scu.get_linked_items(auth, itemid, {})
-            items2tag = scu.filter_dict_by_value(linked, taggable, include=True)
+            for itemid in itemids:
+                # need to get linked items and tag them
+                linked = scu.get_linked_items_parallel(auth, itemid, {}, max_workers=args.workers,
+                                                       use_es=args.use_es)
+                yield scu.filter_dict_by_value(linked, taggable, include=True)
         else:
             # only want to tag provided items
-            itype = scu.get_item_type(auth, itemid)
-            if itype in taggable:
-                items2tag = {itemid: itype}
-        for i, t in items2tag.items():
-            if i not in seen:
-                seen.append(i)
-                item = get_metadata(i, auth)
+            for batch in scu.chunk_list(itemids, BATCH_SIZE):
+                yield scu.filter_dict_by_value(resolver.get_types(batch), taggable, include=True)
+
+    def to_patch():
+        # yields (item id, patch) a batch at a time so patching starts before all the items are read
+        for items2tag in items_to_tag():
+            new = [i for i in items2tag if i not in seen]
+            seen.update(new)
+            if journal is not None:
+                new = [i for i in new if not journal.is_done(i, tag_op)]
+            infos = resolver.resolve(new)
+            for i in new:
+                item = infos[i]
+                if item is None:
+                    continue
                 if not scu.has_field_value(item, 'tags', args.tag):
-                    # not already tagged with this tag so make a patch and add 2 dict
-                    to_patch[i] = make_tag_patch(item, args.tag)
+                    # not already tagged with this tag so make a patch
+                    yield i, make_tag_patch(item, args.tag)
 
     # now do the patching or reporting
-    for pid, patch in to_patch.items():
-        if args.dbupdate:
-            pres = patch_metadata(patch, pid, auth)
-            print(pres['status'])
-        else:
+    if not args.dbupdate:
+        for pid, patch in to_patch():
             print("DRY RUN: patch ", pid, " with ", patch)
+        return
+
+    def report_result(pid, patch, res):
+        if journal is not None:
+            journal.record(pid, tag_op, res)
+        print(res['status'] if isinstance(res, dict) else res)
+
+    execute_patches(to_patch(), lambda pid, patch: patch_metadata(patch, pid, auth),
+                    on_result=report_result)
 
 
 if __name__ == '__main__':  # pragma: no cover
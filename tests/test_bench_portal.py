@@ -0,0 +1,50 @@
+from benchmarks import bench_portal as bp
+from benchmarks.fake_portal import make_graph, FakePortal, fake_es_client
+from scripts import item_fetcher
+
+
+def test_make_graph_links_runs_to_files():
+    graph = make_graph(100)
+    fastq = graph.by_type['FileFastq'][0]
+    emb = graph.frame(fastq)
+    assert emb['uuid'] == fastq
+    assert [w['display_title'].split(' run ')[0] for w in emb['workflow_run_inputs']][:2] == ['md5 0.0.1', 'md5 0.2.6']
+    assert graph.resolve(emb['@id']) == fastq
+
+
+def test_run_benchmark_counts_requests():
+    res = bp.run_benchmark(bp.bench_tag_release_freeze, 100)
+    # 1 set, 2 experiments, 4 fastqs and 2 processed files are tagged
+    assert res['ops'] == 9
+    assert res['requests']['PATCH item'] == 9
+    assert res['requests']['GET search'] == 1
+
+
+def test_compare_flags_regressions():
+    base = {'1k': {'find_pairs': {'ops_per_sec': 10.0, 'relative_speed': 0.1, 'requests': {'GET item': 16}}}}
+    ok = {'1k': {'find_pairs': {'ops_per_sec': 8.0, 'relative_speed': 0.08, 'requests': {'GET item': 16}}}}
+    assert bp.compare(ok, base, tolerance=0.3, check_throughput=True) == []
+    slow = {'1k': {'find_pairs': {'ops_per_sec': 6.0, 'relative_speed': 0.06,
+                                  'requests': {'GET item': 17, 'HEAD s3': 1}}}}
+    # only request counts are checked unless asked
+    assert len(bp.compare(slow, base, tolerance=0.3)) == 2
+    problems = bp.compare(slow, base, tolerance=0.3, check_throughput=True)
+    assert len(problems) == 3
+    assert 'relative speed' in problems[0]
+    # a slower machine is fine if the calibration run is slower too
+    slow_machine = {'1k': {'find_pairs': {'ops_per_sec': 2.0, 'relative_speed': 0.1, 'requests': {'GET item': 16}}}}
+    assert bp.compare(slow_machine, base, check_throughput=True) == []
+
+
+def test_item_fetcher_bulk_same_rows():
+    graph = make_graph(100)
+    ids = bp._fetch_ids(graph)
+    fields = ['file_size', 'status', 'file_format']
+    with FakePortal(graph) as portal, fake_es_client(portal):
+        rows = [item_fetcher.format_row(i, r, fields) for i, r in item_fetcher.iter_items(portal.auth, ids, fields)]
+        portal.reset_counts()
+        bulk = [item_fetcher.format_row(i, r, fields)
+                for i, r in item_fetcher.iter_items(portal.auth, ids, fields, bulk=True)]
+        assert sum(portal.requests.values()) == 3
+    assert rows == bulk
+    assert len(rows) == len(ids)
@@ -0,0 +1,117 @@
+import io
+import pytest
+from scripts import check_release_wfrs as crw
+
+
+def wfr(uuid, title, inputs, status='in review by lab', outputs=()):
+    return {'uuid': uuid, '@id': '/workflow-runs-awsem/%s/' % uuid, 'display_title': title, 'status': status,
+            'run_status': 'complete', 'input_files': [{'value': {'uuid': i}} for i in inputs],
+            'output_files': [{'value': {'uuid': o}} for o in outputs]}
+
+
+@pytest.fixture
+def portal_docs():
+    runs = [wfr('w1', 'md5 0.2.6 run 2020-01-01 10:00:00', ['f1']),
+            wfr('w2', 'md5 0.2.6 run 2020-01-02 10:00:00', ['f1']),
+            wfr('w3', 'bwa-mem 0.2.5 run 2020-01-03 10:00:00', ['f1', 'f2'], outputs=['pf1']),
+            wfr('w4', 'md5 0.2.6 run 2020-01-02 10:00:00', ['f2']),
+            wfr('w5', 'md5 0.2.6 run 2020-01-02 10:00:00', ['f3'], status='released')]
+    files = [{'uuid': 'f1', '@id': '/files-fastq/4DNFI0000001/', 'accession': '4DNFI0000001', 'status': 'uploaded',
+              'workflow_run_inputs': [{'uuid': 'w1'}, {'uuid': 'w2'}, {'uuid': 'w3'}]},
+             {'uuid': 'f2', '@id': '/files-fastq/4DNFI0000002/', 'accession': '4DNFI0000002', 'status': 'uploaded',
+              'workflow_run_inputs': [{'uuid': 'w3'}, {'uuid': 'w4'}]},
+             {'uuid': 'f3', '@id': '/files-fastq/4DNFI0000003/', 'accession': '4DNFI0000003', 'status': 'deleted',
+              'workflow_run_inputs': [{'uuid': 'w5'}]},
+             {'uuid': 'pf2', '@id': '/files-processed/4DNFI0000004/', 'accession': '4DNFI0000004',
+              'status': 'uploaded', 'workflow_run_inputs': []}]
+    docs = {'set1': {'@type': ['ExperimentSetReplicate', 'Item'], 'processed_files': [{'uuid': 'pf2'}],
+                     'experiments_in_set': [{'uuid': 'exp1'}, {'uuid': 'exp2'}]},
+            'exp1': {'@type': ['ExperimentHiC', 'Item'], 'files': [{'uuid': 'f1'}, {'uuid': 'f2'}]},
+            'exp2': {'@type': ['ExperimentHiC', 'Item'], 'files': [{'uuid': 'f2'}]}}
+    for item in files + runs:
+        docs[item['uuid']] = dict(item, **{'@type': ['FileFastq', 'File', 'Item']} if item in files else {})
+    return docs
+
+
+@pytest.fixture
+def es(mocker, portal_docs):
+    def get_es_metadata(uuids, sources=None, key=None, is_generator=False):
+        return [{'uuid': u, 'embedded': portal_docs[u]} for u in uuids if u in portal_docs]
+
+    return mocker.patch('scripts.check_release_wfrs.get_es_metadata', side_effect=get_es_metadata)
+
+
+def test_get_file_uuids(auth, es):
+    assert crw.get_file_uuids(auth, ['set1', 'f3']) == ['pf2', 'f3', 'f1', 'f2']
+    assert es.call_count == 2
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_check_release(auth, es, workers):
+    results, plan = crw.check_release(auth, ['set1', 'f3'], workers=workers, chunk_size=2)
+    assert [r['accession'] for r in results] == ['4DNFI0000004', '4DNFI0000003', '4DNFI0000001', '4DNFI0000002']
+    by_acc = {r['accession']: r for r in results}
+    assert by_acc['4DNFI0000001']['runs'] == ['w1', 'w3']
+    assert by_acc['4DNFI0000002']['runs'] == ['w3']
+    assert not by_acc['4DNFI0000004']['checked']
+    assert by_acc['4DNFI0000003']['notes'][0][0] == 'flagged'
+    # the bwa-mem run and its output are planned for both fastqs but only patched once
+    assert list(plan.steps) == ['w1', 'w3', 'pf1']
+    assert plan.steps['w3']['reasons'] == ['old style or dub']
+    # 4 lookups - the items, the experiments, the files and the runs
+    assert es.call_count == 4
+
+
+def test_check_release_md5_runs_searched_in_chunks(mocker, auth, es, portal_docs):
+    mics = ['mic%d' % i for i in range(3)]
+    for i, uid in enumerate(mics):
+        portal_docs[uid] = {'uuid': uid, '@id': '/files-microscopy/4DNFIMIC000%d/' % i,
+                            'accession': '4DNFIMIC000%d' % i, 'status': 'uploaded', 'workflow_run_inputs': [],
+                            '@type': ['FileMicroscopy', 'File', 'Item']}
+
+    def search(query, auth):
+        runs = []
+        for i in range(3):
+            if 'accession=4DNFIMIC000%d' % i in query:
+                mic = {'uuid': 'mic%d' % i, 'accession': '4DNFIMIC000%d' % i}
+                for run in [wfr('m%da' % i, 'md5 0.2.6 run 2020-01-01 10:00:00', []),
+                            wfr('m%db' % i, 'md5 0.2.6 run 2020-01-02 10:00:00', [])]:
+                    runs.append(dict(run, input_files=[{'value': mic}]))
+        return runs
+    sm = mocker.patch('scripts.check_release_wfrs.search_metadata', side_effect=search)
+    mocker.patch('scripts.check_release_wfrs.scu.SEARCH_CHUNK_SIZE', 2)
+    results, plan = crw.check_release(auth, mics, workers=1, chunk_size=2)
+    assert sm.call_count == 2
+    assert [r['runs'] for r in results] == [['m0a'], ['m1a'], ['m2a']]
+
+
+def test_write_report(auth, es):
+    results, plan = crw.check_release(auth, ['set1', 'f3'], workers=1)
+    out = io.StringIO()
+    cnts = crw.write_report(results, plan, out)
+    lines = out.getvalue().splitlines()
+    assert lines[0] == '#file\taction\titem\tdetail'
+    assert lines[1].startswith('4DNFI0000003\tflagged\t\tdelete released!!!!! md5')
+    assert '4DNFI0000001\tdelete\tpf1\tstatus=deleted; output of deleted run' in lines
+    assert lines[-2] == '# 2 workflow runs and 3 items in all to patch'
+    assert lines[-1] == '# 0 running, 0 skipped, 1 flagged, 0 error'
+    assert cnts['delete'] == 3
+
+
+def test_checked_and_not_checked_files_are_disjoint(mocker, auth):
+    def plan_wfr_deletions(file_resp, auth, plan, stash, notes=None):
+        plan.delete('w_' + file_resp['uuid'], reason='old run')
+        notes.append(('delete', 'old run'))
+        if file_resp['uuid'] == 'bad':
+            raise ValueError('no display_title')
+        # planned steps but no runs - eg. the qc of a deleted file
+        return None
+    mocker.patch('scripts.check_release_wfrs.plan_wfr_deletions', side_effect=plan_wfr_deletions)
+    results = [crw.check_file({'uuid': u, 'accession': u.upper()}, auth, None) for u in ['bad', 'good']]
+    assert [(r['checked'], [s[0] for s in r['steps']]) for r in results] == [(False, []), (True, ['w_good'])]
+    out = io.StringIO()
+    cnts = crw.write_report(results, crw.DeletionPlan(), out)
+    lines = out.getvalue().splitlines()
+    assert [line.split('\t')[:2] for line in lines[1:3]] == [['BAD', 'error'], ['GOOD', 'delete']]
+    assert '# 1 files checked, 1 not checked' in lines
+    assert (cnts['delete'], cnts['error']) == (1, 1)
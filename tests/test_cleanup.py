@@ -0,0 +1,147 @@
+import pytest
+from datetime import datetime
+from functions import cleanup as cl
+
+
+def wfr(uuid, title, inputs, status='in review by lab', outputs=()):
+    return {'uuid': uuid, '@id': '/workflow-runs-awsem/%s/' % uuid, 'display_title': title, 'status': status,
+            'run_status': 'complete', 'input_files': [{'value': i} for i in inputs],
+            'output_files': [{'value': {'uuid': o}} for o in outputs]}
+
+
+@pytest.fixture
+def runs():
+    fq = {'uuid': 'fq1', 'accession': '4DNFIAAAAAAA'}
+    return [
+        wfr('w1', 'md5 0.0.1 run 2020-01-01 10:00:00.000000', [fq]),
+        wfr('w2', 'md5 0.2.6 run 2020-01-02 10:00:00.000000', [fq]),
+        wfr('w3', 'bwa-mem 0.2.6 run 2020-01-03 10:00:00', [fq, 'fq2'], outputs=['pf1']),
+        wfr('w4', 'File Provenance Tracking run 2020-01-03 10:00:00', ['fq2']),
+    ]
+
+
+def test_wfr_name():
+    assert cl.wfr_name({'display_title': 'md5 0.2.6 run 2020-01-01 10:00:00'}) == 'md5'
+    assert cl.wfr_name({'display_title': 'File Provenance Tracking run 2020-01-03'}) == 'File Provenance Tracking'
+
+
+def test_stash_indexes(runs):
+    stash = cl.WorkflowRunStash(runs + runs[:1])
+    assert len(stash) == 4
+    assert 'w1' in stash and stash.get('w3')['uuid'] == 'w3'
+    assert [w['uuid'] for w in stash.for_uuids(['w3', 'w1', 'w3', 'nope'])] == ['w3', 'w1']
+    assert [w['uuid'] for w in stash.for_input('4DNFIAAAAAAA')] == ['w1', 'w2', 'w3']
+    assert [w['uuid'] for w in stash.for_input('fq2')] == ['w3', 'w4']
+    assert [w['uuid'] for w in stash.for_workflow('md5')] == ['w1', 'w2']
+    assert [w['uuid'] for w in stash] == ['w1', 'w2', 'w3', 'w4']
+    assert not cl.WorkflowRunStash()
+
+
+@pytest.mark.parametrize('as_list', [True, False])
+def test_delete_wfrs_with_stash(mocker, auth, runs, as_list):
+    es = mocker.patch('functions.cleanup.pc.get_es_metadata')
+    pm = mocker.patch('functions.deletion_plan.pc.patch_metadata', return_value={'status': 'success'})
+    file_resp = {'@id': '/files-fastq/4DNFIAAAAAAA/', 'accession': '4DNFIAAAAAAA', 'status': 'uploaded',
+                 'workflow_run_inputs': [{'uuid': 'w1'}, {'uuid': 'w2'}, {'uuid': 'w3'}]}
+    stash = runs if as_list else cl.WorkflowRunStash(runs)
+    deleted = cl.delete_wfrs(file_resp, auth, delete=True, stash=stash)
+    # the md5 run with a revision that is no longer accepted is the only one to go
+    assert deleted == ['w1']
+    assert pm.call_args[0][:2] == ({'description': 'This workflow run is deleted', 'status': 'deleted'}, 'w1')
+    assert not es.called
+
+
+def test_delete_wfrs_shared_plan(mocker, auth, runs):
+    pm = mocker.patch('functions.deletion_plan.pc.patch_metadata')
+    mocker.patch('functions.cleanup.pc.get_es_metadata')
+    runs[0]['output_files'] = [{'value': {'uuid': 'out1'}}]
+    file_resp = {'@id': '/files-fastq/4DNFIAAAAAAA/', 'accession': '4DNFIAAAAAAA', 'status': 'uploaded',
+                 'workflow_run_inputs': [{'uuid': 'w1'}, {'uuid': 'w2'}, {'uuid': 'w3'}]}
+    plan = cl.DeletionPlan()
+    stash = cl.WorkflowRunStash(runs)
+    # the same file checked twice only plans each patch once and sends nothing
+    assert cl.delete_wfrs(file_resp, auth, delete=True, stash=stash, plan=plan) == ['w1']
+    assert cl.delete_wfrs(file_resp, auth, delete=True, stash=stash, plan=plan) == ['w1']
+    assert not pm.called
+    assert list(plan.steps) == ['w1', 'out1']
+    assert plan.steps['out1']['after'] == ['w1']
+    assert plan.levels() == [['w1'], ['out1']]
+
+
+def test_delete_wfrs_dry_run_plans_nothing(mocker, auth, runs):
+    pm = mocker.patch('functions.deletion_plan.pc.patch_metadata')
+    file_resp = {'@id': '/files-fastq/4DNFIAAAAAAA/', 'accession': '4DNFIAAAAAAA', 'status': 'uploaded',
+                 'workflow_run_inputs': [{'uuid': 'w1'}, {'uuid': 'w2'}]}
+    plan = cl.DeletionPlan()
+    assert cl.delete_wfrs(file_resp, auth, stash=runs, plan=plan) == []
+    assert not plan and not pm.called
+
+
+def test_parse_wfr_title():
+    assert cl.parse_wfr_title('bwa-mem 0.2.6 run 2018-06-14 16:09:36.035906') == (
+        'bwa-mem', '0.2.6', datetime(2018, 6, 14, 16, 9, 36, 35906))
+    assert cl.parse_wfr_title('md5 0.2.6 run on 2020-01-01 10:00:00.5')[2] == datetime(2020, 1, 1, 10, 0, 0, 500000)
+    assert cl.parse_wfr_title('File Provenance Tracking run 2020-01-03 10:00:00') is None
+    assert cl.parse_wfr_title('md5 run 2020-01-01 10:00:00') is None
+
+
+def test_workflow_rules():
+    assert list(cl.WORKFLOW_RULES) == cl.workflow_names
+    assert cl.WORKFLOW_RULES['md5'].revisions == {'0.0.4', '0.2.6'}
+    assert cl.WORKFLOW_RULES['md5'].run_time == 12
+
+
+def test_wfr_report_grouped_by_name(runs):
+    report = cl.get_wfr_report(list(reversed(runs)))
+    assert [r['wfr_uuid'] for r in report] == ['w1', 'w2', 'w3']
+    assert report[2]['outputs'] == ['pf1'] and report[0]['wfr_version'] == '0.0.1'
+    groups = cl.group_wfr_report(report)
+    assert list(groups) == ['md5', 'bwa-mem']
+    assert [r['wfr_uuid'] for r in groups['md5']] == ['w1', 'w2']
+
+
+def test_delete_wfrs_rules(mocker, auth, capsys):
+    pm = mocker.patch('functions.deletion_plan.pc.patch_metadata', return_value={'status': 'success'})
+    runs = [wfr('w1', 'md5 0.2.6 run 2020-01-01 10:00:00', ['fq1']),
+            wfr('w2', 'md5 0.2.6 run 2020-01-02 10:00:00', ['fq1']),
+            wfr('w3', 'bwa-mem 0.2.5 run 2020-01-03 10:00:00', ['fq1'], outputs=['bam1']),
+            wfr('w4', 'not-a-workflow v1 run 2020-01-03 10:00:00', ['fq1'])]
+    started = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    runs.append(dict(wfr('w5', 'fastqc v2 run ' + started, ['fq1']), run_status='running'))
+    file_resp = {'@id': '/files-fastq/4DNFIAAAAAAA/', 'accession': '4DNFIAAAAAAA', 'status': 'uploaded',
+                 'workflow_run_inputs': [{'uuid': w['uuid']} for w in runs]}
+    # the older md5 duplicate and the bwa-mem run of a revision no longer accepted go,
+    # the still running fastqc and the unlisted workflow stay
+    assert cl.delete_wfrs(file_resp, auth, delete=True, stash=runs, workers=1) == ['w1', 'w3']
+    assert [c[0][1] for c in pm.call_args_list] == ['w1', 'w3', 'bam1']
+    assert "Unlisted Workflow ['not-a-workflow']" in capsys.readouterr().out
+
+
+def test_delete_wfrs_md5_runs_from_stash(mocker, auth):
+    sm = mocker.patch('functions.cleanup.pc.search_metadata')
+    mic = {'uuid': 'mic1', 'accession': '4DNFIMIC0001'}
+    stash = cl.WorkflowRunStash([wfr('w1', 'md5 0.2.6 run 2020-01-01 10:00:00', [mic]),
+                                 wfr('w2', 'md5 0.2.6 run 2020-01-02 10:00:00', [mic]),
+                                 wfr('w3', 'fastqc 0.2.0 run 2020-01-02 10:00:00', [mic])])
+    file_resp = {'@id': '/files-microscopy/4DNFIMIC0001/', 'uuid': 'mic1', 'accession': '4DNFIMIC0001',
+                 'status': 'uploaded', 'workflow_run_inputs': []}
+    # only the md5 runs the search would find are used and the older duplicate goes
+    assert cl.delete_wfrs(file_resp, auth, stash=stash, plan=cl.DeletionPlan(), delete=True) == ['w1']
+    assert not sm.called
+    # without a stash they are searched for
+    sm.return_value = [wfr('w2', 'md5 0.2.6 run 2020-01-02 10:00:00', [mic])]
+    assert cl.delete_wfrs(file_resp, auth) == []
+    assert sm.call_args[0][0] == cl.MD5_RUNS_SEARCH + '&input_files.value.accession=4DNFIMIC0001'
+
+
+def test_delete_wfrs_failed_patch(mocker, auth, runs, capsys):
+    pm = mocker.patch('functions.deletion_plan.pc.patch_metadata', side_effect=Exception('403 forbidden'))
+    runs[0]['output_files'] = [{'value': {'uuid': 'out1'}}]
+    file_resp = {'@id': '/files-fastq/4DNFIAAAAAAA/', 'accession': '4DNFIAAAAAAA', 'status': 'uploaded',
+                 'workflow_run_inputs': [{'uuid': 'w1'}, {'uuid': 'w2'}]}
+    with pytest.raises(cl.DeletionFailed) as err:
+        cl.delete_wfrs(file_resp, auth, delete=True, stash=runs)
+    assert not err.value.summary.succeeded
+    assert err.value.summary.failed == {'w1': '403 forbidden', 'out1': 'NOT PATCHED - w1 failed'}
+    assert pm.call_count == 1
+    assert 'FAILED w1 403 forbidden' in capsys.readouterr().out
@@ -0,0 +1,68 @@
+import threading
+import time
+from functions import data_loader as dl
+
+
+def _items(n):
+    return [{'uuid': 'u%d' % i} for i in range(n)]
+
+
+def _fake_post(bad=(), posted=None):
+    def post(payload, endpoint, auth):
+        assert endpoint == 'load_data'
+        [(itype, items)] = payload['store'].items()
+        if any(i['uuid'] in bad for i in items):
+            raise Exception('bad item')
+        if posted is not None:
+            posted.extend(i['uuid'] for i in items)
+        return {'status': 'success'}
+    return post
+
+
+def test_load_with_bisect_isolates_bad_items(mocker, auth):
+    posted = []
+    post = mocker.patch('functions.data_loader.post_metadata', side_effect=_fake_post({'u3', 'u6'}, posted))
+    failed = dl.load_with_bisect(auth, 'lab', _items(8))
+    assert [f[0] for f in failed] == ['u3', 'u6']
+    assert sorted(posted) == sorted('u%d' % i for i in range(8) if i not in (3, 6))
+    # 1 + 2 halves + 4 quarters + 4 singles for the two bad quarters
+    assert post.call_count == 11
+
+
+def test_load_data_payload_localhost(mocker):
+    post = mocker.patch('functions.data_loader.post_metadata', return_value={})
+    dl.post_load_data({'server': 'http://localhost:8000'}, 'lab', _items(1))
+    payload = post.call_args[0][0]
+    assert payload == {'store': {'lab': _items(1)}, 'overwrite': True, 'config_uri': 'development.ini'}
+
+
+def test_load_items_chunks(mocker, auth):
+    posted = []
+    post = mocker.patch('functions.data_loader.post_metadata', side_effect=_fake_post(posted=posted))
+    assert dl.load_items(auth, 'lab', _items(25), chunk_size=10) == []
+    assert post.call_count == 3
+    assert sorted(posted) == sorted('u%d' % i for i in range(25))
+
+
+def test_submitter_runs_chunks_concurrently(mocker, auth):
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def slow_post(payload, endpoint, auth):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        if payload['store']['lab'][0]['uuid'] == 'u10':
+            raise Exception('bad')
+        return {}
+
+    mocker.patch('functions.data_loader.post_metadata', side_effect=slow_post)
+    submitter = dl.LoadDataSubmitter(auth, 'lab', workers=3, chunk_size=1)
+    for i in range(4):
+        submitter.submit(_items(12)[i * 3:(i + 1) * 3])
+    failed = submitter.finish()
+    assert failed == [('u10', 'bad')]
+    assert 1 < running[1] <= 3
@@ -0,0 +1,93 @@
+import pytest
+from functions import deletion_plan as dp
+from functions import notebook_functions as nf
+
+
+@pytest.fixture
+def plan():
+    plan = dp.DeletionPlan()
+    plan.add('run1', {'description': 'This workflow run is deleted', 'status': 'deleted'}, reason='old run')
+    plan.delete('out1', after=['run1'], reason='output')
+    plan.delete('qc1', after=['run1'], reason='qc')
+    plan.add('run2', {'description': 'This workflow run is deleted', 'status': 'deleted'}, reason='old run')
+    # shared output of both runs
+    plan.delete('out1', after=['run2'], reason='output')
+    return plan
+
+
+def test_plan_merges_steps_for_the_same_item(plan):
+    assert len(plan) == 4
+    assert 'out1' in plan and 'run3' not in plan
+    assert plan.steps['out1'] == {'patch': {'status': 'deleted'}, 'delete_fields': [],
+                                  'after': ['run1', 'run2'], 'reasons': ['output']}
+    plan.add('out1', delete_fields=['quality_metric', 'quality_metric'], after=['out1'])
+    assert plan.steps['out1']['delete_fields'] == ['quality_metric']
+    assert plan.steps['out1']['after'] == ['run1', 'run2']
+
+
+def test_plan_levels(plan):
+    assert plan.levels() == [['run1', 'run2'], ['out1', 'qc1']]
+
+
+def test_plan_levels_ignores_unplanned_and_cycles():
+    plan = dp.DeletionPlan()
+    plan.delete('a', after=['b', 'not_planned'])
+    plan.delete('b', after=['a'])
+    plan.delete('c')
+    assert plan.levels() == [['c'], ['a', 'b']]
+
+
+def test_execute_plan_in_order(mocker, auth, plan, capsys):
+    sent = []
+
+    def patch(patch, item_id, key, add_on=''):
+        sent.append(item_id)
+        return {'status': 'success'}
+
+    mocker.patch('functions.deletion_plan.pc.patch_metadata', side_effect=patch)
+    plan.add('file1', {'status': 'uploading'}, delete_fields=['md5sum', 'file_size'], after=['qc1'])
+    summary = dp.execute_plan(plan, auth, workers=4, progress_every=2)
+    assert sorted(summary.succeeded) == ['file1', 'out1', 'qc1', 'run1', 'run2']
+    assert set(sent[:2]) == {'run1', 'run2'} and sent.index('file1') > sent.index('qc1')
+    out = capsys.readouterr().out
+    assert '2 of 5 cleanup patches done' in out and '5 of 5 cleanup patches done' in out
+    assert dp.pc.patch_metadata.call_args_list[sent.index('file1')][1]['add_on'] == 'delete_fields=md5sum,file_size'
+
+
+def test_execute_plan_skips_dependents_of_failures(mocker, auth, plan):
+    def patch(patch, item_id, key, add_on=''):
+        if item_id == 'run2':
+            return {'status': 'error', 'description': 'access denied'}
+        return {'status': 'success'}
+
+    pm = mocker.patch('functions.deletion_plan.pc.patch_metadata', side_effect=patch)
+    summary = dp.execute_plan(plan, auth, progress_every=0)
+    assert sorted(summary.succeeded) == ['qc1', 'run1']
+    assert list(summary.failed) == ['run2', 'out1']
+    assert summary.failed['out1'] == 'NOT PATCHED - run2 failed'
+    assert 'out1' not in [c[0][1] for c in pm.call_args_list]
+
+
+def test_clean_for_reupload(mocker, auth):
+    mocker.patch('functions.notebook_functions.pc.get_metadata', return_value={
+        'uuid': 'f1', 'status': 'uploaded', 'md5sum': 'abc', 'file_size': 10, 'filename': 'f1.fastq.gz',
+        'quality_metric': {'uuid': 'qc1'}, 'workflow_run_inputs': [{'uuid': 'run1'}, {'uuid': 'run2'}]})
+    plan = nf.clean_for_reupload('4DNFIAAAAAAA', auth, plan=dp.DeletionPlan())
+    assert plan.levels() == [['run1', 'run2', 'qc1'], ['f1']]
+    assert plan.steps['f1']['patch'] == {'status': 'uploading'}
+    assert plan.steps['f1']['delete_fields'] == ['md5sum', 'file_size', 'filename', 'quality_metric']
+    pm = mocker.patch('functions.deletion_plan.pc.patch_metadata', return_value={'status': 'success'})
+    assert nf.clean_for_reupload('4DNFIAAAAAAA', auth, delete_runs=False) is None
+    assert [c[0][1] for c in pm.call_args_list] == ['qc1', 'f1']
+
+
+def test_clean_for_reupload_failed_patch(mocker, auth, capsys):
+    mocker.patch('functions.notebook_functions.pc.get_metadata', return_value={
+        'uuid': 'f1', 'status': 'uploaded', 'md5sum': 'abc', 'quality_metric': {'uuid': 'qc1'}})
+    pm = mocker.patch('functions.deletion_plan.pc.patch_metadata', side_effect=Exception('403 forbidden'))
+    with pytest.raises(dp.DeletionFailed) as err:
+        nf.clean_for_reupload('4DNFIAAAAAAA', auth)
+    # the file is not set to uploading when its qc could not be deleted
+    assert pm.call_count == 1
+    assert list(err.value.summary.failed) == ['qc1', 'f1']
+    assert 'FAILED qc1 403 forbidden' in capsys.readouterr().out
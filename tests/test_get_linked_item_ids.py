@@ -64,7 +64,9 @@ def test_gl_get_args_required_default():
         'no_children': None,
         'search': False,
         'types2exclude': None,
-        'types2include': None
+        'types2include': None,
+        'workers': 8,
+        'use_es': False
     }
     args = gli.get_args('i')
     for k, v in defaults.items():
@@ -96,6 +98,8 @@ def mocked_args_standard():
             'types2include': None,
             'no_children': None,
             'include_released': False,
+            'workers': 8,
+            'use_es': False,
         }
     )
 
@@ -113,6 +117,8 @@ def mocked_args_plus():
             'types2include': None,
             'no_children': ['Biosample'],
             'include_released': True,
+            'workers': 8,
+            'use_es': False,
         }
     )
 
@@ -130,6 +136,8 @@ def mocked_args_plus_more():
             'types2include': None,
             'no_children': ['Biosample'],
             'include_released': False,
+            'workers': 8,
+            'use_es': False,
         }
     )
 
@@ -166,7 +174,7 @@ def test_gl_main_standard(mocker, capsys, mocked_args_standard, auth, got_item_i
     mocker.patch('scripts.get_linked_item_ids.get_excluded',
                  return_value=['User', 'Lab', 'Award', 'OntologyTerm', 'Ontology',
                                'Organism', 'Publication', 'IndividualHuman'])
-    mocker.patch('scripts.get_linked_item_ids.scu.get_linked_items',
+    mocker.patch('scripts.get_linked_item_ids.scu.get_linked_items_parallel',
                  return_value=got_item_ids)
     mocker.patch('scripts.get_linked_item_ids.scu.filter_dict_by_value',
                  return_value=got_item_ids)
@@ -189,7 +197,7 @@ def test_gl_main_plus(mocker, capsys, mocked_args_plus, auth, got_item_ids):
                  return_value=['test_eset_uuid'])
     mocker.patch('scripts.get_linked_item_ids.get_excluded',
                  return_value=None)
-    mocker.patch('scripts.get_linked_item_ids.scu.get_linked_items',
+    mocker.patch('scripts.get_linked_item_ids.scu.get_linked_items_parallel',
                  return_value=got_item_ids)
     mocker.patch('scripts.get_linked_item_ids.scu.filter_dict_by_value',
                  return_value=got_item_ids)
@@ -212,7 +220,7 @@ def test_gl_main_plus_more(mocker, capsys, mocked_args_plus_more, auth, got_item
                  return_value=['test_eset_uuid', 'test_eset_uuid2'])
     mocker.patch('scripts.get_linked_item_ids.get_excluded',
                  return_value=None)
-    mocker.patch('scripts.get_linked_item_ids.scu.get_linked_items',
+    mocker.patch('scripts.get_linked_item_ids.scu.get_linked_items_parallel',
                  side_effect=[got_item_ids, {'ret_uuid1': got_item_ids['ret_uuid1']}])
     mocker.patch('scripts.get_linked_item_ids.is_released',
                  side_effect=se)
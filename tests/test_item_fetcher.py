@@ -0,0 +1,88 @@
+from urllib.parse import quote
+import pytest
+from scripts import item_fetcher as itf
+
+
+def test_format_row_flattens_linked_values():
+    res = {'lab': {'uuid': 'lab_uuid'}, 'files': [{'uuid': 'f1'}, 'f2'], 'file_size': 10}
+    assert itf.format_row('iid', res, ['lab', 'files', 'file_size', 'missing']) == 'iid\tlab_uuid\tf1, f2\t10\tNone\t'
+    assert itf.format_row('iid', res, ['file_size'], noid=True) == '10\t'
+
+
+def test_resolve_uuids_searches_per_field(mocker, auth):
+    uid = '4fdb481a-fd98-4bf2-b2e2-9be1fd0b1bd2'
+    sm = mocker.patch('scripts.item_fetcher.search_metadata', side_effect=[
+        [{'uuid': 'u1', 'accession': '4DNFIAAAAAAA'}], [{'uuid': 'u2', 'aliases': ['lab:a', 'lab:b']}]])
+    resolved = itf.resolve_uuids(auth, [uid, '/files-fastq/4DNFIAAAAAAA/', 'lab:b', '/labs/some-lab/'])
+    assert resolved == {uid: uid, '/files-fastq/4DNFIAAAAAAA/': 'u1', 'lab:b': 'u2'}
+    queries = [c[0][0] for c in sm.call_args_list]
+    assert queries[0] == 'search/?type=Item&accession=4DNFIAAAAAAA&field=uuid&field=accession'
+    assert queries[1] == 'search/?type=Item&aliases=lab%3Ab&field=uuid&field=aliases'
+
+
+def test_fetch_batch_projects_fields_and_falls_back(mocker, auth):
+    mocker.patch('scripts.item_fetcher.resolve_uuids', return_value={'a': 'u1', 'b': 'u2'})
+    es = mocker.patch('functions.script_utils.get_es_metadata',
+                      return_value=[{'uuid': 'u1', 'object': {'status': 'released'}}])
+    gm = mocker.patch('functions.script_utils.get_metadata',
+                      side_effect=[{'status': 'deleted'}, Exception('not found')])
+    res = itf.fetch_batch(auth, ['a', 'b', 'c'], ['status'])
+    assert list(res.items()) == [('a', {'status': 'released'}), ('b', {'status': 'deleted'}), ('c', None)]
+    assert es.call_args[1]['sources'] == ['uuid', 'object.status']
+    assert gm.call_count == 2
+
+
+def test_resolve_uuids_chunks_and_survives_failed_search(mocker, auth, capsys):
+    aliases = ['lab:%d' % i for i in range(5)]
+
+    def search(query, auth):
+        if 'lab%3A2' in query:
+            raise Exception('414 Request-URI Too Long')
+        return [{'uuid': 'u' + a[-1], 'aliases': [a]} for a in aliases if quote(a) in query]
+    sm = mocker.patch('scripts.item_fetcher.search_metadata', side_effect=search)
+    resolved = itf.resolve_uuids(auth, aliases, chunk_size=2)
+    assert sm.call_count == 3
+    assert resolved == {'lab:0': 'u0', 'lab:1': 'u1', 'lab:4': 'u4'}
+    assert 'Search for 2 aliases values failed' in capsys.readouterr().err
+
+
+def test_fetch_batch_falls_back_when_es_fails(mocker, auth, capsys):
+    mocker.patch('scripts.item_fetcher.resolve_uuids', return_value={'a': 'u1', 'b': 'u2'})
+    mocker.patch('functions.script_utils.get_es_metadata', side_effect=Exception('ES timed out'))
+    gm = mocker.patch('functions.script_utils.get_metadata', side_effect=lambda iid, auth, add_on: {'uuid': iid})
+    res = itf.fetch_batch(auth, ['a', 'b'], ['status'])
+    assert list(res.items()) == [('a', {'uuid': 'a'}), ('b', {'uuid': 'b'})]
+    assert gm.call_count == 2
+    assert 'ES request for 2 items failed' in capsys.readouterr().err
+
+
+def test_iter_items_bulk_in_batches(mocker, auth):
+    fb = mocker.patch('scripts.item_fetcher.fetch_batch',
+                      side_effect=lambda auth, ids, fields: {i: {'id': i} for i in ids})
+    ids = ['a', 'b', 'c']
+    assert [i for i, _ in itf.iter_items(auth, ids, ['status'], bulk=True, batch_size=2)] == ids
+    assert fb.call_count == 2
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_iter_items_bulk_repeated_ids_like_serial(mocker, auth, workers):
+    mocker.patch('scripts.item_fetcher.resolve_uuids', return_value={})
+    mocker.patch('scripts.item_fetcher.get_metadata', side_effect=lambda iid, auth, add_on: {'uuid': iid})
+    mocker.patch('functions.script_utils.get_metadata', side_effect=lambda iid, auth, add_on: {'uuid': iid})
+    ids = ['a', 'b', 'a', 'c', 'a']
+    serial = list(itf.iter_items(auth, ids))
+    assert [i for i, _ in serial] == ids
+    assert list(itf.iter_items(auth, ids, bulk=True, batch_size=2, workers=workers)) == serial
+
+
+def test_iter_items_workers_in_order_with_problems(mocker, auth):
+    def get(iid, auth, add_on=None):
+        if iid == 'bad':
+            raise Exception('not found')
+        return {'uuid': iid}
+    mocker.patch('scripts.item_fetcher.get_metadata', side_effect=get)
+    ids = ['id%d' % i for i in range(10)] + ['bad', 'last']
+    res = list(itf.iter_items(auth, ids, workers=4))
+    assert [i for i, _ in res] == ids
+    assert res[10] == ('bad', None)
+    assert res[11] == ('last', {'uuid': 'last'})
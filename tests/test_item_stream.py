@@ -0,0 +1,63 @@
+import io
+import json
+import pytest
+from functions import item_stream as ist
+
+
+ITEMS = [{'uuid': 'u%d' % i, 'title': 'item {} with some text'.format(i), 'vals': list(range(i % 5))}
+         for i in range(50)]
+
+
+def _stream(text, itype=None, lines=False, read_size=7):
+    # a tiny read size so values are split across reads
+    return list(ist.iter_items(io.StringIO(text), itype, lines, read_size=read_size))
+
+
+def test_iter_items_list():
+    res = _stream(json.dumps(ITEMS, indent=2), itype='lab')
+    assert res == [('lab', item) for item in ITEMS]
+
+
+def test_iter_items_store():
+    store = {'lab': ITEMS[:3], 'award': [], 'user': ITEMS[3:5]}
+    res = _stream(json.dumps(store))
+    assert res == [('lab', i) for i in ITEMS[:3]] + [('user', i) for i in ITEMS[3:5]]
+
+
+def test_iter_items_json_lines():
+    text = '\n'.join(json.dumps(i) for i in ITEMS[:4]) + '\n\n'
+    assert _stream(text, itype='lab', lines=True) == [('lab', i) for i in ITEMS[:4]]
+
+
+def test_iter_items_empty():
+    assert _stream('[]', itype='lab') == []
+    assert _stream(' {} ') == []
+
+
+def test_iter_items_errors():
+    with pytest.raises(ValueError):
+        _stream(json.dumps(ITEMS))  # list with no type
+    with pytest.raises(ValueError):
+        _stream('"not items"', itype='lab')
+    with pytest.raises(ValueError):
+        _stream('[{"a": 1}, {"b": ', itype='lab')
+
+
+def test_spool_and_chunk(tmp_path):
+    infile = tmp_path / 'items.json'
+    infile.write_text(json.dumps({'lab': ITEMS[:25], 'user': ITEMS[25:]}))
+    spool_dir = tmp_path / 'spool'
+    spool_dir.mkdir()
+    spooled = ist.spool_items_by_type(str(infile), str(spool_dir))
+    assert sorted(spooled) == ['lab', 'user']
+    assert spooled['lab'][1] == 25
+    chunks = list(ist.iter_spooled_chunks(spooled['lab'][0], chunk_size=10))
+    assert [len(c) for c in chunks] == [10, 10, 5]
+    assert [i for c in chunks for i in c] == ITEMS[:25]
+
+
+def test_spool_json_lines(tmp_path):
+    infile = tmp_path / 'items.jsonl'
+    infile.write_text('\n'.join(json.dumps(i) for i in ITEMS))
+    spooled = ist.spool_items_by_type(str(infile), str(tmp_path), itype='lab')
+    assert spooled['lab'][1] == 50
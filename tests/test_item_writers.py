@@ -0,0 +1,130 @@
+import io
+import csv
+import json
+import pytest
+from functions import item_writers as iw
+
+
+@pytest.fixture
+def rows():
+    return [
+        {'id': 'a', 'lab': {'uuid': 'lab1', '@id': '/labs/lab1/'}, 'files': ['f1', {'uuid': 'f2'}], 'file_size': 10},
+        {'id': 'b', 'lab': None, 'files': [], 'file_size': 20},
+    ]
+
+
+def test_tsv_writer_matches_printed_rows(tmp_path, rows):
+    out = str(tmp_path / 'out.tsv')
+    with iw.get_writer('tsv', ['id', 'lab', 'files', 'file_size'], out) as writer:
+        for row in rows:
+            writer.write(row)
+    with open(out) as of:
+        assert of.read() == '#id\tlab\tfiles\tfile_size\na\tlab1\tf1, f2\t10\t\nb\tNone\t\t20\t\n'
+
+
+def test_csv_and_jsonl_writers(tmp_path, rows):
+    with iw.get_writer('csv', ['id', 'lab', 'files'], str(tmp_path / 'out.csv')) as writer:
+        for row in rows:
+            writer.write(row)
+    with open(str(tmp_path / 'out.csv')) as of:
+        assert list(csv.reader(of)) == [['id', 'lab', 'files'], ['a', 'lab1', 'f1, f2'], ['b', '', '']]
+    with iw.get_writer('jsonl', [], str(tmp_path / 'out.jsonl')) as writer:
+        for row in rows:
+            writer.write(row)
+    with open(str(tmp_path / 'out.jsonl')) as of:
+        assert [json.loads(line) for line in of] == rows
+    assert writer.rows == 2
+
+
+def test_writer_to_stdout(mocker):
+    out = io.StringIO()
+    mocker.patch('functions.item_writers.sys.stdout', out)
+    with iw.get_writer('jsonl', []) as writer:
+        writer.write({'a': 1})
+    assert out.getvalue() == '{"a": 1}\n'
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        iw.get_writer('xlsx', [])
+
+
+def test_column_kinds():
+    assert iw._column_kind([1, None, 2]) == 'int'
+    assert iw._column_kind([1, 2.5]) == 'float'
+    assert iw._column_kind([True, False]) == 'bool'
+    assert iw._column_kind([['a'], []]) == 'list'
+    assert iw._column_kind([[{'a': 1}]]) == 'list'
+    assert iw._column_kind([[['a']]]) == 'string'
+    assert iw._column_kind(['a', 1]) == 'string'
+    assert iw._column_kind([None]) == 'string'
+    assert iw._column_kind([1, 2, None, 2.5]) == 'float'
+    assert iw._column_kind([1, True]) == 'string'
+    assert iw._column_kind([['a'], 'b']) == 'string'
+    assert iw._convert({'a': 1}, 'string', 'c') == '{"a": 1}'
+    assert iw._convert('x', 'list', 'c') == ['x']
+    with pytest.raises(ValueError):
+        iw._convert('x', 'int', 'c')
+
+
+def test_parquet_writer(tmp_path, rows):
+    pq = pytest.importorskip('pyarrow.parquet')
+    out = str(tmp_path / 'out.parquet')
+    writer = iw.ParquetWriter(['id', 'files', 'file_size'], out, row_group_size=1)
+    for row in rows:
+        writer.write(row)
+    writer.close()
+    table = pq.read_table(out)
+    assert table.column('file_size').to_pylist() == [10, 20]
+    assert table.column('files').to_pylist() == [['f1', '{"uuid": "f2"}'], []]
+    assert pq.ParquetFile(out).metadata.num_row_groups == 2
+    encodings = [pq.ParquetFile(out).metadata.row_group(0).column(i).encodings for i in range(3)]
+    assert 'RLE_DICTIONARY' in encodings[0] and 'RLE_DICTIONARY' in encodings[1]
+    assert 'RLE_DICTIONARY' not in encodings[2]
+
+
+def test_dictionary_columns_are_parquet_leaf_columns(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+    schema = pa.schema([('id', pa.string()), ('size', pa.int64()),
+                        ('files', pa.list_(pa.field('element', pa.string()))),
+                        ('lab', pa.struct([('uuid', pa.string()), ('n', pa.int64())]))])
+    dict_columns = iw._dictionary_columns(pa, schema)
+    assert dict_columns == ['id', 'files.list.element', 'lab.uuid']
+    out = str(tmp_path / 'out.parquet')
+    pq.write_table(pa.Table.from_pylist([{'id': 'a', 'size': 1, 'files': ['f'], 'lab': {'uuid': 'l', 'n': 1}}],
+                                        schema=schema), out, use_dictionary=dict_columns)
+    meta = pq.ParquetFile(out).metadata
+    paths = [meta.schema.column(i).path for i in range(meta.num_columns)]
+    assert set(dict_columns) < set(paths)
+    for i, path in enumerate(paths):
+        assert ('RLE_DICTIONARY' in meta.row_group(0).column(i).encodings) == (path in dict_columns)
+
+
+def test_parquet_writer_widens_later_row_groups(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    out = str(tmp_path / 'out.parquet')
+    writer = iw.ParquetWriter(['size', 'mixed', 'empty'], out, row_group_size=2)
+    for row in [{'size': 1, 'mixed': 1}, {'size': 2, 'mixed': 2}, {'size': 2.5, 'mixed': 'x'}, {'mixed': [1]}]:
+        writer.write(row)
+    writer.close()
+    table = pq.read_table(out)
+    assert table.column('size').to_pylist() == [1.0, 2.0, 2.5, None]
+    assert table.column('mixed').to_pylist() == ['1', '2', 'x', '[1]']
+    assert table.column('empty').to_pylist() == [None] * 4
+    assert pq.ParquetFile(out).metadata.num_row_groups == 2
+
+
+def test_parquet_writer_no_rows(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    out = str(tmp_path / 'out.parquet')
+    iw.ParquetWriter(['id'], out).close()
+    assert pq.read_table(out).num_rows == 0
+
+
+def test_dump_results_to_json_csv(tmp_path):
+    from functions.notebook_functions import dump_results_to_json
+    store = {'file_fastq': [{'uuid': 'u1', 'status': 'released'}, {'uuid': 'u2', 'file_size': 5}]}
+    dump_results_to_json(store, str(tmp_path), fmt='csv')
+    assert (tmp_path / 'file_fastq.csv').read_text().splitlines() == [
+        'uuid,status,file_size', 'u1,released,', 'u2,,5']
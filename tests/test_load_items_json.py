@@ -0,0 +1,83 @@
+from scripts import load_items_json as lij
+
+
+def test_build_existing_index(mocker, auth):
+    items = [
+        {'uuid': 'u1', 'term_id': 'EFO:1'},
+        {'uuid': 'u2', 'term_id': 'EFO:2'},
+        {'term_id': 'EFO:3', 'aliases': ['dcic:t3']},
+        {'term_id': 'EFO:4', 'aliases': ['dcic:t4', 'dcic:t4b']},
+        {'term_id': 'EFO 5'},
+    ]
+    es = mocker.patch('functions.script_utils.get_es_metadata', return_value=[{'uuid': 'u1'}])
+    gm = mocker.patch('functions.script_utils.get_metadata', side_effect=Exception('404 not found'))
+    sm = mocker.patch('scripts.load_items_json.search_metadata', side_effect=[
+        [{'uuid': 'u4', 'aliases': ['dcic:t4b', 'other:t4']}],
+        [{'uuid': 'u3', 'term_id': 'EFO:3'}],
+    ])
+    index = lij.build_existing_index(auth, 'ontology_term', items, ['uuid', 'aliases', 'term_id'])
+    assert es.call_args[0][0] == ['u1', 'u2']
+    # u2 is not in ES so is looked for in the database
+    assert gm.call_args == mocker.call('u2', auth, add_on='frame=object&datastore=database')
+    # one search per field with all the values for items without uuids
+    assert sm.call_count == 2
+    # aliases are unique across types so are looked for in all of them
+    alias_query = sm.call_args_list[0][0][0]
+    assert alias_query.startswith('search/?type=Item&status=*&aliases=dcic%3At3&aliases=dcic%3At4')
+    term_query = sm.call_args_list[1][0][0]
+    assert term_query.startswith('search/?type=OntologyTerm&status=*&')
+    assert 'term_id=EFO%205' in term_query
+    assert 'EFO%3A1' not in term_query
+    assert index[('uuid', 'u1')] == 'u1'
+    assert ('uuid', 'u2') not in index
+
+    assert lij.find_existing(items[0], ['aliases', 'term_id'], index) == 'u1'
+    assert lij.find_existing(items[1], ['aliases', 'term_id'], index) is None
+    assert lij.find_existing(items[2], ['aliases', 'term_id'], index) == 'u3'
+    assert lij.find_existing(items[3], ['aliases', 'term_id'], index) == 'u4'
+    assert lij.find_existing(items[4], ['aliases', 'term_id'], index) is None
+
+
+def test_build_existing_index_finds_deleted_items(mocker, auth):
+    # searches leave out deleted and replaced items unless asked for any status
+    existing = [{'uuid': 'u1', 'aliases': ['dcic:b1'], 'status': 'deleted'},
+                {'uuid': 'u2', 'aliases': ['dcic:b2'], 'status': 'replaced'},
+                {'uuid': 'u3', 'aliases': ['dcic:b3'], 'status': 'released'}]
+
+    def search(query, auth):
+        any_status = '&status=*&' in query
+        return [i for i in existing if any_status or i['status'] not in ('deleted', 'replaced')]
+
+    mocker.patch('functions.script_utils.get_es_metadata', return_value=[])
+    mocker.patch('scripts.load_items_json.search_metadata', side_effect=search)
+    items = [{'aliases': ['dcic:b%d' % i]} for i in range(1, 5)]
+    index = lij.build_existing_index(auth, 'biosample', items, ['aliases'])
+    assert [lij.find_existing(i, ['aliases'], index) for i in items] == ['u1', 'u2', 'u3', None]
+
+
+def test_build_existing_index_chunks_values(mocker, auth):
+    items = [{'aliases': ['dcic:%d' % i]} for i in range(5)]
+    mocker.patch('functions.script_utils.get_es_metadata', return_value=[])
+    sm = mocker.patch('scripts.load_items_json.search_metadata', return_value=[])
+    lij.build_existing_index(auth, 'biosample', items, ['aliases'], chunk_size=2)
+    assert sm.call_count == 3
+
+
+def test_build_existing_index_finds_unindexed_uuids(mocker, auth):
+    items = [{'uuid': 'u1'}, {'uuid': 'u2'}, {'uuid': 'u3'}]
+    mocker.patch('functions.script_utils.get_es_metadata', return_value=[{'uuid': 'u1'}])
+
+    def get(iid, auth, add_on=''):
+        if iid == 'u2':
+            return {'uuid': 'u2'}
+        raise Exception('404 not found')
+    mocker.patch('functions.script_utils.get_metadata', side_effect=get)
+    index = lij.build_existing_index(auth, 'biosample', items, ['uuid'])
+    assert [lij.find_existing(i, ['uuid'], index) for i in items] == ['u1', 'u2', None]
+
+
+def test_build_existing_index_default_chunk_keeps_urls_short(mocker, auth):
+    items = [{'aliases': ['dcic:%d' % i]} for i in range(100)]
+    sm = mocker.patch('scripts.load_items_json.search_metadata', return_value=[])
+    lij.build_existing_index(auth, 'biosample', items, ['aliases'])
+    assert sm.call_count == 3
@@ -0,0 +1,84 @@
+import os
+import json
+from functions import load_order as lo
+
+
+PROFILES = {
+    'User': {'properties': {'lab': {'linkTo': 'Lab'}}},
+    'Lab': {'properties': {'pi': {'linkTo': 'User'}, 'awards': {'items': {'linkTo': 'Award'}}}},
+    'Award': {'properties': {'pi': {'linkTo': 'User'}}},
+    'Document': {'properties': {'lab': {'linkTo': 'Lab'}}},
+    'Biosample': {'properties': {'protocols': {'items': {'linkTo': ['Protocol', 'Document']}}}},
+    'Protocol': {'properties': {'attachment': {'type': 'object'}, 'lab': {'linkTo': 'Lab'}}},
+    'FileFastq': {'properties': {'related_files': {'items': {'properties': {'file': {'linkTo': 'File'}}}}},
+                  'rdfs:subClassOf': '/profiles/File.json'},
+    'FileProcessed': {'properties': {'source_experiments': {'items': {'linkTo': 'Experiment'}}},
+                      'rdfs:subClassOf': '/profiles/File.json'},
+    'ExperimentHiC': {'properties': {'files': {'items': {'linkTo': 'FileFastq'}},
+                                     'biosample': {'linkTo': 'Biosample'}}},
+    'ExperimentSet': {'properties': {'experiments_in_set': {'items': {'linkTo': 'Experiment'}}}},
+}
+
+
+def test_snake_case():
+    assert lo.snake_case('ExperimentHiC') == 'experiment_hi_c'
+    assert lo.snake_case('MicroscopeSettingD1') == 'microscope_setting_d1'
+    assert lo.snake_case('QualityMetricDedupqcRepliseq') == 'quality_metric_dedupqc_repliseq'
+
+
+def test_type_name():
+    assert lo.type_name('ontology_term') == 'OntologyTerm'
+    assert lo.type_name('experiment_hi_c') == 'ExperimentHiC'
+    assert lo.type_name('lab') == 'Lab'
+
+
+def test_dependencies_from_profiles():
+    deps = lo.dependencies_from_profiles(PROFILES)
+    assert deps['biosample'] == {'protocol', 'document'}
+    # abstract types from rdfs:subClassOf
+    assert deps['file_fastq'] == {'file_processed'}
+    # or by prefix when there are no sub class links
+    assert deps['experiment_set'] == {'experiment_hi_c'}
+    assert deps['lab'] == {'user', 'award'}
+
+
+def test_build_levels_breaks_cycles_with_order():
+    levels = lo.build_levels(lo.dependencies_from_profiles(PROFILES))
+    order = [t for level in levels for t in level]
+    assert sorted(order) == sorted(lo.snake_case(p) for p in PROFILES)
+    # user <-> lab cycle - user is first in ORDER
+    assert levels[0] == ['user']
+    assert order.index('lab') < order.index('document') < order.index('biosample')
+    assert order.index('biosample') < order.index('experiment_hi_c') < order.index('experiment_set')
+    assert ['document', 'protocol'] in levels
+
+
+def test_group_and_sort_types():
+    levels = [['user'], ['award', 'lab'], ['document', 'protocol']]
+    itypes = ['protocol', 'new_type', 'lab', 'user', 'another', 'award']
+    assert lo.group_types(itypes, levels) == [['user'], ['award', 'lab'], ['protocol'], ['another', 'new_type']]
+    assert lo.sort_types(itypes, levels) == ['user', 'award', 'lab', 'protocol', 'another', 'new_type']
+
+
+def test_get_load_levels_no_auth():
+    assert lo.get_load_levels()[:2] == [['user'], ['award']]
+
+
+def test_get_load_levels_caches_per_server(mocker, auth, tmp_path):
+    gm = mocker.patch('functions.load_order.get_metadata', return_value=PROFILES)
+    levels = lo.get_load_levels(auth, cache_dir=str(tmp_path))
+    assert levels[0] == ['user']
+    cache_file = tmp_path / 'data.4dnucleome.org.json'
+    assert json.loads(cache_file.read_text())['levels'] == levels
+    assert lo.get_load_levels(auth, cache_dir=str(tmp_path)) == levels
+    assert gm.call_count == 1
+    lo.get_load_levels(auth, cache_dir=str(tmp_path), refresh=True)
+    assert gm.call_count == 2
+    os.utime(str(cache_file), (0, 0))
+    lo.get_load_levels(auth, cache_dir=str(tmp_path))
+    assert gm.call_count == 3
+
+
+def test_get_load_levels_falls_back_to_order(mocker, auth, tmp_path):
+    mocker.patch('functions.load_order.get_metadata', side_effect=Exception('no access'))
+    assert lo.get_load_order(auth, cache_dir=str(tmp_path)) == lo.ORDER
@@ -0,0 +1,173 @@
+import time
+import pytest
+from functions import metadata_cache as mc
+from functions import portal_client as pc
+
+
+def _item(uuid, itype='ExperimentHiC', modified='2020-01-01', **kw):
+    item = {'uuid': uuid, '@type': [itype, 'Item'], 'last_modified': {'date_modified': modified}}
+    item.update(kw)
+    return item
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = mc.MetadataCache(str(tmp_path / 'cache.sqlite'), cache_embedded=True)
+    yield cache
+    cache.close()
+    pc.set_metadata_cache(None)
+
+
+@pytest.fixture
+def portal(mocker):
+    items = {}
+
+    def get_metadata(self, obj_id, add_on=''):
+        return dict(items[obj_id])
+
+    def search(query, auth):
+        uuids = [p[5:] for p in query.split('&') if p.startswith('uuid=')]
+        return [{'uuid': u, 'last_modified': items[u]['last_modified']} for u in uuids if u in items]
+
+    get = mocker.patch('functions.portal_client.PortalSession.get_metadata', autospec=True, side_effect=get_metadata)
+    sm = mocker.patch('functions.portal_client.search_metadata', side_effect=search)
+    return items, get, sm
+
+
+def _expire(cache):
+    with cache._conn:
+        cache._conn.execute('UPDATE metadata SET fetched_at=0')
+
+
+def test_cache_hit_within_ttl(cache, portal, auth):
+    items, get, sm = portal
+    items['u1'] = _item('u1')
+    assert cache.get(auth, 'u1') == items['u1']
+    assert cache.get(auth, '/u1/') == items['u1']
+    assert get.call_count == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    # keyed by frame
+    cache.get(auth, 'u1', add_on='frame=raw')
+    assert get.call_count == 2
+    assert sm.call_count == 0
+
+
+def test_cache_persists(tmp_path, portal, auth):
+    items, get, sm = portal
+    items['u1'] = _item('u1')
+    path = str(tmp_path / 'cache.sqlite')
+    mc.MetadataCache(path).get(auth, 'u1', add_on='frame=object')
+    assert mc.MetadataCache(path).get(auth, 'u1', add_on='frame=object') == items['u1']
+    assert get.call_count == 1
+
+
+def test_stale_entry_revalidated(cache, portal, auth):
+    items, get, sm = portal
+    items['u1'] = _item('u1')
+    items['u2'] = _item('u2')
+    cache.get(auth, 'u1')
+    cache.get(auth, 'u2')
+    _expire(cache)
+    items['u2'] = _item('u2', modified='2021-01-01', status='released')
+    assert cache.revalidate(auth) == 1
+    assert sm.call_count == 1
+    assert cache.get(auth, 'u1') == items['u1']
+    assert cache.get(auth, 'u2')['status'] == 'released'
+    assert get.call_count == 3
+    # one item revalidated on its own when it goes stale
+    _expire(cache)
+    assert cache.get(auth, 'u1') == items['u1']
+    assert sm.call_count == 2
+    assert get.call_count == 3
+
+
+def test_type_ttls(cache):
+    assert cache.ttl('Lab') == mc.DAY
+    assert cache.ttl('FileFastq') == mc.DEFAULT_TTL
+    other = mc.MetadataCache(cache.path, ttls={'FileFastq': 5}, default_ttl=1)
+    assert other.ttl('FileFastq') == 5
+    assert other.ttl('Biosample') == 1
+
+
+def test_lru_eviction(tmp_path, portal, auth):
+    items, get, sm = portal
+    for i in range(10):
+        items['u%d' % i] = _item('u%d' % i, text='x' * 1000)
+    cache = mc.MetadataCache(str(tmp_path / 'cache.sqlite'), max_bytes=5000, cache_embedded=True)
+    for i in range(4):
+        cache.get(auth, 'u%d' % i)
+        time.sleep(0.01)
+    cache.get(auth, 'u0')  # u0 is now the most recently used
+    cache.get(auth, 'u4')
+    assert cache._size <= 5000
+    cached = set(r[0] for r in cache._conn.execute('SELECT obj_id FROM metadata'))
+    assert 'u0' in cached and 'u4' in cached
+    assert 'u1' not in cached
+
+
+def test_invalidate(cache, portal, auth):
+    items, get, sm = portal
+    items['u1'] = _item('u1')
+    items['4DNESAAAAAAA'] = items['u1']
+    cache.get(auth, 'u1')
+    cache.invalidate(auth, 'u1')
+    cache.get(auth, 'u1')
+    assert get.call_count == 2
+    # by another id of the item
+    cache.get(auth, '/4DNESAAAAAAA/')
+    cache.invalidate(auth, ['4DNESAAAAAAA'])
+    cache.get(auth, '4DNESAAAAAAA')
+    assert get.call_count == 4
+
+
+def test_enable_cache_routes_portal_client(tmp_path, portal, auth):
+    items, get, sm = portal
+    items['u1'] = _item('u1')
+    cache = mc.enable_cache(str(tmp_path / 'cache.sqlite'))
+    pc.get_metadata('u1', auth, add_on='frame=object')
+    pc.get_metadata('u1', auth, add_on='frame=object')
+    assert get.call_count == 1
+    assert cache.hits == 1
+    mc.disable_cache()
+    pc.get_metadata('u1', auth, add_on='frame=object')
+    assert get.call_count == 2
+
+
+def test_embedded_frame_not_cached_by_default(tmp_path, portal, auth):
+    items, get, sm = portal
+    items['u1'] = _item('u1')
+    cache = mc.MetadataCache(str(tmp_path / 'cache.sqlite'))
+    cache.get(auth, 'u1')
+    cache.get(auth, 'u1', add_on='frame=embedded')
+    cache.get(auth, 'u1', add_on='frame=raw')
+    cache.get(auth, 'u1', add_on='frame=raw')
+    assert get.call_count == 3
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_patch_post_and_delete_field_invalidate(mocker, tmp_path, portal, auth):
+    items, get, sm = portal
+    items['u1'] = _item('u1', accession='4DNESAAAAAAA')
+    items['4DNESAAAAAAA'] = items['u1']
+    mocker.patch('functions.portal_client.PortalSession.patch_metadata',
+                 return_value={'status': 'success', '@graph': [{'uuid': 'u1'}]})
+    mocker.patch('functions.portal_client.PortalSession.post_metadata',
+                 return_value={'status': 'success', '@graph': [{'uuid': 'u1'}]})
+    mocker.patch('functions.portal_client.PortalSession.delete_field', side_effect=Exception('403'))
+    cache = mc.enable_cache(str(tmp_path / 'cache.sqlite'))
+    try:
+        pc.get_metadata('u1', auth, add_on='frame=object')
+        # patched by accession - the uuid in the response is used
+        pc.patch_metadata({'status': 'released'}, '4DNESAAAAAAA', auth)
+        pc.get_metadata('u1', auth, add_on='frame=object')
+        assert get.call_count == 2
+        pc.post_metadata({'uuid': 'u1'}, 'experiment_hi_c', auth)
+        pc.get_metadata('u1', auth, add_on='frame=object')
+        assert get.call_count == 3
+        with pytest.raises(Exception):
+            pc.delete_field('u1', 'description', auth)
+        pc.get_metadata('u1', auth, add_on='frame=object')
+        assert get.call_count == 4
+        assert cache.hits == 0
+    finally:
+        mc.disable_cache()
@@ -0,0 +1,85 @@
+import threading
+import time
+import pytest
+from functions import patch_executor as pe
+
+
+def test_execute_patches_summary():
+    def do_patch(iid, payload):
+        if iid == 'bad':
+            return {'status': 'error', 'description': 'access denied'}
+        if iid == 'boom':
+            raise Exception('connection reset')
+        return {'status': 'success'}
+    jobs = [(i, {'status': 'deleted'}) for i in ['a', 'bad', 'b', 'boom']]
+    summary = pe.execute_patches(jobs, do_patch, workers=3)
+    assert sorted(summary.succeeded) == ['a', 'b']
+    assert list(summary.failed) == ['bad', 'boom']
+    assert summary.failed['bad'] == 'RESPONSE STATUS error access denied'
+    assert summary.failed['boom'] == 'connection reset'
+
+
+def test_execute_patches_on_result_in_submission_order_w_one_worker():
+    seen = []
+    jobs = [(str(i), {}) for i in range(10)]
+    pe.execute_patches(jobs, lambda i, p: {'status': 'success'},
+                       on_result=lambda iid, payload, res: seen.append(iid))
+    assert seen == [str(i) for i in range(10)]
+
+
+def test_execute_patches_bounded_in_flight():
+    lock = threading.Lock()
+    counts = {'now': 0, 'max': 0}
+
+    def do_patch(iid, payload):
+        with lock:
+            counts['now'] += 1
+            counts['max'] = max(counts['max'], counts['now'])
+        time.sleep(0.01)
+        with lock:
+            counts['now'] -= 1
+        return {'status': 'success'}
+
+    def jobs():
+        for i in range(30):
+            yield str(i), {}
+    summary = pe.execute_patches(jobs(), do_patch, workers=4)
+    assert len(summary.succeeded) == 30
+    assert counts['max'] <= 4
+
+
+def test_rate_limiter_spaces_calls():
+    limiter = pe.RateLimiter(rate=50)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.wait()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_get_rate_limiter_one_per_server():
+    lim = pe.get_rate_limiter('https://test.server/', 10)
+    assert pe.get_rate_limiter('https://test.server', 10) is lim
+    assert lim.interval == 0.1
+    assert pe.get_rate_limiter('https://other.server', 5) is not lim
+    # no rate given means no limit rather than the rate of an earlier caller
+    assert pe.get_rate_limiter('https://test.server') is lim
+    assert lim.interval == 0
+
+
+def test_rate_limit_needs_a_server():
+    with pytest.raises(ValueError):
+        pe.get_rate_limiter(None, 10)
+    with pytest.raises(ValueError):
+        pe.execute_patches([('a', {})], lambda i, p: {'status': 'success'}, rate=10)
+    # without a rate no server is needed
+    assert pe.execute_patches([('a', {})], lambda i, p: {'status': 'success'}).succeeded == ['a']
+
+
+def test_write_failed(tmp_path):
+    summary = pe.PatchSummary()
+    summary.add_failure('id1', 'oops')
+    summary.add_success('id2')
+    summary.add_failure('id3', 'oops')
+    outfile = tmp_path / 'failed.txt'
+    summary.write_failed(str(outfile))
+    assert outfile.read_text() == 'id1\nid3\n'
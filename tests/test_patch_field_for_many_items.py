@@ -11,7 +11,12 @@ def test_pffmi_get_args_required_default():
         'isarray': False,
         'field': 'status',
         'value': 'deleted',
-        'numtype': None
+        'numtype': None,
+        'workers': 1,
+        'rate': None,
+        'failed_ids': None,
+        'journal': None,
+        'resume': False
     }
     args = pf.get_args(['i', 'status', 'deleted'])
     for k, v in defaults.items():
@@ -52,13 +57,17 @@ def mocked_args_dbupd_is_false():
             'input': ['id1', 'id2'],
             'field': 'status',
             'value': 'deleted',
-            'numtype': None
+            'numtype': None,
+            'workers': 1,
+            'rate': None,
+            'stream': False,
+            'failed_ids': None
         }
     )
 
 
 @pytest.fixture
-def mocked_args_dbupd_is_true():
+def mocked_args_dbupd_is_true(tmp_path):
     return MockedNamespace(
         {
             'key': None,
@@ -70,7 +79,11 @@ def mocked_args_dbupd_is_true():
             'input': ['id1', 'id2'],
             'field': 'status',
             'value': 'deleted',
-            'numtype': None
+            'numtype': None,
+            'workers': 1,
+            'rate': None,
+            'stream': False,
+            'failed_ids': str(tmp_path / 'failed.txt')
         }
     )
 
@@ -87,7 +100,11 @@ def mocked_args_is_array():
             'input': ['id1', 'id2'],
             'field': 'aliases',
             'value': "'4dn-dcic-lab:test'",
-            'numtype': None
+            'numtype': None,
+            'workers': 1,
+            'rate': None,
+            'stream': False,
+            'failed_ids': None
         }
     )
 
@@ -104,7 +121,11 @@ def mocked_args_w_delete():
             'input': ['id1', 'id2'],
             'field': 'aliases',
             'value': '*delete*',
-            'numtype': None
+            'numtype': None,
+            'workers': 1,
+            'rate': None,
+            'stream': False,
+            'failed_ids': None
         }
     )
 
@@ -122,7 +143,7 @@ def test_pffmi_main_dryrun(mocker, capsys, mocked_args_dbupd_is_false, auth):
     iids = ['id1', 'id2']
     mocker.patch('scripts.patch_field_for_many_items.get_args', return_value=mocked_args_dbupd_is_false)
     mocker.patch('scripts.patch_field_for_many_items.get_authentication_with_server', return_value=auth)
-    mocker.patch('scripts.patch_field_for_many_items.scu.get_item_ids_from_args', return_value=iids)
+    mocker.patch('scripts.patch_field_for_many_items.scu.iter_item_ids_from_args', return_value=iids)
     pf.main()
     out = capsys.readouterr()[0]
     for i in iids:
@@ -134,7 +155,7 @@ def test_pffmi_main_val_is_array(mocker, capsys, mocked_args_is_array, auth):
     iids = ['id1', 'id2']
     mocker.patch('scripts.patch_field_for_many_items.get_args', return_value=mocked_args_is_array)
     mocker.patch('scripts.patch_field_for_many_items.get_authentication_with_server', return_value=auth)
-    mocker.patch('scripts.patch_field_for_many_items.scu.get_item_ids_from_args', return_value=iids)
+    mocker.patch('scripts.patch_field_for_many_items.scu.iter_item_ids_from_args', return_value=iids)
     pf.main()
     out = capsys.readouterr()[0]
     for i in iids:
@@ -148,7 +169,7 @@ def test_pffmi_main_dbupdate(mocker, capsys, mocked_args_dbupd_is_true, auth):
     resp2 = {'status': 'error', 'description': "access denied"}
     mocker.patch('scripts.patch_field_for_many_items.get_args', return_value=mocked_args_dbupd_is_true)
     mocker.patch('scripts.patch_field_for_many_items.get_authentication_with_server', return_value=auth)
-    mocker.patch('scripts.patch_field_for_many_items.scu.get_item_ids_from_args', return_value=iids)
+    mocker.patch('scripts.patch_field_for_many_items.scu.iter_item_ids_from_args', return_value=iids)
     mocker.patch('scripts.patch_field_for_many_items.patch_metadata', side_effect=[resp1, resp2])
     pf.main()
     out = capsys.readouterr()[0]
@@ -164,7 +185,7 @@ def test_pffmi_main_dbupdate_delete(mocker, capsys, mocked_args_w_delete, auth):
     resp1 = {'status': 'success'}
     mocker.patch('scripts.patch_field_for_many_items.get_args', return_value=mocked_args_w_delete)
     mocker.patch('scripts.patch_field_for_many_items.get_authentication_with_server', return_value=auth)
-    mocker.patch('scripts.patch_field_for_many_items.scu.get_item_ids_from_args', return_value=iids)
+    mocker.patch('scripts.patch_field_for_many_items.scu.iter_item_ids_from_args', return_value=iids)
     mocker.patch('scripts.patch_field_for_many_items.delete_field', side_effect=[resp1, resp1])
     pf.main()
     out = capsys.readouterr()[0]
@@ -172,3 +193,102 @@ def test_pffmi_main_dbupdate_delete(mocker, capsys, mocked_args_w_delete, auth):
         s = "PATCHING %s to aliases = *delete*" % i
         assert s in out
         assert 'SUCCESS' in out
+
+
+def test_pffmi_main_dbupdate_writes_failed_ids(mocker, capsys, mocked_args_dbupd_is_true, auth):
+    iids = ['id1', 'id2']
+    resp2 = {'status': 'error', 'description': "access denied"}
+    mocker.patch('scripts.patch_field_for_many_items.get_args', return_value=mocked_args_dbupd_is_true)
+    mocker.patch('scripts.patch_field_for_many_items.get_authentication_with_server', return_value=auth)
+    mocker.patch('scripts.patch_field_for_many_items.scu.iter_item_ids_from_args', return_value=iids)
+    mocker.patch('scripts.patch_field_for_many_items.patch_metadata',
+                 side_effect=[{'status': 'success'}, resp2])
+    pf.main()
+    out = capsys.readouterr()[0]
+    assert '1 SUCCEEDED\t1 FAILED' in out
+    with open(mocked_args_dbupd_is_true.failed_ids) as ff:
+        assert ff.read() == 'id2\n'
+
+
+def test_pffmi_main_dbupdate_w_workers(mocker, capsys, mocked_args_dbupd_is_true, auth):
+    iids = ['id%d' % i for i in range(20)]
+    mocked_args_dbupd_is_true.workers = 4
+    mocker.patch('scripts.patch_field_for_many_items.get_args', return_value=mocked_args_dbupd_is_true)
+    mocker.patch('scripts.patch_field_for_many_items.get_authentication_with_server', return_value=auth)
+    mocker.patch('scripts.patch_field_for_many_items.scu.iter_item_ids_from_args', return_value=iids)
+    pm = mocker.patch('scripts.patch_field_for_many_items.patch_metadata', return_value={'status': 'success'})
+    pf.main()
+    out = capsys.readouterr()[0]
+    assert pm.call_count == 20
+    assert '20 SUCCEEDED\t0 FAILED' in out
+
+
+def test_pffmi_main_dbupdate_resume_from_journal(mocker, capsys, mocked_args_dbupd_is_true, auth, tmp_path):
+    iids = ['id1', 'id2', 'id3']
+    mocked_args_dbupd_is_true.journal = str(tmp_path / 'journal.jsonl')
+    mocked_args_dbupd_is_true.resume = True
+    mocker.patch('scripts.patch_field_for_many_items.get_args', return_value=mocked_args_dbupd_is_true)
+    mocker.patch('scripts.patch_field_for_many_items.get_authentication_with_server', return_value=auth)
+    mocker.patch('scripts.patch_field_for_many_items.scu.iter_item_ids_from_args', return_value=iids)
+    mocker.patch('scripts.patch_field_for_many_items.patch_metadata',
+                 side_effect=[{'status': 'success'}, Exception('timeout'), {'status': 'success'}])
+    pf.main()
+    # the re-run only patches the item that failed
+    capsys.readouterr()
+    pm = mocker.patch('scripts.patch_field_for_many_items.patch_metadata', return_value={'status': 'success'})
+    pf.main()
+    out = capsys.readouterr()[0]
+    assert pm.call_count == 1
+    assert pm.call_args[0][1] == 'id2'
+    assert '2 SKIPPED' in out
+    assert [line.split()[:2] for line in out.splitlines() if line.startswith(('PATCHING', 'SKIPPING'))] == [
+        ['SKIPPING', 'id1'], ['PATCHING', 'id2'], ['SKIPPING', 'id3']]
+
+
+def test_pffmi_main_search_patching_away_its_filter(mocker, capsys, auth):
+    # the search pages by offset like search_metadata does and sees the patches as they happen
+    store = {'id%d' % i: 'uploaded' for i in range(7)}
+
+    def search(query, key, is_generator=False):
+        offset = 0
+        while True:
+            page = [u for u, status in store.items() if status == 'uploaded'][offset:offset + 2]
+            if not page:
+                return
+            for uid in page:
+                yield {'uuid': uid}
+            offset += 2
+
+    def patch(patch, iid, key):
+        store[iid] = patch['status']
+        return {'status': 'success'}
+
+    args = pf.get_args(['type=FileFastq&status=uploaded', 'status', 'deleted', '--search', '--dbupdate',
+                        '--key', str(auth)])
+    mocker.patch('scripts.patch_field_for_many_items.get_args', return_value=args)
+    mocker.patch('scripts.patch_field_for_many_items.get_authentication_with_server', return_value=auth)
+    mocker.patch('functions.script_utils.search_metadata', side_effect=search)
+    mocker.patch('scripts.patch_field_for_many_items.patch_metadata', side_effect=patch)
+    pf.main()
+    assert set(store.values()) == {'deleted'}
+    assert '7 SUCCEEDED' in capsys.readouterr().out
+
+
+def test_pffmi_main_stream_patches_while_reading_search(mocker, capsys, auth):
+    events = []
+
+    def search(query, key, is_generator=False):
+        for i in range(4):
+            events.append(('read', 'id%d' % i))
+            yield {'uuid': 'id%d' % i}
+
+    args = pf.get_args(['type=FileFastq', 'status', 'released', '--search', '--stream', '--dbupdate',
+                        '--key', str(auth)])
+    mocker.patch('scripts.patch_field_for_many_items.get_args', return_value=args)
+    mocker.patch('scripts.patch_field_for_many_items.get_authentication_with_server', return_value=auth)
+    mocker.patch('functions.script_utils.search_metadata', side_effect=search)
+    mocker.patch('scripts.patch_field_for_many_items.patch_metadata',
+                 side_effect=lambda patch, iid, key: events.append(('patch', iid)) or {'status': 'success'})
+    pf.main()
+    assert events.index(('patch', 'id0')) < events.index(('read', 'id3'))
+    assert '4 SUCCEEDED' in capsys.readouterr().out
@@ -0,0 +1,91 @@
+import json
+import pytest
+from functions import patch_journal as pj
+from functions.patch_executor import execute_patches
+
+
+class MockedNamespace(object):
+    def __init__(self, dic):
+        for k, v in dic.items():
+            setattr(self, k, v)
+
+
+def test_payload_hash_ignores_key_order():
+    assert pj.payload_hash({'a': 1, 'b': [1, 2]}) == pj.payload_hash({'b': [1, 2], 'a': 1})
+    assert pj.payload_hash({'a': 1}) != pj.payload_hash({'a': 2})
+
+
+def test_journal_records_and_resumes(tmp_path):
+    jfile = str(tmp_path / 'journal.jsonl')
+    journal = pj.PatchJournal(jfile)
+    journal.record('id1', {'status': 'released'}, {'status': 'success'})
+    journal.record('id2', {'status': 'released'}, {'status': 'error', 'description': 'denied'})
+    journal.record('id3', {'status': 'released'}, Exception('timeout'))
+    with open(jfile) as jf:
+        entries = [json.loads(line) for line in jf]
+    assert [e['status'] for e in entries] == ['success', 'error', 'error']
+    assert entries[1]['message'] == 'denied'
+    assert entries[2]['message'] == 'timeout'
+
+    resumed = pj.PatchJournal(jfile, resume=True)
+    assert resumed.is_done('id1', {'status': 'released'})
+    # a different payload for the same item is not done
+    assert not resumed.is_done('id1', {'status': 'deleted'})
+    assert not resumed.is_done('id2', {'status': 'released'})
+    # without resume nothing is skipped
+    assert not pj.PatchJournal(jfile).is_done('id1', {'status': 'released'})
+
+
+def test_journal_skips_partial_line(tmp_path):
+    jfile = tmp_path / 'journal.jsonl'
+    good = json.dumps({'id': 'id1', 'hash': pj.payload_hash({}), 'status': 'success'})
+    jfile.write_text(good + '\n{"id": "id2", "ha')
+    journal = pj.PatchJournal(str(jfile), resume=True)
+    assert journal.is_done('id1', {})
+
+
+def test_journal_entry_after_partial_line_is_kept(tmp_path):
+    jfile = tmp_path / 'journal.jsonl'
+    jfile.write_text('{"id": "id0", "ha')
+    pj.PatchJournal(str(jfile)).record('id1', {}, {'status': 'success'})
+    resumed = pj.PatchJournal(str(jfile), resume=True)
+    assert resumed.is_done('id1', {})
+    assert not resumed.is_done('id0', {})
+
+
+def test_execute_patches_w_journal(tmp_path):
+    jfile = str(tmp_path / 'journal.jsonl')
+    jobs = [('id1', {}), ('id2', {})]
+    execute_patches(jobs, lambda i, p: {'status': 'success' if i == 'id1' else 'error'},
+                    journal=pj.PatchJournal(jfile))
+    done = []
+    summary = execute_patches(jobs, lambda i, p: done.append(i) or {'status': 'success'},
+                              journal=pj.PatchJournal(jfile, resume=True))
+    assert done == ['id2']
+    assert summary.skipped == ['id1']
+
+
+def test_execute_patches_repeats_in_run_duplicates(tmp_path):
+    jfile = str(tmp_path / 'journal.jsonl')
+    done = []
+    summary = execute_patches([('id1', {}), ('id1', {})], lambda i, p: done.append(i) or {'status': 'success'},
+                              journal=pj.PatchJournal(jfile, resume=True))
+    assert done == ['id1', 'id1']
+    assert summary.skipped == []
+    # entries recorded after a resumed run started are not skipped either
+    resumed = pj.PatchJournal(jfile, resume=True)
+    assert resumed.is_done('id1', {})
+    resumed.record('id2', {}, {'status': 'success'})
+    assert not resumed.is_done('id2', {})
+
+
+def test_get_journal(tmp_path):
+    assert pj.get_journal(MockedNamespace({'journal': None, 'resume': False})) is None
+    journal = pj.get_journal(MockedNamespace({'journal': str(tmp_path / 'j'), 'resume': True}))
+    assert journal.resume
+
+
+def test_get_journal_resume_wo_journal(capsys):
+    with pytest.raises(SystemExit):
+        pj.get_journal(MockedNamespace({'journal': None, 'resume': True}))
+    assert '--resume needs' in capsys.readouterr()[0]
@@ -0,0 +1,96 @@
+import pytest
+from functions import portal_client as pc
+
+
+class MockedResponse(object):
+    def __init__(self, json_body, status_code=200):
+        self.body = json_body
+        self.status_code = status_code
+        self.url = 'url'
+        self.text = str(json_body)
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    pc._sessions.clear()
+    pc._es_connections.clear()
+    pc._env_auths.clear()
+    pc._s3_utils.clear()
+
+
+def test_get_session_one_per_server(auth):
+    s1 = pc.get_session(auth)
+    s2 = pc.get_session(dict(auth))
+    other = dict(auth, server='https://staging.4dnucleome.org')
+    assert s1 is s2
+    assert pc.get_session(other) is not s1
+
+
+def test_portal_session_url(auth):
+    session = pc.get_session(auth)
+    assert session.url('/labs/test-lab/', 'frame=raw') == 'https://data.4dnucleome.org/labs/test-lab/?frame=raw'
+
+
+def test_get_metadata_uses_pooled_session(mocker, auth):
+    req = mocker.patch('requests.Session.request', return_value=MockedResponse({'uuid': 'test_uuid'}))
+    res = pc.get_metadata('test_id', auth, add_on='frame=object')
+    assert res == {'uuid': 'test_uuid'}
+    args, kwargs = req.call_args
+    assert args == ('GET', 'https://data.4dnucleome.org/test_id?frame=object')
+    assert kwargs['auth'] == ('testkey', 'testsecret')
+
+
+def test_get_metadata_error_status_not_retried(mocker, auth):
+    req = mocker.patch('requests.Session.request',
+                       return_value=MockedResponse({'status': 'error'}, status_code=404))
+    with pytest.raises(Exception):
+        pc.get_metadata('test_id', auth)
+    assert req.call_count == 1
+
+
+def test_get_s3_utils_cached_per_env(mocker):
+    s3 = mocker.patch('functions.portal_client.s3Utils', side_effect=lambda env: object())
+    first = pc.get_s3_utils('data')
+    assert pc.get_s3_utils('data') is first
+    assert pc.get_s3_utils('staging') is not first
+    assert s3.call_count == 2
+
+
+def test_get_env_auth_cached_per_env(mocker, auth):
+    ga = mocker.patch('functions.portal_client.ff_utils.get_authentication_with_server', return_value=auth)
+    assert pc.get_env_auth('data') == auth
+    assert pc.get_env_auth('data') == auth
+    assert ga.call_count == 1
+
+
+class MockedEsClient(object):
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def search(self, index=None, body=None, size=10, from_=0):
+        self.queries.append((index, body))
+        ids = body['query']['bool']['must'][0]['terms']['_id']
+        hits = [{'_id': i, '_source': self.docs[i]} for i in ids if i in self.docs]
+        return {'hits': {'total': {'value': len(hits)}, 'hits': hits[from_:from_ + size]}}
+
+
+def test_get_es_metadata_one_client_per_server(mocker, auth):
+    client = MockedEsClient({'u1': {'uuid': 'u1'}, 'u2': {'uuid': 'u2'}, 'u3': {'uuid': 'u3'}})
+    health = mocker.patch('functions.portal_client.ff_utils.get_health_page',
+                          return_value={'elasticsearch': 'https://es.test', 'namespace': 'ns'})
+    create = mocker.patch('functions.portal_client.es_utils.create_es_client', return_value=client)
+    assert pc.get_es_metadata(['u1', 'u2', 'u4'], key=auth, chunk_size=2) == [{'uuid': 'u1'}, {'uuid': 'u2'}]
+    hits = pc.get_es_metadata(['u3'], filters={'status': ['released', '!deleted']}, sources=['uuid'],
+                              key=dict(auth, server=auth['server'].rstrip('/')), is_generator=True)
+    assert list(hits) == [{'uuid': 'u3'}]
+    assert health.call_count == 1
+    assert create.call_args == mocker.call('https://es.test', use_aws_auth=True)
+    index, query = client.queries[-1]
+    assert index == 'ns*'
+    assert query['query']['bool']['must'][1] == {'terms': {'embedded.status.raw': ['released']}}
+    assert query['query']['bool']['must_not'] == [{'terms': {'embedded.status.raw': ['deleted']}}]
+    assert query['_source'] == ['uuid']
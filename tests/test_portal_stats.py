@@ -0,0 +1,94 @@
+import io
+import json
+import pytest
+from functions import portal_stats as ps
+from functions import portal_client as pc
+
+
+class MockedResponse(object):
+    def __init__(self, json_body, status_code=200):
+        self.body = json_body
+        self.status_code = status_code
+        self.url = 'url'
+        self.text = json.dumps(json_body)
+        self.content = self.text.encode('utf-8')
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def recorder(tmp_path):
+    pc._sessions.clear()
+    recorder = ps.enable(trace_file=str(tmp_path / 'trace.jsonl'), report_at_exit=False)
+    yield recorder
+    ps.disable()
+
+
+def test_endpoint_class():
+    assert ps.endpoint_class('/search/?type=Lab') == 'search'
+    assert ps.endpoint_class('4fdb481a-fd98-4bf2-b2e2-9be1fd0b1bd2') == 'item'
+    assert ps.endpoint_class('/4DNFIAAAAAAA/') == 'item'
+    assert ps.endpoint_class('dcic:alias') == 'item'
+    assert ps.endpoint_class('files-fastq/4DNFIAAAAAAA') == 'files-fastq'
+
+
+def test_histogram_percentiles():
+    hist = ps.LatencyHistogram()
+    for ms in range(1, 101):
+        hist.add(ms / 1000.0)
+    assert hist.count == 100
+    assert 47 < hist.percentile(50) < 53
+    assert 94 < hist.percentile(95) < 100
+    assert 98 < hist.percentile(99) < 105
+    assert ps.LatencyHistogram().percentile(50) == 0.0
+
+
+def test_track_off_by_default():
+    ps.disable()
+    with ps.track('get', 'item') as call:
+        assert call is None
+    ps.note_attempt(100)  # no error when nothing is tracked
+
+
+def test_track_records_errors(recorder):
+    with pytest.raises(ValueError):
+        with ps.track('patch', 'item'):
+            raise ValueError()
+    row = recorder.summary_rows()[0]
+    assert (row['call'], row['count'], row['errors']) == ('patch', 1, 1)
+
+
+def test_portal_calls_recorded(mocker, recorder, auth):
+    bodies = [MockedResponse({'status': 'error'}, status_code=500), MockedResponse({'uuid': 'u1'}),
+              MockedResponse({'status': 'success'})]
+    mocker.patch('requests.Session.request', side_effect=bodies)
+    mocker.patch('dcicutils.ff_utils.time.sleep')
+    assert pc.get_metadata('4fdb481a-fd98-4bf2-b2e2-9be1fd0b1bd2', auth) == {'uuid': 'u1'}
+    pc.patch_metadata({'status': 'released'}, 'files-fastq/4DNFIAAAAAAA', auth)
+    rows = {r['call']: r for r in recorder.summary_rows()}
+    assert rows['get']['count'] == 1
+    assert rows['get']['retries'] == 1
+    assert rows['get']['kb'] * 1024 == len(bodies[0].content) + len(bodies[1].content)
+    assert rows['patch']['count'] == 1
+    with open(recorder.trace_file) as tf:
+        trace = [json.loads(line) for line in tf]
+    assert [t['call'] for t in trace] == ['get', 'patch']
+    assert [t['endpoint'] for t in trace] == ['item', 'files-fastq']
+
+
+def test_search_and_es_recorded(mocker, recorder, auth):
+    mocker.patch('dcicutils.ff_utils.search_metadata',
+                 side_effect=lambda *a, **kw: iter([{'uuid': 'u1'}, {'uuid': 'u2'}]))
+    mocker.patch('functions.portal_client._es_hits', return_value=iter([{'uuid': 'u1'}]))
+    assert [h['uuid'] for h in pc.search_metadata('search/?type=Lab', auth, is_generator=True)] == ['u1', 'u2']
+    pc.get_es_metadata(['u1'], key=auth)
+    rows = {r['call']: r for r in recorder.summary_rows()}
+    assert rows['search']['count'] == 1
+    assert rows['search']['top_endpoint'] == 'search'
+    assert rows['es']['count'] == 1
+    out = io.StringIO()
+    recorder.report(out)
+    table = out.getvalue()
+    assert 'p95_ms' in table
+    assert [line.split()[0] for line in table.splitlines()[3:5]] == ['search', 'es']
@@ -0,0 +1,93 @@
+import pytest
+from functions import provenance as pv
+from functions import cleanup as cl
+
+FQ1 = '11111111-1111-4111-8111-111111111111'
+FQ2 = '22222222-2222-4222-8222-222222222222'
+PF1 = '33333333-3333-4333-8333-333333333333'
+PF2 = '44444444-4444-4444-8444-444444444444'
+BAM = '55555555-5555-4555-8555-555555555555'
+RUN1 = 'aaaaaaaa-aaaa-4aaa-8aaa-aaaaaaaaaaaa'
+RUN2 = 'bbbbbbbb-bbbb-4bbb-8bbb-bbbbbbbbbbbb'
+MD5 = 'cccccccc-cccc-4ccc-8ccc-cccccccccccc'
+
+
+def linked(uuid, item_type):
+    return {'uuid': uuid, '@type': [item_type, 'Item']}
+
+
+@pytest.fixture
+def docs():
+    return {
+        FQ1: {'@type': ['FileFastq'], 'quality_metric': linked('qc-fq1', 'QualityMetricFastqc'),
+              'workflow_run_inputs': [linked(RUN1, 'WorkflowRunAwsem'), linked(MD5, 'WorkflowRunAwsem')]},
+        FQ2: {'@type': ['FileFastq'], 'workflow_run_inputs': [linked(RUN1, 'WorkflowRunAwsem')]},
+        BAM: {'@type': ['FileProcessed'], 'workflow_run_outputs': [linked(RUN1, 'WorkflowRunAwsem')],
+              'workflow_run_inputs': [linked(RUN2, 'WorkflowRunAwsem')]},
+        PF1: {'@type': ['FileProcessed'], 'workflow_run_outputs': [linked(RUN2, 'WorkflowRunAwsem')]},
+        PF2: {'@type': ['FileProcessed'], 'workflow_run_outputs': [linked(RUN2, 'WorkflowRunAwsem')]},
+        RUN1: {'@type': ['WorkflowRunAwsem'],
+               'input_files': [{'value': linked(FQ1, 'FileFastq')}, {'value': linked(FQ2, 'FileFastq')}],
+               'output_files': [{'value': linked(BAM, 'FileProcessed')},
+                                {'value_qc': linked('qc-bam', 'QualityMetricBamqc')}],
+               'quality_metric': linked('qc-run1', 'QualityMetricWorkflowrun')},
+        RUN2: {'@type': ['WorkflowRunAwsem'], 'input_files': [{'value': linked(BAM, 'FileProcessed')}],
+               'output_files': [{'value': linked(PF1, 'FileProcessed')}, {'value': linked(PF2, 'FileProcessed')}]},
+        MD5: {'@type': ['WorkflowRunAwsem'], 'input_files': [{'value': linked(FQ1, 'FileFastq')}], 'output_files': []},
+    }
+
+
+@pytest.fixture
+def es(mocker, docs):
+    def get_es_metadata(uuids, sources=None, chunk_size=200, key=None, is_generator=False):
+        return [{'uuid': u, 'embedded': docs[u]} for u in uuids if u in docs]
+
+    return mocker.patch('functions.provenance.pc.get_es_metadata', side_effect=get_es_metadata)
+
+
+def test_walk(auth, es):
+    graph = pv.ProvenanceWalker(auth).walk([FQ1, FQ2])
+    assert graph.uuids() == [FQ1, 'qc-fq1', RUN1, MD5, FQ2, BAM, 'qc-bam', 'qc-run1']
+    assert graph.nodes[BAM] == 'FileProcessed' and graph.nodes['qc-bam'] == 'QualityMetricBamqc'
+    assert graph.of_type('WorkflowRun') == [RUN1, MD5]
+    assert (FQ1, 'quality_metric', 'qc-fq1') in graph.edges
+    assert (RUN1, 'input', FQ2) in graph.edges and (RUN1, 'output', BAM) in graph.edges
+    assert len(graph.edges) == len(set(graph.edges))
+    # a level of files and a level of runs
+    assert es.call_count == 2
+
+
+def test_walk_depth(auth, es):
+    graph = pv.ProvenanceWalker(auth).walk([FQ1], depth=3)
+    assert set(graph.of_type('FileProcessed')) == {BAM, PF1, PF2}
+    assert (RUN2, 'input', BAM) in graph.edges
+    # files and runs for each level - the runs of the last level were already got
+    assert es.call_count == 5
+
+
+def test_walker_memo(auth, es):
+    walker = pv.ProvenanceWalker(auth)
+    walker.walk([FQ1])
+    calls = es.call_count
+    # all the runs of FQ2 were already got with FQ1
+    walker.walk([FQ2])
+    fetched = [u for c in es.call_args_list[calls:] for u in c[0][0]]
+    assert fetched == [FQ2]
+
+
+def test_walker_non_uuid_ids(mocker, auth, es, docs):
+    gm = mocker.patch('functions.provenance.pc.get_metadata', return_value=dict(docs[PF1], uuid=PF1))
+    walker = pv.ProvenanceWalker(auth)
+    assert walker.walk(['4DNFIPF10000']).uuids() == [PF1, RUN2, PF2]
+    walker.walk(['4DNFIPF10000'])
+    assert gm.call_count == 1
+
+
+def test_fetch_pf_associated(auth, es, docs):
+    walker = pv.ProvenanceWalker(auth)
+    assoc = cl.fetch_pf_associated(dict(docs[BAM], uuid=BAM), auth, walker=walker)
+    assert set(assoc) == {BAM, RUN1, 'qc-bam', 'qc-run1', RUN2, PF1, PF2}
+    assert len(assoc) == len(set(assoc))
+    assert [c[0][0] for c in es.call_args_list] == [[RUN2, RUN1]]
+    assert cl.fetch_wfr_associated(RUN1, auth, walker=walker) == [RUN1, BAM, 'qc-bam', 'qc-run1']
+    assert es.call_count == 1
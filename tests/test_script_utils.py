@@ -426,3 +426,263 @@ def test_get_item_if_you_can_w_fakename_and_itype_no_item(mocker, auth):
     mocker.patch('functions.script_utils.get_metadata', side_effect=[None, None])
     result = scu.get_item_if_you_can(auth, 'fake name', 'OntologyTerm')
     assert result is None
+
+
+@pytest.fixture
+def linked_graph():
+    """raw and embedded frames for a small item graph keyed by uuid"""
+    es = '1256801c-9c6e-4563-a97a-a295fccf5f07'
+    exp = '2256801c-9c6e-4563-a97a-a295fccf5f07'
+    fq = '3256801c-9c6e-4563-a97a-a295fccf5f07'
+    bs = '4256801c-9c6e-4563-a97a-a295fccf5f07'
+    lab = '5256801c-9c6e-4563-a97a-a295fccf5f07'
+    user = '6256801c-9c6e-4563-a97a-a295fccf5f07'
+    wfr = '7256801c-9c6e-4563-a97a-a295fccf5f07'
+    return {
+        es: ({'status': 'released', 'experiments_in_set': [exp], 'lab': lab},
+             {'@type': ['ExperimentSetReplicate', 'ExperimentSet', 'Item']}),
+        exp: ({'status': 'released', 'files': [fq], 'biosample': bs, 'lab': lab},
+              {'@type': ['ExperimentHiC', 'Experiment', 'Item']}),
+        fq: ({'status': 'released', 'lab': lab},
+             {'@type': ['FileFastq', 'File', 'Item'], 'workflow_run_inputs': [{'uuid': wfr}]}),
+        bs: ({'status': 'released', 'lab': lab, 'attachment': {'blob': user}},
+             {'@type': ['Biosample', 'Item']}),
+        lab: ({'status': 'current', 'pi': user},
+              {'@type': ['Lab', 'Item']}),
+    }
+
+
+def _fake_get_metadata(graph):
+    def get_metadata(iid, auth, add_on=''):
+        if iid not in graph:
+            return {'status': 'error'}
+        raw, embedded = graph[iid]
+        return raw if add_on == 'frame=raw' else embedded
+    return get_metadata
+
+
+def test_get_linked_items_parallel_same_as_get_linked_items(mocker, auth, linked_graph):
+    mocker.patch('functions.script_utils.get_metadata', side_effect=_fake_get_metadata(linked_graph))
+    start = '1256801c-9c6e-4563-a97a-a295fccf5f07'
+    expected = scu.get_linked_items(auth, start, {}, ['Publication', 'Lab', 'User', 'Award'])
+    result = scu.get_linked_items_parallel(auth, start, max_workers=3)
+    assert result == expected
+    assert result['7256801c-9c6e-4563-a97a-a295fccf5f07'] == 'WorkflowRun'
+    # lab is in no_children so the user is never reached
+    assert '6256801c-9c6e-4563-a97a-a295fccf5f07' not in result
+
+
+def test_get_linked_items_parallel_w_no_children(mocker, auth, linked_graph):
+    mocker.patch('functions.script_utils.get_metadata', side_effect=_fake_get_metadata(linked_graph))
+    result = scu.get_linked_items_parallel(auth, '1256801c-9c6e-4563-a97a-a295fccf5f07',
+                                           no_children=['ExperimentHiC'])
+    assert sorted(result.values()) == ['ExperimentHiC', 'ExperimentSetReplicate', 'Lab']
+
+
+def test_get_linked_items_parallel_w_item_in_found(auth):
+    found_items = {'itemid': 'Biosample'}
+    result = scu.get_linked_items_parallel(auth, 'itemid', found_items)
+    assert result == found_items
+
+
+def test_get_linked_items_parallel_w_error_status(auth, mocker):
+    mocker.patch('functions.script_utils.get_metadata', return_value={'status': 'error'})
+    assert not scu.get_linked_items_parallel(auth, 'test_id')
+
+
+def _fake_get_es_metadata(graph):
+    def get_es_metadata(uuids, sources=None, key=None, is_generator=False):
+        for uid in uuids:
+            if uid in graph:
+                raw, embedded = graph[uid]
+                yield {'uuid': uid, 'properties': raw, 'embedded': embedded}
+    return get_es_metadata
+
+
+def test_get_linked_items_parallel_use_es(mocker, auth, linked_graph):
+    start = '1256801c-9c6e-4563-a97a-a295fccf5f07'
+    mocker.patch('functions.script_utils.get_metadata', side_effect=_fake_get_metadata(linked_graph))
+    expected = scu.get_linked_items_parallel(auth, start)
+    gm = mocker.patch('functions.script_utils.get_metadata', side_effect=_fake_get_metadata(linked_graph))
+    es = mocker.patch('functions.script_utils.get_es_metadata', side_effect=_fake_get_es_metadata(linked_graph))
+    result = scu.get_linked_items_parallel(auth, start, use_es=True)
+    assert result == expected
+    # one bulk request per level and nothing fetched from the portal
+    assert es.call_count == 3
+    assert not gm.called
+
+
+def test_get_linked_items_parallel_use_es_not_indexed(mocker, auth, linked_graph):
+    start = '1256801c-9c6e-4563-a97a-a295fccf5f07'
+    mocker.patch('functions.script_utils.get_metadata', side_effect=_fake_get_metadata(linked_graph))
+    expected = scu.get_linked_items_parallel(auth, start)
+    indexed = {k: v for k, v in linked_graph.items() if k != start}
+    gm = mocker.patch('functions.script_utils.get_metadata', side_effect=_fake_get_metadata(linked_graph))
+    mocker.patch('functions.script_utils.get_es_metadata', side_effect=_fake_get_es_metadata(indexed))
+    result = scu.get_linked_items_parallel(auth, start, use_es=True)
+    assert result == expected
+    # only the unindexed start item is fetched - raw and embedded
+    assert gm.call_count == 2
+
+
+def test_find_uuids_nested_and_in_order():
+    val = {
+        'a': '7256801c-9c6e-4563-a97a-a295fccf5f07',
+        'b': [{'c': ['5256801c-9c6e-4563-a97a-a295fccf5f07', 'not a uuid']}, 3, None],
+        'd': "it's '6256801c-9c6e-4563-a97a-a295fccf5f07' in text",
+    }
+    assert scu.find_uuids(val) == ['7256801c-9c6e-4563-a97a-a295fccf5f07', '5256801c-9c6e-4563-a97a-a295fccf5f07']
+
+
+def test_find_uuids_skips_attachment():
+    val = {'attachment': {'blob_id': '6256801c-9c6e-4563-a97a-a295fccf5f07'},
+           'lab': '7256801c-9c6e-4563-a97a-a295fccf5f07'}
+    assert scu.find_uuids(val) == ['7256801c-9c6e-4563-a97a-a295fccf5f07']
+
+
+def test_find_uuids_no_dashes_or_empty():
+    assert scu.find_uuids('231111bc85354448903e854af460b254aaaa') == []
+    assert scu.find_uuids([]) == []
+    assert scu.find_uuids(None) == []
+
+
+def test_chunk_list():
+    assert list(scu.chunk_list([1, 2, 3, 4, 5], 2)) == [[1, 2], [3, 4], [5]]
+    assert list(scu.chunk_list([1, 2, 3])) == [[1, 2, 3]]
+    assert list(scu.chunk_list([], 2)) == []
+    assert list(scu.chunk_list(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(scu.chunk_list((i for i in 'abc'))) == [['a', 'b', 'c']]
+
+
+def test_ordered_set_keeps_first_seen_order():
+    seen = scu.OrderedSet(['b', 'a'])
+    seen.add('c')
+    seen.append('a')
+    assert 'a' in seen
+    assert 'd' not in seen
+    assert list(seen) == ['b', 'a', 'c']
+    seen.discard('a')
+    seen.discard('x')
+    assert list(seen) == ['b', 'c']
+    assert len(seen) == 2
+
+
+def test_imap_ordered_keeps_order_and_window():
+    import time
+    import threading
+    running = []
+    lock = threading.Lock()
+    most = [0]
+
+    def slow(i):
+        with lock:
+            running.append(i)
+            most[0] = max(most[0], len(running))
+        time.sleep(0.01 * (5 - i % 5))
+        with lock:
+            running.remove(i)
+        return i * 2
+
+    consumed = []
+
+    def items():
+        for i in range(20):
+            consumed.append(i)
+            yield i
+
+    results = []
+    for res in scu.imap_ordered(slow, items(), workers=3, window=4):
+        # never more than the window ahead of what has been yielded
+        assert len(consumed) - len(results) <= 5
+        results.append(res)
+    assert results == [i * 2 for i in range(20)]
+    assert most[0] <= 3
+
+
+def test_imap_ordered_raises_in_order():
+    def fxn(i):
+        if i == 2:
+            raise ValueError(i)
+        return i
+    results = []
+    with pytest.raises(ValueError):
+        for res in scu.imap_ordered(fxn, range(5), workers=2):
+            results.append(res)
+    assert results == [0, 1]
+
+
+def test_iter_item_ids_from_search_is_lazy(mocker, auth):
+    pages_read = []
+
+    def search(query, auth, is_generator=False):
+        for i, uid in enumerate(['u1', 'u2', 'u1', 'u3']):
+            pages_read.append(i)
+            yield {'uuid': uid}
+    sm = mocker.patch('functions.script_utils.search_metadata', side_effect=search)
+    ids = scu.iter_item_ids_from_args(['type=Biosample'], auth, True, stream_search=True)
+    assert next(ids) == 'u1'
+    assert pages_read == [0]
+    assert list(ids) == ['u2', 'u3']
+    assert sm.call_args[0][0] == 'search/?type=Biosample'
+
+
+def test_iter_item_ids_from_search_reads_all_pages_first(mocker, auth):
+    pages_read = []
+
+    def search(query, auth, is_generator=False):
+        for i, uid in enumerate(['u1', 'u2', 'u1', 'u3']):
+            pages_read.append(i)
+            yield {'uuid': uid}
+    mocker.patch('functions.script_utils.search_metadata', side_effect=search)
+    ids = scu.iter_item_ids_from_args(['type=Biosample'], auth, True)
+    assert next(ids) == 'u1'
+    assert pages_read == [0, 1, 2, 3]
+    assert list(ids) == ['u2', 'u3']
+
+
+def test_iter_item_ids_from_file_and_list(tmp_path, auth):
+    idfile = tmp_path / 'ids.txt'
+    idfile.write_text('id1\n\nid2\nid1\n')
+    assert list(scu.iter_item_ids_from_args([str(idfile)], auth)) == ['id1', 'id2']
+    assert list(scu.iter_item_ids_from_args(['a', 'b', 'a'], auth)) == ['a', 'b']
+
+
+def test_item_info_resolver_bulk_and_cached(mocker, auth):
+    u1 = '4fdb481a-fd98-4bf2-b2e2-9be1fd0b1bd2'
+    es = mocker.patch('functions.script_utils.get_es_metadata', return_value=[
+        {'uuid': u1, 'embedded': {'@type': ['Biosample', 'Item']},
+         'properties': {'tags': ['t1'], 'status': 'released'}}])
+    gm = mocker.patch('functions.script_utils.get_metadata', side_effect=[
+        {'uuid': 'u2', '@type': ['Lab', 'Item']}, Exception('not found')])
+    resolver = scu.ItemInfoResolver(auth)
+    infos = resolver.resolve([u1, 'lab:a', 'missing', u1])
+    assert infos[u1] == {'uuid': u1, '@type': ['Biosample', 'Item'], 'tags': ['t1']}
+    assert infos['lab:a'] == {'uuid': 'u2', '@type': ['Lab', 'Item']}
+    assert infos['missing'] is None
+    assert es.call_args[1]['sources'] == ['uuid', 'embedded.@type', 'properties.tags']
+    assert resolver.get_types([u1, 'lab:a', 'missing']) == {u1: 'Biosample', 'lab:a': 'Lab', 'missing': None}
+    assert es.call_count == 1
+    assert gm.call_count == 2
+
+
+def test_bulk_fetch_resolved_ids_and_fallback(mocker, auth, capsys):
+    es = mocker.patch('functions.script_utils.get_es_metadata',
+                      return_value=[{'uuid': 'u1', 'object': {'status': 'released'}}])
+    gm = mocker.patch('functions.script_utils.get_metadata',
+                      side_effect=[{'status': 'deleted'}, Exception('not found')])
+    res = scu.bulk_fetch(auth, ['a', 'b', 'c', 'a'], ['uuid', 'object.status'], lambda hit: hit['object'],
+                         resolved={'a': 'u1', 'b': 'u2'}, add_on='frame=object')
+    assert list(res.items()) == [('a', {'status': 'released'}), ('b', {'status': 'deleted'}), ('c', None)]
+    assert es.call_args[0][0] == ['u1', 'u2']
+    assert gm.call_args_list[0] == mocker.call('b', auth, add_on='frame=object')
+    assert capsys.readouterr().err == ''
+
+
+def test_bulk_fetch_es_failure_gets_items_one_at_a_time(mocker, auth, capsys):
+    u1 = '4fdb481a-fd98-4bf2-b2e2-9be1fd0b1bd2'
+    mocker.patch('functions.script_utils.get_es_metadata', side_effect=Exception('ES timed out'))
+    gm = mocker.patch('functions.script_utils.get_metadata', side_effect=lambda iid, auth, add_on: {'uuid': iid})
+    res = scu.bulk_fetch(auth, [u1, 'lab:a'], ['uuid'], lambda hit: hit)
+    assert res == {u1: {'uuid': u1}, 'lab:a': {'uuid': 'lab:a'}}
+    assert gm.call_count == 2
+    assert 'ES request for 1 items failed' in capsys.readouterr().err
@@ -140,3 +140,47 @@ def test_add_tag2item_not_released(capsys, mocker, auth):
     assert out == "STATUS deleted doesn't get tagged - skipping test_uuid\n"
     assert cnts['skipped'] == 1
     assert 'test_uuid' in seen
+
+
+def test_item_id_from_embedded_or_id():
+    assert trf.item_id({'uuid': 'test_uuid', '@id': '/experiments-hi-c/4DNEXAAAAAAA/'}) == 'test_uuid'
+    assert trf.item_id({'@id': '/experiments-hi-c/4DNEXAAAAAAA/'}) == '/experiments-hi-c/4DNEXAAAAAAA/'
+    assert trf.item_id('test_uuid') == 'test_uuid'
+
+
+def test_tag_release_prefetched(mocker, auth):
+    hits = {
+        'rel': {'uuid': 'rel', 'properties': {'update_items': [{'primary_id': 'set1'}, {'primary_id': 'bs1'}]},
+                'embedded': {'@type': ['DataReleaseUpdate', 'Item']}},
+        'set1': {'uuid': 'set1', 'properties': {'status': 'released', 'experiments_in_set': ['exp1']},
+                 'embedded': {'@type': ['ExperimentSetReplicate', 'ExperimentSet', 'Item']}},
+        'bs1': {'uuid': 'bs1', 'properties': {'status': 'released'}, 'embedded': {'@type': ['Biosample', 'Item']}},
+        'exp1': {'uuid': 'exp1', 'properties': {'status': 'released', 'files': ['f1', 'f2'], 'processed_files': ['pf1'],
+                 'tags': ['test_tag']}, 'embedded': {'@type': ['ExperimentHiC', 'Experiment', 'Item']}},
+        'f1': {'uuid': 'f1', 'properties': {'status': 'released'},
+               'embedded': {'@type': ['FileFastq', 'File', 'Item']}},
+        'f2': {'uuid': 'f2', 'properties': {'status': 'deleted'}, 'embedded': {'@type': ['FileFastq', 'File', 'Item']}},
+    }
+    mocker.patch('scripts.tag_release_freeze.scu.get_item_ids_from_args', return_value=['rel'])
+    mocker.patch('scripts.tag_release_freeze.scu.is_uuid', side_effect=lambda i: i in hits)
+    es = mocker.patch('scripts.tag_release_freeze.get_es_metadata',
+                      side_effect=lambda uuids, **kw: [hits[u] for u in uuids])
+    gm = mocker.patch('scripts.tag_release_freeze.get_metadata', return_value={
+        'uuid': 'pf1', 'status': 'released', '@type': ['FileProcessed', 'File', 'Item']})
+    pm = mocker.patch('scripts.tag_release_freeze.patch_metadata', return_value={'status': 'success'})
+    cnts = trf.tag_release_prefetched(auth, 'test_tag', dbupdate=True, workers=2)
+    assert es.call_count == 4
+    gm.assert_called_once_with('pf1', auth, add_on='frame=object')
+    assert sorted(c[0][1] for c in pm.call_args_list) == ['f1', 'pf1', 'set1']
+    assert cnts['patched'] == 3
+    # biosample is not a set, exp1 is already tagged and f2 is deleted
+    assert cnts['skipped'] == 3
+    assert cnts['FileFastq'] == 2
+
+
+def test_tag_release_prefetched_dry_run(mocker, auth):
+    mocker.patch('scripts.tag_release_freeze.plan_release_tags', return_value=[('u1', 'FileFastq', {'tags': ['t']})])
+    pm = mocker.patch('scripts.tag_release_freeze.patch_metadata')
+    cnts = trf.tag_release_prefetched(auth, 't')
+    assert not pm.called
+    assert cnts['not_patched'] == 1
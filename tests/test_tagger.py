@@ -18,3 +18,56 @@ def test_make_tag_patch_w_existing_tags():
     assert len(tags) == 2
     assert tag in tags
     assert 'my_tag' in tags
+
+
+def test_main_tags_with_bulk_lookups(mocker, auth):
+    import argparse
+    u1, u2, u3 = ['4fdb481a-fd98-4bf2-b2e2-9be1fd0b1bd%d' % i for i in range(1, 4)]
+    args = argparse.Namespace(key=None, env='data', input=[u1, u2, u3, 'lab:alias'], search=False, tag='test_tag',
+                              taglinked=False, types2exclude=None, dbupdate=True, journal=None, resume=False,
+                              stream=False)
+    mocker.patch('scripts.tagger.get_args', return_value=args)
+    mocker.patch('scripts.tagger.get_authentication_with_server', return_value=auth)
+    mocker.patch('scripts.tagger.scu.get_types_that_can_have_field', return_value=['Biosample', 'Lab'])
+    es = mocker.patch('functions.script_utils.get_es_metadata', return_value=[
+        {'uuid': u1, 'embedded': {'@type': ['Biosample', 'Item']}, 'properties': {'tags': ['old']}},
+        {'uuid': u2, 'embedded': {'@type': ['Biosample', 'Item']}, 'properties': {'tags': ['test_tag']}},
+        {'uuid': u3, 'embedded': {'@type': ['User', 'Item']}, 'properties': {}}])
+    gm = mocker.patch('functions.script_utils.get_metadata',
+                      return_value={'uuid': 'lab_uuid', '@type': ['Lab', 'Item']})
+    pm = mocker.patch('scripts.tagger.patch_metadata', return_value={'status': 'success'})
+    t.main()
+    assert es.call_count == 1
+    assert gm.call_count == 1
+    # u2 already has the tag and users are not taggable
+    assert sorted((c[0][1], c[0][0]['tags']) for c in pm.call_args_list) == [
+        (u1, ['old', 'test_tag']), ('lab:alias', ['test_tag'])]
+
+
+def test_main_patches_first_batch_before_reading_the_rest(mocker, auth):
+    import argparse
+    uuids = ['4fdb481a-fd98-4bf2-b2e2-9be1fd0b%04d' % i for i in range(5)]
+    args = argparse.Namespace(key=None, env='data', input=['type=Biosample'], search=True, tag='test_tag',
+                              taglinked=False, types2exclude=None, dbupdate=True, journal=None, resume=False,
+                              stream=True)
+    events = []
+
+    def search(query, key, is_generator=False):
+        for uid in uuids:
+            events.append(('read', uid))
+            yield {'uuid': uid}
+
+    def es(uuids, sources=None, chunk_size=200, key=None, is_generator=False):
+        return [{'uuid': u, 'embedded': {'@type': ['Biosample', 'Item']}, 'properties': {}} for u in uuids]
+
+    mocker.patch('scripts.tagger.get_args', return_value=args)
+    mocker.patch('scripts.tagger.get_authentication_with_server', return_value=auth)
+    mocker.patch('scripts.tagger.BATCH_SIZE', 2)
+    mocker.patch('scripts.tagger.scu.get_types_that_can_have_field', return_value=['Biosample'])
+    mocker.patch('functions.script_utils.search_metadata', side_effect=search)
+    mocker.patch('functions.script_utils.get_es_metadata', side_effect=es)
+    mocker.patch('scripts.tagger.patch_metadata',
+                 side_effect=lambda patch, uid, key: events.append(('patch', uid)) or {'status': 'success'})
+    t.main()
+    assert sorted(uid for kind, uid in events if kind == 'patch') == uuids
+    assert events.index(('patch', uuids[0])) < events.index(('read', uuids[4]))